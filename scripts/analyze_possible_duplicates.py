@@ -1,14 +1,17 @@
 #!/usr/bin/env python
-import argparse, logging, os
+import argparse, logging
 from collections import namedtuple
+from functools import partial
+from itertools import chain, islice
 from urllib.parse import urlsplit
 
 from datasketch import MinHashLSH
 from scrapy.utils.url import canonicalize_url
 from maybedont import DupePredictor
-from maybedont.utils import get_too_common_shingles, get_min_hash
 
-from scripts.utils import item_reader, get_too_common_shingles
+from scripts.minhash import StreamingTooCommonShingles, with_min_hashes
+from scripts.utils import item_reader, map_crawl_outputs, \
+    peek_too_common_shingles
 
 
 def main():
@@ -18,30 +21,35 @@ def main():
     parser.add_argument(
         '--action', choices=['analyze_file', 'learn_duplicates'],
         default='analyze_file')
+    parser.add_argument(
+        '--streaming-shingles', action='store_true',
+        help='find too common shingles approximately over all items, '
+             'instead of using the first 300 items (for analyze_file)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of files to process in parallel')
     args = parser.parse_args()
-    fn = globals()[args.action]
+    fn = partial(globals()[args.action], verbose=args.verbose)
+    if args.action == 'analyze_file':
+        fn = partial(fn, streaming_shingles=args.streaming_shingles)
 
     if args.action == 'analyze_file':
         print('site'.ljust(40), '\t'.join(['urls', 'set(u)', 'pth', 'uniq']))
-    if os.path.isdir(args.crawler_out):
-        for filename in os.listdir(args.crawler_out):
-            if any(filename.endswith(ext) for ext in ['.json', '.jl']):
-                with open(os.path.join(args.crawler_out, filename)) as f:
-                    fn(filename, f, verbose=args.verbose)
-    else:
-        with open(args.crawler_out) as f:
-            fn(os.path.basename(args.crawler_out), f, verbose=args.verbose)
+    for _ in map_crawl_outputs(fn, args.crawler_out, jobs=args.jobs):
+        pass
 
 
-def analyze_file(name, f, verbose=False):
+def analyze_file(name, path, verbose=False, streaming_shingles=False):
     urls = []
     Doc = namedtuple('Doc', ['item', 'min_hash'])
     documents = {} # key -> Doc
     lsh = MinHashLSH(threshold=0.9, num_perm=128)
-    too_common = get_too_common_shingles(f, name, limit=300)
-    for i, item in enumerate(item_reader(f, name)):
+    items = item_reader(path, name)
+    if streaming_shingles:
+        too_common = StreamingTooCommonShingles()
+    else:
+        too_common, items = peek_too_common_shingles(items, limit=300)
+    for i, (item, min_hash) in enumerate(with_min_hashes(items, too_common)):
         urls.append(item['url'])
-        min_hash = get_min_hash(item['extracted_text'], too_common)
         key = 'item_{}'.format(i)
         item = {'url': item['url']}
         documents[key] = Doc(item, min_hash)
@@ -81,11 +89,12 @@ def n_unique(documents, duplicates):
     return len(unique)
 
 
-def learn_duplicates(name, f, verbose=False):
+def learn_duplicates(name, path, verbose=False):
     print(name)
     logging.basicConfig(level=logging.DEBUG)
-    texts_sample = [
-        item['extracted_text'] for item in item_reader(f, name, limit=300)]
+    items = item_reader(path, name)
+    sample = list(islice(items, 300))
+    texts_sample = [item['extracted_text'] for item in sample]
     dupe_predictor = DupePredictor(texts_sample)
 
     lsh = MinHashLSH(threshold=0.9, num_perm=128)  # separate from dupe_predictor
@@ -101,10 +110,10 @@ def learn_duplicates(name, f, verbose=False):
                 '(%d duplicates)' % (
             tp / (tp + fp) if tp else 0.,
             tp / n_dup if n_dup else 0., threshold, n_dup))
-    for i, item in enumerate(item_reader(f, name)):
+    items = with_min_hashes(chain(sample, items), too_common_shingles)
+    for i, (item, min_hash) in enumerate(items):
         dupe_prob = dupe_predictor.get_dupe_prob(item['url'])
         y_pred.append(dupe_prob)
-        min_hash = get_min_hash(item['extracted_text'], too_common_shingles)
         if dupe_prob < threshold:
             duplicates = [url for url, _ in dupe_predictor.update_model(
                 item['url'], item['extracted_text'])]
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+""" Measure startup cost: time to import crawler modules in a fresh
+interpreter, which heavy modules they pull in, and time to load models
+on first use.
+"""
+import argparse, json, statistics, subprocess, sys
+
+
+MODULES = ['undercrawler.spiders', 'undercrawler.settings',
+           'undercrawler.dupe_filter', 'undercrawler.middleware',
+           'undercrawler.export_pipeline', 'undercrawler.media_pipeline',
+           'undercrawler.near_dupe_pipeline',
+           'undercrawler.raw_content_pipeline', 'undercrawler.metrics']
+HEAVY_MODULES = ['formasaurus', 'autopager', 'sklearn', 'sklearn_crfsuite',
+                 'datasketch', 'numpy', 'lxml', 'boto3', 'botocore']
+FIRST_USE = {
+    'formasaurus': "import formasaurus; "
+                   "formasaurus.extract_forms('<form></form>')",
+    'autopager': "import autopager; "
+                 "autopager.urls('<a href=\"/page/2\">2</a>')",
+}
+
+TIMING_CODE = '''
+import json, sys, time
+t0 = time.perf_counter()
+{code}
+print(json.dumps({{
+    "seconds": time.perf_counter() - t0,
+    "heavy_modules": [m for m in {heavy!r} if m in sys.modules],
+}}))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    arg = parser.add_argument
+    arg('modules', nargs='*', help='modules to import (default: {})'
+        .format(' '.join(MODULES)))
+    arg('--repeat', type=int, default=5, help='runs for each measurement')
+    arg('--scrapy-list', action='store_true',
+        help='also measure "scrapy list" run time')
+    arg('--output', help='save results to this JSON file')
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.modules or MODULES:
+        results['import ' + module] = measure(
+            'import {}'.format(module), args.repeat)
+    for name, code in sorted(FIRST_USE.items()):
+        results['first use: ' + name] = measure(code, args.repeat)
+    if args.scrapy_list:
+        results['scrapy list'] = measure(
+            'from scrapy.cmdline import execute\n'
+            'try:\n'
+            '    execute(["scrapy", "list"])\n'
+            'except SystemExit:\n'
+            '    pass', args.repeat)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'wt') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+def measure(code, repeat):
+    """ Run code in fresh interpreters, returning timing summary
+    and heavy modules loaded.
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-W', 'ignore', '-c',
+             TIMING_CODE.format(code=code, heavy=HEAVY_MODULES)],
+            stderr=subprocess.DEVNULL)
+        runs.append(json.loads(output.decode('utf8').strip().splitlines()[-1]))
+    times = [run['seconds'] for run in runs]
+    return {
+        'median_s': statistics.median(times),
+        'min_s': min(times),
+        'heavy_modules': runs[-1]['heavy_modules'],
+    }
+
+
+def print_results(results):
+    print('{:<40}{:>10}{:>10}  {}'.format(
+        '', 'median s', 'min s', 'heavy modules loaded'))
+    for name, r in results.items():
+        print('{:<40}{:>10.3f}{:>10.3f}  {}'.format(
+            name, r['median_s'], r['min_s'],
+            ', '.join(r['heavy_modules']) or '-'))
+
+
+if __name__ == '__main__':
+    main()
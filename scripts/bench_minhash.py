@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+import argparse, time
+
+from maybedont.utils import get_min_hash, get_too_common_shingles
+import numpy as np
+
+from scripts.minhash import BatchMinHasher
+from scripts.utils import crawl_outputs, item_reader
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare batch MinHash computation with maybedont')
+    arg = parser.add_argument
+    arg('crawler_out')
+    arg('--limit', type=int, default=2000, help='max number of items')
+    arg('--batch-size', type=int, default=500)
+    arg('--num-perm', type=int, default=128)
+    args = parser.parse_args()
+
+    texts = []
+    for name, path in crawl_outputs(args.crawler_out):
+        items = item_reader(path, name=name, progress=False,
+                            limit=args.limit - len(texts))
+        texts.extend(item['extracted_text'] for item in items
+                     if 'extracted_text' in item)
+        if len(texts) >= args.limit:
+            break
+    too_common = get_too_common_shingles(texts[:1000])
+    print('{} texts, {} too common shingles'.format(
+        len(texts), len(too_common)))
+
+    t0 = time.perf_counter()
+    expected = [get_min_hash(text, too_common, num_perm=args.num_perm)
+                for text in texts]
+    t_single = time.perf_counter() - t0
+
+    hasher = BatchMinHasher(num_perm=args.num_perm)
+    t0 = time.perf_counter()
+    min_hashes = []
+    for start in range(0, len(texts), args.batch_size):
+        min_hashes.extend(hasher.min_hashes(
+            texts[start:start + args.batch_size], too_common))
+    t_batch = time.perf_counter() - t0
+
+    assert all(np.array_equal(a.hashvalues, b.hashvalues)
+               for a, b in zip(expected, min_hashes)), \
+        'batch signatures differ from get_min_hash'
+    for label, t in [('get_min_hash', t_single), ('batch', t_batch)]:
+        print('{:<15} {:.2f} s, {:.0f} docs/s'.format(
+            label, t, len(texts) / t if t else 0))
+    print('speedup: {:.1f}x'.format(t_single / t_batch if t_batch else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+""" Replay stored pages from crawler output through BaseSpider.parse
+(without network), reporting pages/sec, time of each parse stage
+and peak memory.
+"""
+import argparse, json, platform, time, tracemalloc
+from collections import defaultdict
+
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+from scrapy_splash import SplashJsonResponse
+
+import undercrawler.settings
+from undercrawler.crazy_form_submitter import search_form_requests
+from undercrawler.dupe_filter import DupeFilter
+from undercrawler.spiders import BaseSpider, extract_forms, get_js_links
+from undercrawler.utils import max_rss_bytes
+from scripts.utils import RawContentReader, crawl_outputs, item_reader
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    arg = parser.add_argument
+    arg('crawler_out', help='crawler output with raw_content of pages')
+    arg('--limit', type=int, help='max number of pages')
+    arg('--repeat', type=int, default=1, help='replay the corpus N times')
+    arg('--splash', action='store_true',
+        help='replay pages as Splash responses')
+    arg('--raw-content-store',
+        help='RAW_CONTENT_STORE used during the crawl, if any')
+    arg('--tracemalloc', action='store_true',
+        help='trace peak Python memory during parse (slower)')
+    arg('-s', '--set', action='append', default=[], metavar='NAME=VALUE',
+        help='override crawler settings')
+    arg('--output', help='save results to this JSON file')
+    arg('--compare', help='compare with results saved with --output')
+    args = parser.parse_args()
+
+    pages = load_pages(args.crawler_out, limit=args.limit,
+                       raw_content_store=args.raw_content_store)
+    if not pages:
+        parser.error('No pages with raw content found')
+    overrides = dict(s.split('=', 1) for s in args.set)
+    result = run_benchmark(pages, splash=args.splash, repeat=args.repeat,
+                           trace_memory=args.tracemalloc, settings=overrides)
+    result['meta']['corpus'] = args.crawler_out
+    print_result(result)
+    if args.compare:
+        with open(args.compare, 'rt') as f:
+            print_comparison(json.load(f), result)
+    if args.output:
+        with open(args.output, 'wt') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+
+def load_pages(crawler_out, limit=None, raw_content_store=None):
+    """ Return a list of (url, html) for pages in crawler output.
+    """
+    read_raw_content = (RawContentReader(raw_content_store)
+                        if raw_content_store else None)
+    pages = []
+    for name, path in crawl_outputs(crawler_out):
+        for item in item_reader(path, name=name, progress=False):
+            if 'raw_content' in item:
+                html = item['raw_content']
+            elif read_raw_content is not None and \
+                    'raw_content_hash' in item.get('metadata', {}):
+                html = read_raw_content(item)
+            else:
+                continue
+            pages.append((item['url'], html))
+            if limit and len(pages) >= limit:
+                return pages
+    return pages
+
+
+def make_spider(pages, splash=False, settings=None):
+    s = Settings()
+    s.setmodule(undercrawler.settings)
+    s.update({'AUTOLOGIN_ENABLED': False, 'SCREENSHOT': False})
+    if not splash:
+        s['SPLASH_URL'] = None
+    s.update(settings or {})
+    crawler = get_crawler(BaseSpider, s.copy_to_dict())
+    spider = BaseSpider.from_crawler(crawler, url=pages[0][0])
+    spider.use_splash = splash
+    # The same as BaseSpider.parse_first does for start urls
+    hard_url_constraint = crawler.settings.getbool('HARD_URL_CONSTRAINT')
+    for url, _ in pages:
+        spider.allowed.add(url, hard_url_constraint)
+    return spider
+
+
+def make_response(spider, url, html):
+    request = spider.make_request(url, meta={'depth': 1})
+    if spider.use_splash:
+        return SplashJsonResponse(
+            'http://127.0.0.1:8050/execute', request=request,
+            headers={'Content-Type': 'application/json'},
+            body=json.dumps({
+                'url': url,
+                'html': html,
+                'http_status': 200,
+                'headers': [{'name': 'Content-Type',
+                             'value': 'text/html; charset=utf-8'}],
+            }).encode('utf8'))
+    return HtmlResponse(url, body=html.encode('utf8'), encoding='utf8',
+                        request=request)
+
+
+class Timings:
+    def __init__(self):
+        self.times = defaultdict(list)
+
+    def measure(self, stage, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.times[stage].append(time.perf_counter() - t0)
+        return result
+
+    def summary(self):
+        return {stage: _summary(times) for stage, times in self.times.items()}
+
+
+def _summary(times):
+    times = sorted(times)
+    return {
+        'count': len(times),
+        'total_s': sum(times),
+        'mean_ms': 1000 * sum(times) / len(times),
+        'p50_ms': 1000 * times[len(times) // 2],
+        'p95_ms': 1000 * times[min(len(times) - 1, int(len(times) * 0.95))],
+    }
+
+
+def run_benchmark(pages, splash=False, repeat=1, trace_memory=False,
+                  settings=None):
+    spider = make_spider(pages, splash=splash, settings=settings)
+    # Load models before timing
+    extract_forms('<form></form>')
+    spider._pagination_urls(make_response(spider, *pages[0]))
+    timings = Timings()
+
+    # Full parse, as done during the crawl
+    dupe_filter = DupeFilter.from_crawler(spider.crawler)
+    url_cache = spider.url_cache
+    n_requests = n_unique = 0
+    cache_hits, cache_misses = url_cache.hits, url_cache.misses
+    if trace_memory:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        spider.state.pop('handled_search_forms', None)
+        for url, html in pages:
+            response = make_response(spider, url, html)
+            results = timings.measure('parse', list, spider.parse(response))
+            for request in results:
+                if hasattr(request, 'dont_filter'):
+                    n_requests += 1
+                    n_unique += not timings.measure(
+                        'dupefilter', dupe_filter.request_seen, request)
+    parse_time = time.perf_counter() - t0
+    cache_hits = url_cache.hits - cache_hits
+    cache_misses = url_cache.misses - cache_misses
+    traced_peak = None
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    # Separate stages of parse, on fresh responses
+    for _ in range(repeat):
+        for url, html in pages:
+            run_stages(spider, make_response(spider, url, html), timings)
+
+    n_pages = len(pages) * repeat
+    return {
+        'meta': {
+            'pages': n_pages,
+            'splash': splash,
+            'python': platform.python_version(),
+            'settings': settings or {},
+        },
+        'pages_per_sec': n_pages / parse_time,
+        'requests': n_requests,
+        'unique_requests': n_unique,
+        'stages': timings.summary(),
+        'url_cache': {
+            'size': url_cache.maxsize,
+            'hits': cache_hits,
+            'misses': cache_misses,
+        },
+        'memory': {
+            'max_rss_mb': max_rss_bytes() / 2**20,
+            'tracemalloc_peak_mb':
+                traced_peak / 2**20 if traced_peak is not None else None,
+        },
+    }
+
+
+def run_stages(spider, response, timings):
+    """ Run the main stages of BaseSpider.parse separately.
+    """
+    timings.measure('selector', lambda: response.selector)
+    forms = timings.measure(
+        'forms', extract_forms, response.text)
+    links = timings.measure(
+        'links', spider.link_extractor.extract_links, response)
+    timings.measure('pagination', spider._pagination_urls, response)
+    timings.measure('onclick', get_js_links, response)
+    timings.measure(
+        'iframes', spider.iframe_link_extractor.extract_links, response)
+    search_enabled = spider.settings.getbool('CRAZY_SEARCH_ENABLED')
+    for form, meta in forms:
+        if search_enabled and meta['form'] == 'search':
+            timings.measure('search_forms', list, search_form_requests(
+                response.url, form, meta,
+                search_terms=spider.search_terms,
+                extra_search_terms=spider.extra_search_terms))
+    timings.measure(
+        'item', spider.text_cdr_item, response,
+        follow_urls={link.url for link in links},
+        metadata={'forms': [meta for _, meta in forms]})
+
+
+def print_result(result):
+    print('{pages} pages, {pps:.1f} pages/sec, {requests} requests '
+          '({unique} unique)'.format(
+              pages=result['meta']['pages'], pps=result['pages_per_sec'],
+              requests=result['requests'], unique=result['unique_requests']))
+    print('{:<15}{:>8}{:>12}{:>12}{:>12}'.format(
+        'stage', 'count', 'mean ms', 'p50 ms', 'p95 ms'))
+    for stage, s in sorted(result['stages'].items()):
+        print('{:<15}{:>8}{:>12.3f}{:>12.3f}{:>12.3f}'.format(
+            stage, s['count'], s['mean_ms'], s['p50_ms'], s['p95_ms']))
+    cache = result['url_cache']
+    lookups = cache['hits'] + cache['misses']
+    if lookups:
+        print('url cache: {} lookups, {:.1%} hits'.format(
+            lookups, cache['hits'] / lookups))
+    memory = result['memory']
+    print('max RSS: {:.1f} MB'.format(memory['max_rss_mb']))
+    if memory['tracemalloc_peak_mb'] is not None:
+        print('tracemalloc peak: {:.1f} MB'.format(
+            memory['tracemalloc_peak_mb']))
+
+
+def print_comparison(baseline, result):
+    print()
+    print('Compared to baseline ({} pages):'.format(
+        baseline['meta']['pages']))
+    print('{:<15}{:>12}{:>12}{:>10}'.format(
+        '', 'baseline', 'current', 'change'))
+    rows = [('pages/sec', baseline['pages_per_sec'], result['pages_per_sec'])]
+    for stage, s in sorted(result['stages'].items()):
+        if stage in baseline['stages']:
+            rows.append(('{} ms'.format(stage),
+                         baseline['stages'][stage]['mean_ms'], s['mean_ms']))
+    rows.append(('max RSS MB', baseline['memory']['max_rss_mb'],
+                 result['memory']['max_rss_mb']))
+    for label, old, new in rows:
+        change = '{:+.1f}%'.format(100 * (new - old) / old) if old else '-'
+        print('{:<15}{:>12.3f}{:>12.3f}{:>10}'.format(label, old, new, change))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,56 +1,80 @@
 #!/usr/bin/env python
 import argparse, json, os
 from collections import Counter
+from functools import partial
 
 from datasketch import MinHashLSH
-from maybedont.utils import get_min_hash
 
-from scripts.utils import item_reader, get_too_common_shingles
+from undercrawler.item_index import METADATA_MAX_INT_VALUE, ItemIndex, \
+    index_path, item_metadata, metadata_keys, open_output
+from scripts.minhash import StreamingTooCommonShingles, with_min_hashes
+from scripts.utils import item_reader, map_crawl_outputs, \
+    peek_too_common_shingles
 
 
 def main():
     parser = argparse.ArgumentParser()
     arg = parser.add_argument
     arg('crawler_out')
-    arg('--show', help='show urls for given key')
+    arg('--show', help='show urls for given key (only this is done '
+                       'if the file has a sidecar index)')
     arg('--skip-unique', action='store_true', help='skip unique check')
+    arg('--streaming-shingles', action='store_true',
+        help='find too common shingles approximately over all items, '
+             'instead of using the first 1000 items')
     arg('--duration-limit', type=int, help='in seconds')
     arg('--print-duplicates', action='store_true')
     arg('--print-urls', action='store_true')
     arg('--limit', type=int)
-    arg('--max-int-value', type=int, default=5)
+    arg('--max-int-value', type=int, default=METADATA_MAX_INT_VALUE)
     arg('--output', help='additional output in JSON')
+    arg('--jobs', type=int, default=1,
+        help='number of files to process in parallel')
     args = parser.parse_args()
 
     params = vars(args)
     crawler_out = params.pop('crawler_out')
     output = params.pop('output')
+    jobs = params.pop('jobs')
     stats = {}
-    if os.path.isdir(crawler_out):
-        for filename in os.listdir(crawler_out):
-            if filename.endswith('.json') or filename.endswith('.jl'):
-                with open(os.path.join(crawler_out, filename)) as f:
-                    print()
-                    print(filename)
-                    stats[filename] = print_stats(f, **params)
-    else:
-        with open(crawler_out) as f:
-            stats[os.path.basename(crawler_out)] = print_stats(f, **params)
+    fn = partial(_print_file_stats,
+                 print_name=os.path.isdir(crawler_out), **params)
+    for name, file_stats in map_crawl_outputs(fn, crawler_out, jobs=jobs):
+        stats[name] = file_stats
     if output:
         with open(output, 'w') as f:
             json.dump(stats, f, ensure_ascii=False, indent=4, sort_keys=True)
 
 
+def _print_file_stats(name, path, print_name=False, **params):
+    if print_name:
+        print()
+        print(name)
+    return print_stats(path, name=name, **params)
+
+
 def print_stats(
-        f, show=None, skip_unique=False, max_int_value=5, duration_limit=None,
-        print_duplicates=False, print_urls=False, limit=None):
+        path, show=None, skip_unique=False,
+        max_int_value=METADATA_MAX_INT_VALUE,
+        duration_limit=None, print_duplicates=False, print_urls=False,
+        limit=None, name=None, streaming_shingles=False):
+    if (show and max_int_value == METADATA_MAX_INT_VALUE and
+            os.path.exists(index_path(path))):
+        return show_indexed(path, show, duration_limit, limit)
     stats = Counter()
+    items = item_reader(path, name=name, limit=limit)
     if not skip_unique:
         lsh = MinHashLSH(threshold=0.9, num_perm=128)
-        too_common = get_too_common_shingles(f, limit=1000)
+        if streaming_shingles:
+            too_common = StreamingTooCommonShingles()
+        else:
+            too_common, items = peek_too_common_shingles(items, limit=1000)
+        items = with_min_hashes(items, too_common)
+    else:
+        items = ((item, None) for item in items)
     urls = {}
     min_timestamp = max_timestamp = None
-    for i, item in enumerate(item_reader(f, limit=limit)):
+    for i, (item, min_hash) in enumerate(items):
         if print_urls:
             print(item['url'])
         content_type = item.get('content_type', 'missing')
@@ -68,24 +92,11 @@ def print_stats(
             stats.update(['documents'])
             continue
         stats.update(['items'])
-        for key, value in item['extracted_metadata'].items():
-            if key == 'forms':
-                for form in value:
-                    stats.update(['form_{}'.format(form['form'])])
-                    stats.update(['form_field {}'.format(f)
-                                  for f in form['fields'].values()])
-            if isinstance(value, list):
-                value = len(value)
-            if isinstance(value, int) and not isinstance(value, bool):
-                if value >= max_int_value:
-                    value = '{}+'.format(max_int_value)
-                key = '{}_{}'.format(key, value)
-            if value:
-                stats.update([key])
-                if key == show:
-                    print(item['url'])
+        keys = metadata_keys(item_metadata(item), max_int_value)
+        stats.update(keys)
+        if show in keys:
+            print(item['url'])
         if not skip_unique:
-            min_hash = get_min_hash(item['extracted_text'], too_common)
             duplicates = lsh.query(min_hash)
             if not duplicates:
                 stats.update(['unique_items'])
@@ -104,5 +115,27 @@ def print_stats(
     return stats
 
 
+def show_indexed(path, show, duration_limit=None, limit=None):
+    """ Print urls of items with show key, decoding only candidate items
+    found with the sidecar index.
+    """
+    index = ItemIndex.load(index_path(path))
+    n_items = len(index)
+    if duration_limit:
+        n_items = index.time_limit(duration_limit)
+    if limit is not None:
+        n_items = min(n_items, limit)
+    n_shown = 0
+    with open_output(path) as f:
+        for ordinal in index.with_metadata_key(show):
+            if ordinal >= n_items:
+                break
+            item = index.read_item(f, ordinal)
+            if show in metadata_keys(item_metadata(item)):
+                print(item['url'])
+                n_shown += 1
+    return Counter({show: n_shown})
+
+
 if __name__ == '__main__':
     main()
@@ -10,20 +10,39 @@ directory = {root}
 stopsignal = INT
 stopwaitsecs = 360
 autostart = false
-command = {scrapy} crawl undercrawler -a url={url} -s LOG_FILE={log} -o {out} -s JOBDIR={job} {extra}
+command = {scrapy} crawl undercrawler -a url={url} -s LOG_FILE={log} {out} -s JOBDIR={job} {extra}
+log_stderr = true
+'''
+
+model_server_tpl = '''\
+[program:model_server]
+user = {user}
+environment = LANG="en_US.UTF-8", USER="{user}"
+directory = {root}
+autostart = true
+command = {python} -m undercrawler.model_server {socket} --workers {workers}
 log_stderr = true
 '''
 
 
 def main():
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(allow_abbrev=False)
     parser.add_argument('urls')
     parser.add_argument('config_out_dir')
     parser.add_argument('data_out_dir')
-    sys_args = sys.argv[1:]
-    n_args = 3
-    args = parser.parse_args(args=sys_args[:n_args])
-    other_args = ' '.join(sys_args[n_args:])
+    parser.add_argument(
+        '--compressed-export', action='store_true',
+        help='export to a folder with compressed rotated files '
+             '(EXPORT_DIR setting) instead of a single .jl file')
+    parser.add_argument(
+        '--model-server-workers', type=int,
+        help='generate a config for a model server with this number of '
+             'workers, shared by all crawlers (MODEL_SERVER_SOCKET setting)')
+    # All other arguments are passed to "scrapy crawl"
+    args, other_args = parser.parse_known_args()
+    other_args = ' '.join(other_args)
+    user = pwd.getpwuid(os.getuid()).pw_name
+    root = os.path.abspath(os.path.dirname(__file__))
 
     dirs = [os.path.join(args.data_out_dir, name)
             for name in ['log', 'out', 'job']]
@@ -33,6 +52,17 @@ def main():
     with open(args.urls) as f:
         urls = [_normalize_url(line) for line in f]
 
+    if args.model_server_workers:
+        socket = os.path.abspath(
+            os.path.join(args.data_out_dir, 'model_server.sock'))
+        with open(os.path.join(args.config_out_dir, 'model_server.conf'),
+                  'w') as f:
+            f.write(model_server_tpl.format(
+                user=user, root=os.path.dirname(root),
+                python=sys.executable, socket=socket,
+                workers=args.model_server_workers))
+        other_args = '-s MODEL_SERVER_SOCKET={} {}'.format(socket, other_args)
+
     names = set()
     for url in urls:
         name = _unique_name(url, names)
@@ -41,15 +71,19 @@ def main():
 
         with open(os.path.join(args.config_out_dir, name + '.conf'), 'w') as f:
             dout = lambda d, x: os.path.join(args.data_out_dir, d, x)
+            if args.compressed_export:
+                out = '-s EXPORT_DIR={}'.format(dout('out', name))
+            else:
+                out = '-o {}'.format(dout('out', name + '.jl'))
             f.write(tpl.format(
                 name=name,
-                user=pwd.getpwuid(os.getuid()).pw_name,
-                root=os.path.abspath(os.path.dirname(__file__)),
+                user=user,
+                root=root,
                 scrapy=subprocess.check_output(
                     ['which', 'scrapy']).strip().decode('utf-8'),
                 url=url,
                 log=dout('log', name + '.log'),
-                out=dout('out', name + '.jl'),
+                out=out,
                 job=dout('job', name),
                 extra=other_args,
                 ))
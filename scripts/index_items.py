@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+import argparse, os, sys
+
+from undercrawler.item_index import ItemIndex, build_index, index_path, \
+    open_output
+from scripts.utils import crawl_outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Build sidecar indexes for crawler output, '
+                    'or find items by url using them')
+    parser.add_argument('crawler_out')
+    parser.add_argument('--url', action='append',
+                        help='print items with this url (can be repeated)')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='rebuild existing indexes')
+    args = parser.parse_args()
+
+    for name, path in crawl_outputs(args.crawler_out):
+        if args.rebuild or not os.path.exists(index_path(path)):
+            print('{}: indexed {} items'.format(name, build_index(path)),
+                  file=sys.stderr)
+        if args.url:
+            print_items(path, args.url)
+
+
+def print_items(path, urls):
+    index = ItemIndex.load(index_path(path))
+    ordinals = sorted({i for url in urls for i in index.find_url(url)})
+    if ordinals:
+        with open_output(path) as f:
+            for ordinal in ordinals:
+                print(index.read_raw(f, ordinal).decode('utf8'))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 import argparse, json, os
 
-from scripts.utils import item_reader
+from undercrawler.item_index import ItemIndex, index_path, open_output
+from scripts.utils import is_crawl_output, item_reader
 
 
 def main():
@@ -13,6 +14,8 @@ def main():
 
     if os.path.isdir(args.cralwer_out):
         for filename in os.listdir(args.cralwer_out):
+            if not is_crawl_output(filename):
+                continue
             print(filename)
             limit_results(
                 os.path.join(args.cralwer_out, filename),
@@ -23,22 +26,40 @@ def main():
 
 
 def limit_results(in_filename, out_filename, seconds):
-    with open(in_filename) as in_f:
-        with open(out_filename, 'w') as out_f:
-            out_f.write('[')
-            start_timestamp = None
-            n_items = 0
-            for item in item_reader(in_f, skip_limit=True):
-                if start_timestamp is None:
-                    start_timestamp = item['timestamp']
-                if item['timestamp'] - start_timestamp > seconds * 1000:
-                    break
-                if n_items != 0:
-                    out_f.write(',\n')
-                out_f.write(json.dumps(item))
-                n_items += 1
-            print(n_items)
-            out_f.write(']\n')
+    if os.path.exists(index_path(in_filename)):
+        limit_results_indexed(in_filename, out_filename, seconds)
+        return
+    with open(out_filename, 'w') as out_f:
+        out_f.write('[')
+        start_timestamp = None
+        n_items = 0
+        for item in item_reader(in_filename, progress=False):
+            if start_timestamp is None:
+                start_timestamp = item['timestamp']
+            if item['timestamp'] - start_timestamp > seconds * 1000:
+                break
+            if n_items != 0:
+                out_f.write(',\n')
+            out_f.write(json.dumps(item))
+            n_items += 1
+        print(n_items)
+        out_f.write(']\n')
+
+
+def limit_results_indexed(in_filename, out_filename, seconds):
+    """ Find where to stop with binary search on the sidecar index,
+    and copy items without decoding them.
+    """
+    index = ItemIndex.load(index_path(in_filename))
+    n_items = index.time_limit(seconds)
+    with open_output(in_filename) as in_f, open(out_filename, 'wb') as out_f:
+        out_f.write(b'[')
+        for ordinal in range(n_items):
+            if ordinal != 0:
+                out_f.write(b',\n')
+            out_f.write(index.read_raw(in_f, ordinal))
+        out_f.write(b']\n')
+    print(n_items)
 
 
 if __name__ == '__main__':
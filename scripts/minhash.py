@@ -0,0 +1,204 @@
+from itertools import islice
+import math
+
+from datasketch import MinHash
+import datasketch.minhash
+from maybedont.utils import shingle_hashes
+import numpy as np
+
+
+class BatchMinHasher:
+    """ Compute MinHash signatures for many documents at once.
+    Shingles are hashed in the same way as in ``maybedont.utils.get_min_hash``,
+    but permutations are applied to hashes of all documents in a batch
+    as one matrix operation. Signatures are equal to ones computed by
+    ``get_min_hash``, so they can be used with ``datasketch.MinHashLSH``
+    and mixed with MinHash objects computed in other ways.
+    """
+    def __init__(self, num_perm=128, seed=1, chunk_rows=2**15):
+        self.template = MinHash(num_perm=num_perm, seed=seed)
+        self.num_perm = num_perm
+        self.chunk_rows = chunk_rows
+        self.scheme = getattr(self.template, 'scheme', 'legacy')
+        self.dtype = self.template.hashvalues.dtype
+        self.hashfunc = self.template.hashfunc
+        a, b = self.template.permutations
+        self._a = np.asarray(a, dtype=self.dtype)
+        self._b = np.asarray(b, dtype=self.dtype)
+        self._empty = self.template.hashvalues.copy()
+
+    def shingle_hashes(self, text, too_common):
+        """ Return an array of shingle hashes of the text,
+        skipping too common shingles.
+        """
+        hashfunc = self.hashfunc
+        return np.fromiter(
+            (hashfunc(digest) for digest in
+             (h.digest() for h in shingle_hashes(text))
+             if digest not in too_common),
+            dtype=self.dtype)
+
+    def signatures(self, hash_arrays):
+        """ Return signatures of documents as a (n_docs, num_perm) array,
+        given an array of shingle hashes for each document.
+        """
+        signatures = np.tile(self._empty, (len(hash_arrays), 1))
+        lengths = np.array([len(hv) for hv in hash_arrays], dtype=np.int64)
+        if not lengths.sum():
+            return signatures
+        hv = np.concatenate(hash_arrays).astype(self.dtype, copy=False)
+        doc_ids = np.repeat(np.arange(len(hash_arrays)), lengths)
+        for start in range(0, len(hv), self.chunk_rows):
+            chunk_hv = hv[start:start + self.chunk_rows]
+            chunk_doc_ids = doc_ids[start:start + self.chunk_rows]
+            phv = self._permute(chunk_hv)
+            # Minimum over rows of each document in this chunk
+            doc_starts = np.flatnonzero(
+                np.r_[True, chunk_doc_ids[1:] != chunk_doc_ids[:-1]])
+            mins = np.minimum.reduceat(phv, doc_starts, axis=0)
+            # Documents can span several chunks
+            np.minimum.at(signatures, chunk_doc_ids[doc_starts], mins)
+        return signatures
+
+    def min_hashes(self, texts, too_common):
+        """ Return a list of MinHash objects for texts.
+        too_common is either a set of shingle digests, or
+        a StreamingTooCommonShingles instance: in this case it is updated
+        with texts before they are hashed.
+        """
+        if isinstance(too_common, StreamingTooCommonShingles):
+            hash_arrays = self._streaming_shingle_hashes(texts, too_common)
+        else:
+            hash_arrays = [self.shingle_hashes(text, too_common)
+                           for text in texts]
+        signatures = self.signatures(hash_arrays)
+        return [self.to_min_hash(signature) for signature in signatures]
+
+    def _streaming_shingle_hashes(self, texts, too_common):
+        digests = [list({h.digest() for h in shingle_hashes(text)})
+                   for text in texts]
+        keys = [shingle_keys(doc_digests) for doc_digests in digests]
+        too_common.update(keys)
+        hashfunc = self.hashfunc
+        return [
+            np.fromiter((hashfunc(digest) for digest, is_common
+                         in zip(doc_digests, too_common.contains(doc_keys))
+                         if not is_common), dtype=self.dtype)
+            for doc_digests, doc_keys in zip(digests, keys)]
+
+    def to_min_hash(self, signature):
+        min_hash = self.template.copy()
+        min_hash.hashvalues = signature
+        return min_hash
+
+    def _permute(self, hv):
+        """ Apply all permutations to hashes, the same way as
+        ``MinHash.update_batch`` does it for the hashing scheme in use.
+        """
+        hv = hv.reshape(-1, 1)
+        with np.errstate(over='ignore'):
+            if self.scheme == 'legacy':
+                phv = (hv * self._a + self._b) % \
+                    datasketch.minhash._mersenne_prime
+                return np.bitwise_and(phv, datasketch.minhash._max_hash)
+            width = datasketch.minhash._SCHEME_WIDTHS[self.scheme]
+            hv = datasketch.minhash._fmix(hv, width)
+            return hv * self._a + self._b
+
+
+class CountMinSketch:
+    """ Count-min sketch over uint64 keys, with counters in a
+    (depth, width) numpy array. Estimates are never below true counts,
+    and exceed them by at most ``error_bound()`` with probability
+    at least ``1 - exp(-depth)`` for each key.
+    """
+    def __init__(self, width=2**16, depth=4, seed=1):
+        if width & (width - 1):
+            raise ValueError('width must be a power of 2')
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.counts = np.zeros((depth, width), dtype=np.uint32)
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(0, 2**63, size=(depth, 1), dtype=np.uint64) \
+            * np.uint64(2) + np.uint64(1)
+        self._b = rng.randint(0, 2**63, size=(depth, 1), dtype=np.uint64)
+        self._shift = np.uint64(64 - int(math.log2(width)))
+
+    def update(self, keys):
+        """ Increment counts of keys by one (keys can repeat).
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        for row, idx in zip(self.counts, self._indices(keys)):
+            row += np.bincount(idx, minlength=self.width).astype(np.uint32)
+        self.total += len(keys)
+
+    def estimate(self, keys):
+        keys = np.asarray(keys, dtype=np.uint64)
+        indices = self._indices(keys)
+        return np.min([row[idx] for row, idx in zip(self.counts, indices)],
+                      axis=0) if len(keys) else np.zeros(0, dtype=np.uint32)
+
+    def error_bound(self):
+        return math.e / self.width * self.total
+
+    def _indices(self, keys):
+        # multiply-add-shift hashing, one hash function per row
+        with np.errstate(over='ignore'):
+            return ((keys * self._a + self._b) >> self._shift).astype(np.intp)
+
+
+class StreamingTooCommonShingles:
+    """ An approximate streaming version of
+    ``maybedont.utils.get_too_common_shingles`` with bounded memory:
+    shingles that occur in more than ``threshold`` fraction of documents
+    seen so far are too common. Document frequencies are counted with
+    a count-min sketch, so shingles can be wrongly considered too common
+    if their count is within ``sketch.error_bound()`` of the threshold,
+    but too common shingles are never missed.
+    """
+    def __init__(self, threshold=0.05, width=2**16, depth=4, seed=1):
+        self.threshold = threshold
+        self.sketch = CountMinSketch(width=width, depth=depth, seed=seed)
+        self.n_docs = 0
+
+    def update(self, doc_keys):
+        """ Add documents, given an array of unique shingle keys
+        for each document.
+        """
+        if doc_keys:
+            self.sketch.update(np.concatenate(doc_keys))
+        self.n_docs += len(doc_keys)
+
+    def contains(self, keys):
+        """ Return a boolean mask of too common shingle keys.
+        """
+        min_count = max(1, self.threshold * self.n_docs)
+        return self.sketch.estimate(keys) > min_count
+
+
+def shingle_keys(digests):
+    """ Return sketch keys (uint64) for shingle digests.
+    """
+    return np.frombuffer(b''.join(d[:8] for d in digests), dtype='<u8')
+
+
+def with_min_hashes(items, too_common, hasher=None, batch_size=500):
+    """ Yield (item, min_hash) pairs, computing MinHash of item text
+    in batches. min_hash is None for items without text (documents).
+    If too_common is a StreamingTooCommonShingles instance, it is updated
+    with each batch before the batch is hashed, so items are read only once.
+    """
+    hasher = hasher or BatchMinHasher()
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            break
+        with_text = [item for item in batch if 'extracted_text' in item]
+        min_hashes = dict(zip(
+            map(id, with_text),
+            hasher.min_hashes(
+                [item['extracted_text'] for item in with_text], too_common)))
+        for item in batch:
+            yield item, min_hashes.get(id(item))
@@ -1,31 +1,228 @@
+import contextlib
+from functools import partial
+import gzip
+import io
+from itertools import chain, islice
 import json
+import mmap
+import multiprocessing
+import os.path
+import signal
+from urllib.parse import urlsplit
 
 from tqdm import tqdm
 import maybedont.utils
 
+from undercrawler.export_pipeline import RotatingWriter
 
-def item_reader(f, name=None, limit=None, skip_limit=False):
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+CRAWL_OUTPUT_EXTENSIONS = ['.jl', '.json']
+COMPRESSION_EXTENSIONS = ['', '.gz', '.zst']
+
+
+def is_crawl_output(filename):
+    """
+    >>> is_crawl_output('out.jl')
+    True
+    >>> is_crawl_output('items-00001.jl.gz')
+    True
+    >>> is_crawl_output('manifest.json.tmp')
+    False
+    >>> is_crawl_output(RotatingWriter.manifest_name)
+    False
+    """
+    if filename == RotatingWriter.manifest_name:
+        return False
+    return any(filename.endswith(ext + compression_ext)
+               for ext in CRAWL_OUTPUT_EXTENSIONS
+               for compression_ext in COMPRESSION_EXTENSIONS)
+
+
+def crawl_outputs(crawler_out):
+    """ Return a list of (name, path) for crawler output, which can be
+    a single file or a folder with output files, sorted by name.
+    For an ``EXPORT_DIR`` with a manifest, only finished files listed
+    in the manifest are returned.
+    """
+    if os.path.isdir(crawler_out):
+        manifest_path = os.path.join(crawler_out, RotatingWriter.manifest_name)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'rt', encoding='utf8') as f:
+                names = [entry['name'] for entry in json.load(f)['files']]
+            return [(name, os.path.join(crawler_out, name))
+                    for name in sorted(names)]
+        return [(filename, os.path.join(crawler_out, filename))
+                for filename in sorted(os.listdir(crawler_out))
+                if is_crawl_output(filename)]
+    return [(os.path.basename(crawler_out), crawler_out)]
+
+
+def map_crawl_outputs(fn, crawler_out, jobs=1):
+    """ Call ``fn(name, path)`` for each file in crawler_out and yield
+    (name, result) pairs in the order of file names.
+    If jobs > 1, files are processed in a pool of ``jobs`` processes:
+    anything printed by fn is captured and printed in the same order
+    as the results are yielded, so the output does not depend on jobs.
+    """
+    outputs = crawl_outputs(crawler_out)
+    if jobs <= 1:
+        for name, path in outputs:
+            yield name, fn(name, path)
+        return
+    with multiprocessing.Pool(jobs, initializer=_reset_signals) as pool:
+        for name, (printed, result) in zip(
+                (name for name, _ in outputs),
+                pool.imap(partial(_call_captured, fn), outputs)):
+            print(printed, end='', flush=True)
+            yield name, result
+
+
+def _reset_signals():
+    # Forked workers can inherit handlers installed by twisted,
+    # and then do not exit on Pool.terminate()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+
+def _call_captured(fn, output):
+    name, path = output
+    printed = io.StringIO()
+    with contextlib.redirect_stdout(printed):
+        result = fn(name, path)
+    return printed.getvalue(), result
+
+
+def item_reader(path, name=None, limit=None, progress=True, batch_size=1000):
+    """ Read items from crawler output at path: JSON lines or JSON array
+    with one item per line, optionally compressed with gzip (".gz")
+    or zstd (".zst"). The file is read only once, memory-mapped if it is
+    not compressed, and progress is reported in bytes read.
+    Items are decoded in batches with orjson if it is installed.
+    """
+    items = _read_items(path, name, progress, batch_size)
+    if limit is not None:
+        items = islice(items, limit)
+    return items
+
+
+def _read_items(path, name, progress, batch_size):
     n_skips = 0
-    f.seek(0)
-    if limit is None or skip_limit:
-        limit = sum(1 for _ in f)
-        f.seek(0)
-    it = enumerate(f)
-    if not skip_limit:
-        it = tqdm(it, total=limit)
-    for i, line in it:
-        if i > limit:
+    with _open_lines(path) as (lines, size, get_position):
+        with tqdm(total=size, unit='B', unit_scale=True,
+                  desc=name, disable=not progress) as pbar:
+            position = 0
+            for batch in _batches(lines, batch_size):
+                for item in _decode_batch(batch):
+                    if item is None:
+                        n_skips += 1
+                    else:
+                        yield item
+                new_position = get_position()
+                pbar.update(new_position - position)
+                position = new_position
+    assert n_skips <= 1, (n_skips, name or path)
+
+
+def _batches(lines, batch_size):
+    while True:
+        batch = list(islice(lines, batch_size))
+        if not batch:
+            break
+        yield batch
+
+
+def _decode_batch(lines):
+    r"""
+    >>> list(_decode_batch([b'[{"a": 1},\n', b'{"b": [2]}\n', b']\n', b'{"c']))
+    [{'a': 1}, {'b': [2]}, None]
+    """
+    for line in lines:
+        line = line.strip(b'[],\r\n')
+        if not line:
             continue
         try:
-            item = json.loads(line.strip('[],\n'))
+            if orjson is not None:
+                yield orjson.loads(line)
+            else:
+                yield json.loads(line.decode('utf8'))
         except ValueError:
-            n_skips += 1
-            continue
-        yield item
-    assert n_skips <= 1, (n_skips, name)
+            yield None
+
+
+class _open_lines:
+    """ A context manager returning an iterator over lines of the file,
+    the size of the file, and a function returning how much of the file
+    was read so far.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._raw = self._mmap = self._stream = None
+
+    def __enter__(self):
+        self._raw = open(self.path, 'rb')
+        size = os.fstat(self._raw.fileno()).st_size
+        if self.path.endswith('.gz'):
+            self._stream = gzip.GzipFile(fileobj=self._raw)
+        elif self.path.endswith('.zst'):
+            import zstandard  # optional dependency
+            self._stream = io.BufferedReader(
+                zstandard.ZstdDecompressor().stream_reader(self._raw))
+        if self._stream is not None:
+            return iter(self._stream), size, self._raw.tell
+        if size == 0:  # empty files can not be memory-mapped
+            return iter([]), size, lambda: 0
+        self._mmap = mmap.mmap(
+            self._raw.fileno(), 0, access=mmap.ACCESS_READ)
+        return iter(self._mmap.readline, b''), size, self._mmap.tell
+
+    def __exit__(self, *args):
+        for f in [self._stream, self._mmap, self._raw]:
+            if f is not None:
+                f.close()
+
+
+def peek_too_common_shingles(items, limit):
+    """ Return too common shingles computed from the first ``limit`` items,
+    and an iterator over all items, so that the items are read only once.
+    """
+    items = iter(items)
+    head = list(islice(items, limit))
+    too_common = maybedont.utils.get_too_common_shingles(
+        item['extracted_text'] for item in head if 'extracted_text' in item)
+    return too_common, chain(head, items)
+
 
+class RawContentReader:
+    """ Load raw_content of items exported with RawContentStorePipeline:
+    pass the same store that was set in RAW_CONTENT_STORE
+    (a local path or s3://bucket/prefix/).
+    Items that still have raw_content are returned as is.
+    """
+    def __init__(self, store_uri):
+        p = urlsplit(store_uri)
+        if p.scheme == 's3':
+            import botocore.session
+            self.s3_client = botocore.session.get_session()\
+                .create_client('s3')
+            self.bucket, self.prefix = p.netloc, p.path.lstrip('/')
+        else:
+            self.s3_client = None
+            self.root = p.path if p.scheme == 'file' else store_uri
 
-def get_too_common_shingles(f, name=None, limit=None):
-    return maybedont.utils.get_too_common_shingles(
-        (item['extracted_text'] for item in item_reader(f, name, limit=limit)
-            if 'extracted_text' in item))
+    def __call__(self, item):
+        if 'raw_content' in item:
+            return item['raw_content']
+        path = item['metadata']['raw_content_stored_url']
+        if self.s3_client is not None:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket, Key=self.prefix + path)
+            data = response['Body'].read()
+        else:
+            with open(os.path.join(self.root, path), 'rb') as f:
+                data = f.read()
+        return data.decode('utf8')
@@ -0,0 +1,143 @@
+""" Crawl a local synthetic site, measuring crawl throughput,
+duplicate content avoidance and memory growth of the spider::
+
+    python -m tests.bench_crawl --max-pages 10000
+"""
+import argparse, json, os, time
+from urllib.parse import urlsplit
+
+from scrapy import signals
+from scrapy.crawler import CrawlerProcess
+from scrapy.settings import Settings
+from twisted.internet.task import LoopingCall
+
+import undercrawler.settings
+from undercrawler.spiders import BaseSpider
+from undercrawler.utils import max_rss_bytes, rss_bytes
+from .mockserver import MockServer
+from .synthetic_site import SyntheticSite, canonical_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    arg = parser.add_argument
+    arg('--site', default='{}',
+        help='SyntheticSite parameters as JSON, e.g. {"n_pages": 100000}')
+    arg('--max-pages', type=int, default=2000,
+        help='stop after crawling this many pages')
+    arg('--max-seconds', type=int, default=0,
+        help='stop after this many seconds')
+    arg('--sample-interval', type=float, default=5.0,
+        help='memory sampling interval in seconds')
+    arg('--splash', action='store_true', help='crawl using Splash')
+    arg('-s', '--set', action='append', default=[], metavar='NAME=VALUE',
+        help='override crawler settings')
+    arg('--output', help='save results to this JSON file')
+    args = parser.parse_args()
+
+    settings = Settings()
+    settings.setmodule(undercrawler.settings)
+    settings.update({
+        'AUTOLOGIN_ENABLED': False,
+        'DOWNLOAD_DELAY': 0,
+        'AUTOTHROTTLE_ENABLED': False,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 16,
+        'CLOSESPIDER_PAGECOUNT': args.max_pages,
+        'CLOSESPIDER_TIMEOUT': args.max_seconds,
+        'LOG_LEVEL': 'INFO',
+    })
+    if not args.splash:
+        settings['SPLASH_URL'] = None
+    settings.update(dict(s.split('=', 1) for s in args.set))
+
+    os.environ['SYNTHETIC_SITE'] = args.site
+    with MockServer(SyntheticSite) as s:
+        result = run_crawl(s.root_url, settings, args.sample_interval)
+    result['site'] = json.loads(args.site)
+    print_result(result)
+    if args.output:
+        with open(args.output, 'wt') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+
+def run_crawl(root_url, settings, sample_interval):
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(BaseSpider)
+    canonical_paths = []
+    memory_samples = []
+
+    def item_scraped(item, response, spider):
+        if 'url' in item:
+            p = urlsplit(item['url'])
+            path = p.path + ('?' + p.query if p.query else '')
+            canonical_paths.append(canonical_path(path))
+
+    def sample_memory():
+        memory_samples.append({
+            'seconds': time.perf_counter() - t0,
+            'pages': len(canonical_paths),
+            'rss_mb': rss_bytes() / 2**20,
+        })
+
+    sampler = LoopingCall(sample_memory)
+
+    def spider_opened(spider):
+        sampler.start(sample_interval)
+
+    def spider_closed(spider):
+        if sampler.running:
+            sampler.stop()
+
+    # Signal receivers are weak references, they are kept alive
+    # by this frame until the crawl is finished.
+    crawler.signals.connect(item_scraped, signal=signals.item_scraped)
+    crawler.signals.connect(spider_opened, signal=signals.spider_opened)
+    crawler.signals.connect(spider_closed, signal=signals.spider_closed)
+    t0 = time.perf_counter()
+    process.crawl(crawler, url=root_url)
+    process.start()
+    elapsed = time.perf_counter() - t0
+    sample_memory()
+
+    stats = crawler.stats.get_stats()
+    n_pages = len(canonical_paths)
+    n_unique = len(set(canonical_paths))
+    # Measure growth after the first page, when all modules are loaded
+    first = next((sample for sample in memory_samples if sample['pages']),
+                 memory_samples[0])
+    last = memory_samples[-1]
+    return {
+        'seconds': elapsed,
+        'pages': n_pages,
+        'pages_per_sec': n_pages / elapsed,
+        'responses': stats.get('response_received_count', 0),
+        'requests_filtered': stats.get('dupefilter/filtered', 0),
+        'unique_pages': n_unique,
+        'duplicate_ratio': 1 - n_unique / n_pages if n_pages else 0,
+        'memory': {
+            'samples': memory_samples,
+            'max_rss_mb': max_rss_bytes() / 2**20,
+            'growth_mb_per_1k_pages': (
+                1000 * (last['rss_mb'] - first['rss_mb']) /
+                (last['pages'] - first['pages'])
+                if last['pages'] > first['pages'] else None),
+        },
+        'finish_reason': stats.get('finish_reason'),
+    }
+
+
+def print_result(result):
+    print('{pages} pages in {seconds:.1f} s, {pages_per_sec:.1f} pages/sec '
+          '({finish_reason})'.format(**result))
+    print('{unique_pages} unique pages, {ratio:.1%} duplicate content, '
+          '{requests_filtered} requests filtered'.format(
+              ratio=result['duplicate_ratio'], **result))
+    memory = result['memory']
+    growth = memory['growth_mb_per_1k_pages']
+    print('max RSS {:.1f} MB, growth {} MB per 1000 pages'.format(
+        memory['max_rss_mb'], '-' if growth is None else
+        '{:.2f}'.format(growth)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+""" A synthetic site for end-to-end crawl tests and benchmarks.
+Pages are generated on the fly from the url, so the site can have
+millions of pages without using memory. Site shape is controlled
+by SyntheticSite class attributes, which can be overridden
+with JSON in the SYNTHETIC_SITE environment variable.
+"""
+import gzip
+from html import escape
+import hashlib
+import json
+import os
+import random
+from urllib.parse import urlencode
+
+from twisted.web.resource import Resource
+
+from .utils import html
+
+
+class SyntheticSite(Resource):
+    isLeaf = True
+
+    n_pages = 10000
+    # Links from each page to next pages (all pages are reachable this way)
+    fan_out = 10
+    # Extra links from each page to random pages
+    random_links = 5
+    # Number of paginated listings and pages in each listing
+    n_listings = 10
+    pagination_length = 20
+    items_per_listing_page = 10
+    # Add a search form to each page
+    search_form = True
+    search_results = 10
+    # Fraction of pages with an onclick link, iframe, and a media file link
+    onclick_ratio = 0.2
+    iframe_ratio = 0.1
+    media_ratio = 0.1
+    media_size = 1024
+    # Fraction of links that get parameters which do not change the content
+    dup_param_ratio = 0.2
+    dup_params = ['sessionid', 'utm_source', 'ref']
+    # Links from each page to itself with a different sort order
+    sort_links = 0
+    words_per_page = 200
+    # Number of urls in each gzipped sitemap listed in robots.txt
+    # via a sitemap index (no sitemaps if 0)
+    sitemap_size = 0
+
+    def __init__(self):
+        super().__init__()
+        for key, value in json.loads(
+                os.environ.get('SYNTHETIC_SITE') or '{}').items():
+            if not hasattr(self, key):
+                raise ValueError('Unknown SyntheticSite parameter: {}'
+                                 .format(key))
+            setattr(self, key, value)
+
+    def render_GET(self, request):
+        path = request.path.decode('utf8').strip('/').split('/')
+        args = {k.decode('utf8'): v[0].decode('utf8')
+                for k, v in request.args.items()}
+        try:
+            if path == ['']:
+                body = self.page(0)
+            elif path[0] == 'page' and len(path) == 2:
+                body = self.page(int(path[1]))
+            elif path[0] == 'list' and len(path) == 2:
+                body = self.listing(int(path[1]), int(args.get('page', 1)))
+            elif path == ['search']:
+                body = self.search(args.get('q', ''))
+            elif path[0] == 'frame' and len(path) == 2:
+                body = self.frame(int(path[1]))
+            elif path[0] == 'media' and len(path) == 2:
+                request.setHeader(b'content-type', b'application/pdf')
+                return self.media(int(path[1].split('.')[0]))
+            elif self.sitemap_size and path == ['robots.txt']:
+                request.setHeader(b'content-type', b'text/plain')
+                return self.robots().encode('utf8')
+            elif self.sitemap_size and path == ['sitemap_index.xml']:
+                request.setHeader(b'content-type', b'application/xml')
+                return self.sitemap_index().encode('utf8')
+            elif self.sitemap_size and path[0] == 'sitemaps' and \
+                    len(path) == 2 and path[1].endswith('.xml.gz'):
+                request.setHeader(b'content-type', b'application/x-gzip')
+                return gzip.compress(self.sitemap(
+                    int(path[1].split('.')[0])).encode('utf8'))
+            else:
+                raise ValueError
+        except (ValueError, IndexError):
+            request.setResponseCode(404)
+            body = html('Not found')
+        request.setHeader(b'content-type', b'text/html; charset=utf-8')
+        return body.encode('utf8')
+
+    def page(self, page_id):
+        if not 0 <= page_id < self.n_pages:
+            raise ValueError
+        rng = random.Random(page_id)
+        links = [
+            self.page_link(child, rng) for child in range(
+                page_id * self.fan_out + 1,
+                min(self.n_pages, (page_id + 1) * self.fan_out + 1))]
+        links.extend(self.page_link(rng.randrange(self.n_pages), rng)
+                     for _ in range(self.random_links))
+        links.extend(
+            '<a href="/page/{}?sort={}">Sort by {}</a>'.format(
+                page_id, order, order)
+            for order in ['date', 'name', 'price', 'rating'][:self.sort_links])
+        if page_id < self.n_listings:
+            links.append('<a href="/list/{}">Listing {}</a>'
+                         .format(page_id, page_id))
+        parts = [self.search_form_html() if self.search_form else '',
+                 '<p>{}</p>'.format(page_text(page_id, self.words_per_page)),
+                 ' '.join(links)]
+        if rng.random() < self.onclick_ratio:
+            parts.append(
+                '<span onclick="window.open(\'/page/{}\')">more</span>'
+                .format(rng.randrange(self.n_pages)))
+        if rng.random() < self.iframe_ratio:
+            parts.append('<iframe src="/frame/{}"></iframe>'.format(page_id))
+        if rng.random() < self.media_ratio:
+            parts.append('<a href="/media/{}.pdf">document</a>'
+                         .format(page_id))
+        return html('\n'.join(parts))
+
+    def page_link(self, page_id, rng):
+        url = '/page/{}'.format(page_id)
+        if rng.random() < self.dup_param_ratio:
+            url += '?' + urlencode(
+                {param: rng.randrange(1000) for param in self.dup_params})
+        return '<a href="{}">Page {}</a>'.format(url, page_id)
+
+    def listing(self, listing_id, page):
+        if not (0 <= listing_id < self.n_listings and
+                1 <= page <= self.pagination_length):
+            raise ValueError
+        start = _hash_int(listing_id, page)
+        links = [
+            '<a href="/page/{0}">Item {0}</a>'.format(
+                (start + i) % self.n_pages)
+            for i in range(self.items_per_listing_page)]
+        pagination = [
+            '<a href="/list/{}?page={}">{}</a>'.format(listing_id, n, n)
+            for n in range(1, self.pagination_length + 1) if n != page]
+        if page < self.pagination_length:
+            pagination.append('<a href="/list/{}?page={}">Next</a>'
+                              .format(listing_id, page + 1))
+        return html('<ul>{}</ul><div class="pagination">{}</div>'.format(
+            ''.join('<li>{}</li>'.format(link) for link in links),
+            ' '.join(pagination)))
+
+    def search(self, query):
+        start = _hash_int(query)
+        results = [
+            '<a href="/page/{0}">Result {0}</a>'.format(
+                (start + i) % self.n_pages)
+            for i in range(self.search_results if query else 0)]
+        return html('{}<h1>Results for "{}"</h1>{}'.format(
+            self.search_form_html(), escape(query), ' '.join(results)))
+
+    def frame(self, page_id):
+        return html('<a href="/page/{0}">Framed {0}</a>'.format(
+            _hash_int(page_id, 'frame') % self.n_pages))
+
+    def media(self, media_id):
+        return hashlib.sha256(str(media_id).encode()).digest() * \
+            (self.media_size // 32)
+
+    def robots(self):
+        return 'User-agent: *\nDisallow: /search\n' \
+               'Sitemap: /sitemap_index.xml\n'
+
+    def sitemap_index(self):
+        n_sitemaps = -(-self.n_pages // self.sitemap_size)
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns='
+            '"http://www.sitemaps.org/schemas/sitemap/0.9">{}</sitemapindex>'
+            .format(''.join(
+                '<sitemap><loc>/sitemaps/{}.xml.gz</loc></sitemap>'.format(i)
+                for i in range(n_sitemaps))))
+
+    def sitemap(self, sitemap_id):
+        start = sitemap_id * self.sitemap_size
+        if not 0 <= start < self.n_pages:
+            raise ValueError
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns='
+            '"http://www.sitemaps.org/schemas/sitemap/0.9">{}</urlset>'
+            .format(''.join(
+                '<url><loc>/page/{}</loc></url>'.format(page_id)
+                for page_id in range(
+                    start, min(self.n_pages, start + self.sitemap_size)))))
+
+    @staticmethod
+    def search_form_html():
+        return ('<form action="/search" method="get">'
+                '<label for="q">Search:</label> '
+                '<input id="q" name="q" type="text"/> '
+                '<input type="submit" value="Search"/></form>')
+
+
+def canonical_path(path):
+    """ Path of the page with the same content (without parameters
+    that do not affect content).
+
+    >>> canonical_path('/page/1?sessionid=10&ref=2')
+    '/page/1'
+    >>> canonical_path('/list/1?page=2')
+    '/list/1?page=2'
+    >>> canonical_path('/')
+    '/page/0'
+    """
+    path, _, query = path.partition('?')
+    if path.rstrip('/') == '':
+        return '/page/0'
+    if path.startswith('/page/'):
+        return path
+    return '{}?{}'.format(path, query) if query else path
+
+
+def page_text(page_id, n_words):
+    rng = random.Random(-1 - page_id)
+    return ' '.join('w{}'.format(rng.randrange(5000)) for _ in range(n_words))
+
+
+def _hash_int(*args):
+    return int(hashlib.sha1(repr(args).encode('utf8')).hexdigest()[:8], 16)
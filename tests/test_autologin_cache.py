@@ -0,0 +1,138 @@
+import sqlite3
+import time
+
+from autologin_middleware import AutologinMiddleware
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.http.cookies import CookieJar
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer, task
+
+from undercrawler.middleware import (
+    AutologinCookieCache, CachedAutologinMiddleware)
+
+
+COOKIES = [{'name': 'session', 'value': '1', 'path': '/'}]
+
+
+def test_cookie_cache(tmpdir):
+    path = str(tmpdir.join('cookies.db'))
+    cache = AutologinCookieCache(path, ttl=60)
+    other = AutologinCookieCache(path, ttl=60)
+    assert cache.get('a') is None
+    cache.set('a', COOKIES)
+    assert other.get('a') == COOKIES
+    new_cookies = [dict(COOKIES[0], value='2')]
+    other.set('a', new_cookies)
+    assert not cache.invalidate('a', COOKIES)
+    assert cache.get('a') == new_cookies
+    assert cache.invalidate('a', new_cookies)
+    assert other.get('a') is None
+    expired = AutologinCookieCache(path, ttl=-1)
+    expired.set('b', COOKIES)
+    assert cache.get('b') is None
+
+    assert cache.acquire_lease('a', 60)
+    assert not other.acquire_lease('a', 60)
+    assert other.acquire_lease('b', 60)
+    cache.release_lease('a')
+    assert other.acquire_lease('a', 60)
+    assert other.acquire_lease('c', -1)
+    assert cache.acquire_lease('c', 60)
+
+
+def test_cookie_cache_locked(tmpdir):
+    path = str(tmpdir.join('cookies.db'))
+    cache = AutologinCookieCache(path, ttl=60)
+    cache.set('a', COOKIES)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute('BEGIN IMMEDIATE')  # another process is writing
+    t0 = time.time()
+    assert cache.get('a') == COOKIES  # readers are not blocked with WAL
+    cache.set('b', COOKIES)
+    assert not cache.acquire_lease('a', 60)
+    assert not cache.invalidate('a', COOKIES)
+    cache.release_lease('a')
+    assert time.time() - t0 < 5
+    other.execute('COMMIT')
+    assert cache.get('b') is None
+    assert cache.acquire_lease('a', 60)
+    assert cache.invalidate('a', COOKIES)
+
+
+def make_middleware(path, monkeypatch, logins):
+    def _login(self, request, spider):
+        logins.append(request.url)
+        self.auth_cookies = list(COOKIES)
+        self.logged_in = True
+        return defer.succeed(None)
+    monkeypatch.setattr(AutologinMiddleware, '_login', _login)
+    crawler = get_crawler(settings_dict={
+        'AUTOLOGIN_ENABLED': True,
+        'AUTOLOGIN_COOKIE_CACHE': path,
+        'AUTOLOGIN_COOKIE_CACHE_TTL': 60,
+        'AUTOLOGIN_COOKIE_CACHE_WAIT': 60,
+        'AUTOLOGIN_USERNAME': 'admin',
+    })
+    return CachedAutologinMiddleware.from_crawler(crawler)
+
+
+def test_shared_login(tmpdir, monkeypatch):
+    path = str(tmpdir.join('cookies.db'))
+    logins = []
+    mw = make_middleware(path, monkeypatch, logins)
+    request = Request('http://www.example.com/a')
+    mw.process_request(request, None)
+    assert mw.logged_in and logins == ['http://www.example.com/a']
+    assert request.cookies == COOKIES
+
+    # Another process reuses cookies
+    mw2 = make_middleware(path, monkeypatch, logins)
+    request2 = Request('http://example.com/b')
+    mw2.process_request(request2, None)
+    assert mw2.logged_in and len(logins) == 1
+    assert request2.cookies == COOKIES
+    assert mw2.stats.get_value('autologin/cookie_cache/hits') == 1
+
+    # Different credentials are not shared
+    mw3 = make_middleware(path, monkeypatch, logins)
+    mw3.username = 'other'
+    mw3.process_request(Request('http://example.com/b'), None)
+    assert len(logins) == 2
+
+    # Logout removes cookies from the cache, and the next login is stored
+    response = HtmlResponse(request2.url, request=request2)
+    response.flags.append(CookieJar())
+    mw2.process_response(request2, response, None)
+    assert mw2.stats.get_value('autologin/cookie_cache/invalidated') == 1
+    assert len(logins) == 3
+    mw4 = make_middleware(path, monkeypatch, logins)
+    mw4.process_request(Request('http://example.com/c'), None)
+    assert len(logins) == 3
+
+
+def test_wait_for_other_login(tmpdir, monkeypatch):
+    path = str(tmpdir.join('cookies.db'))
+    clock = task.Clock()
+    monkeypatch.setattr(
+        'undercrawler.middleware.autologin.reactor', clock)
+    logins = []
+    mw = make_middleware(path, monkeypatch, logins)
+    key = mw._cache_key(Request('http://example.com'))
+    other = AutologinCookieCache(path)
+    assert other.acquire_lease(key, 60)
+    d = mw.process_request(Request('http://example.com/a'), None)
+    clock.advance(5)
+    assert not d.called
+    other.set(key, COOKIES)
+    clock.advance(1)
+    assert d.called and mw.logged_in and not logins
+
+    # Login anyway if the other process takes too long
+    mw = make_middleware(path, monkeypatch, logins)
+    other.invalidate(key, COOKIES)
+    d = mw.process_request(Request('http://example.com/a'), None)
+    clock.pump([1] * 59)
+    assert not d.called
+    clock.advance(1)
+    assert d.called and mw.logged_in and len(logins) == 1
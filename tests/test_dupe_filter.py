@@ -1,7 +1,19 @@
-from scrapy import Request
-from scrapy_splash import SplashRequest
+from copy import deepcopy
+import hashlib
+import os
+import re
 
-from undercrawler.dupe_filter import DupeFilter
+import pytest
+
+from scrapy import Request, FormRequest
+from scrapy.statscollectors import StatsCollector
+from scrapy.utils.test import get_crawler
+from scrapy_splash import SplashRequest, SplashFormRequest
+from scrapy_splash.dupefilter import splash_request_fingerprint
+
+from undercrawler.dupe_filter import DupeFilter, FingerprintSet
+from undercrawler.spiders import BaseSpider
+from undercrawler.utils import UrlCache
 
 
 def test_dupe_filter_with_splash():
@@ -33,3 +45,140 @@ def test_dupe_filter_without_splash():
     # splash is not used, so by default these urls are considered the same
     assert url_fp('http://www.example.com/foo#a') == \
            url_fp('http://www.example.com/foo#b')
+
+
+def test_same_as_splash_fingerprint():
+    # DupeFilter computes the same fingerprint as SplashAwareDupeFilter
+    # for the request with normalized url
+    def reference_fp(request):
+        if 'splash' in request.meta and \
+                not request.meta.get('_splash_processed'):
+            url = re.sub(r'^https?://(www\.)?', 'http://', request.url)
+            meta = deepcopy(request.meta)
+            meta['splash'].setdefault('args', {})['url'] = url
+            request = request.replace(url=url, meta=meta)
+        return splash_request_fingerprint(request)
+
+    args = {'lua_source': 'function main(splash) end ' * 100, 'wait': 0.5}
+    processed = SplashRequest('http://example.com/a', args=args)
+    processed.meta['_splash_processed'] = True
+    requests = [
+        Request('http://www.example.com/foo?b=1&a=1#x'),
+        FormRequest('http://example.com/search', formdata={'q': 'a'}),
+        SplashRequest('https://www.example.com/foo?b=1&a=1#x', args=args),
+        SplashRequest('http://example.com/foo', endpoint='execute',
+                      args=args, cache_args=['lua_source']),
+        SplashFormRequest('http://example.com/search', formdata={'q': 'a'},
+                          args=args),
+        processed,
+    ]
+    dupe_filter = DupeFilter()
+    for request in requests:
+        for _ in range(2):  # second time with cached values
+            assert dupe_filter.request_fingerprint(request) == \
+                reference_fp(request)
+
+
+def test_url_cache():
+    cache = UrlCache(maxsize=2)
+    url = 'http://example.com/?b=1&a=2#frag'
+    assert cache.canonicalize_url(url) == 'http://example.com/?a=2&b=1'
+    assert cache.canonicalize_url(url) == 'http://example.com/?a=2&b=1'
+    assert cache.canonicalize_url(url, keep_fragments=True) == \
+        'http://example.com/?a=2&b=1#frag'
+    assert (cache.hits, cache.misses) == (1, 2)
+    cache.canonicalize_url('http://example.com/c')
+    assert len(cache._cache) == 2
+    cache.canonicalize_url(url)  # evicted
+    assert cache.misses == 4
+    stats = StatsCollector(get_crawler())
+    cache.record_stats(stats)
+    assert stats.get_value('url_cache/hits') == 1
+    assert stats.get_value('url_cache/size') == 2
+    disabled = UrlCache(maxsize=0)
+    assert disabled.canonicalize_url(url) == 'http://example.com/?a=2&b=1'
+    assert (disabled.hits, disabled.misses) == (0, 0)
+
+
+def test_url_cache_per_crawler():
+    crawlers = [get_crawler(BaseSpider, {'URL_CACHE_SIZE': size})
+                for size in [10, 20]]
+    caches = []
+    for crawler in crawlers:
+        spider = crawler._create_spider(url='http://example.com')
+        dupe_filter = DupeFilter.from_crawler(crawler)
+        assert spider.url_cache is dupe_filter.url_cache
+        caches.append(spider.url_cache)
+    assert [cache.maxsize for cache in caches] == [10, 20]
+    dupe_filter.request_seen(Request('http://example.com/a'))
+    assert (caches[0].misses, caches[1].misses) == (0, 1)
+
+
+def test_fingerprint_set(monkeypatch):
+    monkeypatch.setattr(FingerprintSet, 'min_buffer_size', 10)
+    fingerprints = FingerprintSet(8)
+    # trailing zero bytes are stripped in numpy "S" arrays
+    added = [b'\x01' + b'\0' * 7]
+    added.extend(hashlib.sha1(str(i).encode()).digest()[:8]
+                 for i in range(100))
+    for fp in added:
+        fingerprints.add(fp)
+    assert len(fingerprints) == len(added)
+    assert len(fingerprints._buffer) < 10
+    for fp in added:
+        assert fp in fingerprints
+    for i in range(100, 200):
+        assert hashlib.sha1(str(i).encode()).digest()[:8] not in fingerprints
+    assert b'\x01' + b'\0' * 6 + b'\x01' not in fingerprints
+    with pytest.raises(ValueError):
+        fingerprints.add(b'\x01')
+
+
+@pytest.mark.parametrize('bits', [64, 128])
+def test_compact_fingerprints(tmpdir, bits):
+    jobdir = str(tmpdir)
+    urls = ['http://example.com/{}'.format(i) for i in range(10)]
+    # Full fingerprints from the previous run are migrated
+    dupe_filter = DupeFilter(jobdir)
+    for url in urls[:5]:
+        assert not dupe_filter.request_seen(Request(url))
+    dupe_filter.close('finished')
+    for _ in range(2):
+        dupe_filter = DupeFilter(jobdir, fingerprint_bits=bits)
+        assert len(dupe_filter.fingerprints) == 5
+        for url in urls[:5]:
+            assert dupe_filter.request_seen(Request(url))
+        assert not dupe_filter.request_seen(Request(urls[5]))
+        dupe_filter.close('finished')
+        urls.pop(5)
+        assert os.path.getsize(
+            os.path.join(jobdir, 'requests.seen.bin')) == 6 * bits // 8
+        # added fingerprint is not kept, as this is the second run
+        with open(os.path.join(jobdir, 'requests.seen.bin'), 'r+b') as f:
+            f.truncate(5 * bits // 8)
+    assert os.path.exists(os.path.join(jobdir, 'requests.seen.migrated'))
+
+
+def test_partial_fingerprint(tmpdir):
+    jobdir = str(tmpdir)
+    path = os.path.join(jobdir, 'requests.seen.bin')
+    urls = ['http://example.com/{}'.format(i) for i in range(3)]
+    dupe_filter = DupeFilter(jobdir, fingerprint_bits=64)
+    for url in urls[:2]:
+        dupe_filter.request_seen(Request(url))
+    dupe_filter.close('finished')
+    with open(path, 'ab') as f:
+        f.write(b'\x01\x02\x03')  # crashed while writing
+    dupe_filter = DupeFilter(jobdir, fingerprint_bits=64)
+    assert len(dupe_filter.fingerprints) == 2
+    assert not dupe_filter.request_seen(Request(urls[2]))
+    dupe_filter.close('finished')
+    assert os.path.getsize(path) == 3 * 8
+    dupe_filter = DupeFilter(jobdir, fingerprint_bits=64)
+    for url in urls:
+        assert dupe_filter.request_seen(Request(url))
+    dupe_filter.close('finished')
+
+    fingerprints = FingerprintSet(8)
+    fingerprints.update_from_bytes(b'\x01' * 8 + b'\x02' * 3)
+    assert len(fingerprints) == 1
@@ -0,0 +1,89 @@
+import io
+import json
+
+import pytest
+
+from undercrawler.export_pipeline import CompressedExportPipeline
+from undercrawler.item_index import open_output
+
+
+def read_export(export_dir):
+    with export_dir.join('manifest.json').open() as f:
+        manifest = json.load(f)['files']
+    items = []
+    for entry in manifest:
+        path = str(export_dir.join(entry['name']))
+        with io.TextIOWrapper(open_output(path), encoding='utf8') as f:
+            file_items = [json.loads(line) for line in f]
+        assert len(file_items) == entry['items']
+        items.extend(file_items)
+    return manifest, items
+
+
+def test_export(tmpdir):
+    pipeline = CompressedExportPipeline(str(tmpdir))
+    pipeline.open_spider(None)
+    items = [{'url': 'http://example.com/{}'.format(i), 'raw_content': 'ü'}
+             for i in range(10)]
+    for item in items:
+        assert pipeline.process_item(item, None) is item
+    pipeline.close_spider(None)
+    manifest, exported = read_export(tmpdir)
+    assert len(manifest) == 1
+    assert exported == items
+
+
+def test_rotate_and_resume(tmpdir):
+    items = [{'url': 'http://example.com/{}'.format(i)} for i in range(20)]
+    for chunk in [items[:10], items[10:]]:
+        pipeline = CompressedExportPipeline(str(tmpdir), rotate_bytes=1)
+        pipeline.open_spider(None)
+        for item in chunk:
+            pipeline.process_item(item, None)
+        pipeline.close_spider(None)
+    manifest, exported = read_export(tmpdir)
+    assert len(manifest) == 20
+    assert [entry['name'] for entry in manifest][:2] == \
+        ['items-00000.jl.gz', 'items-00001.jl.gz']
+    assert exported == items
+
+
+def test_export_zstd(tmpdir):
+    pytest.importorskip('zstandard')
+    items = [{'url': 'http://example.com/{}'.format(i), 'raw_content': 'ü'}
+             for i in range(5)]
+    for chunk in [items[:3], items[3:]]:
+        pipeline = CompressedExportPipeline(str(tmpdir), compression='zstd')
+        pipeline.open_spider(None)
+        for item in chunk:
+            pipeline.process_item(item, None)
+        pipeline.close_spider(None)
+    manifest, exported = read_export(tmpdir)
+    assert [entry['name'] for entry in manifest] == \
+        ['items-00000.jl.zst', 'items-00001.jl.zst']
+    assert all(entry['compression'] == 'zstd' for entry in manifest)
+    assert exported == items
+
+
+def test_resume_after_crash(tmpdir):
+    pipeline = CompressedExportPipeline(str(tmpdir), index=True)
+    pipeline.writer.write(b'{"url": "http://example.com/lost"}\n')
+    pipeline.writer._stream.close()
+    pipeline.writer._raw.close()  # crashed before rotation
+    unfinished = tmpdir.join('items-00000.jl.gz').read_binary()
+    assert unfinished
+    items = [{'url': 'http://example.com/{}'.format(i)} for i in range(3)]
+    pipeline = CompressedExportPipeline(str(tmpdir), index=True)
+    pipeline.open_spider(None)
+    for item in items:
+        pipeline.process_item(item, None)
+    pipeline.close_spider(None)
+    manifest, exported = read_export(tmpdir)
+    assert [entry['name'] for entry in manifest] == ['items-00001.jl.gz']
+    assert exported == items
+    assert tmpdir.join('items-00000.jl.gz').read_binary() == unfinished
+
+
+def test_unknown_compression(tmpdir):
+    with pytest.raises(ValueError):
+        CompressedExportPipeline(str(tmpdir), compression='bz2')
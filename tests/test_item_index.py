@@ -0,0 +1,138 @@
+import json
+import os
+
+from numpy.lib.recfunctions import repack_fields
+import pytest
+
+from undercrawler.export_pipeline import CompressedExportPipeline
+from undercrawler.item_index import ItemIndex, build_index, index_path, \
+    open_output
+from scripts.crawl_stats import print_stats
+from scripts.limit_results import limit_results
+
+
+TIMESTAMPS = [1000, 3000, 2000, 5000, 4000, 9000, 6000]
+
+
+def make_items():
+    return [{'url': 'http://example.com/{}'.format(i % 5),
+             'timestamp': ts,
+             'content_type': 'text/html' if i % 2 else 'image/png',
+             'extracted_text': 'ü {}'.format(i),
+             'extracted_metadata': {'is_page': i % 3 == 0, 'depth': i}}
+            for i, ts in enumerate(TIMESTAMPS)]
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'zstd', 'none'])
+def test_export_index(tmpdir, compression):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    pipeline = CompressedExportPipeline(
+        str(tmpdir), compression=compression, index=True)
+    pipeline.open_spider(None)
+    items = make_items()
+    for item in items:
+        pipeline.process_item(item, None)
+    pipeline.close_spider(None)
+    with tmpdir.join('manifest.json').open() as f:
+        entry, = json.load(f)['files']
+    path = str(tmpdir.join(entry['name']))
+    assert entry['index'] == entry['name'] + '.idx'
+    index = ItemIndex.load(str(tmpdir.join(entry['index'])))
+    assert len(index) == len(items)
+    assert list(index.records['timestamp']) == TIMESTAMPS
+    with open_output(path) as f:
+        assert [index.read_item(f, i) for i in range(len(index))] == items
+    # Index built afterwards is the same
+    built_path = str(tmpdir.join('built.idx'))
+    assert build_index(path, built_path) == len(items)
+    assert ItemIndex.load(built_path).records.tobytes() == \
+        index.records.tobytes()
+
+
+def test_lookup(tmpdir):
+    path = str(tmpdir.join('out.jl'))
+    items = make_items()
+    with open(path, 'w') as f:
+        for item in items:
+            f.write(json.dumps(item) + '\n')
+    build_index(path)
+    index = ItemIndex.load(index_path(path))
+    assert index.find_url('http://example.com/1') == [1, 6]
+    assert index.find_url('http://example.com/10') == []
+    assert index.with_content_type('image/png') == [0, 2, 4, 6]
+    assert index.time_limit(0) == 1
+    assert index.time_limit(2) == 3
+    assert index.time_limit(4) == 5
+    assert index.time_limit(100) == len(items)
+    with open_output(path) as f:
+        assert index.read_item(f, 6) == items[6]
+        assert index.read_item(f, 1) == items[1]
+
+
+def test_load_v1_index(tmpdir):
+    path = str(tmpdir.join('out.jl'))
+    with open(path, 'w') as f:
+        for item in make_items():
+            f.write(json.dumps(item) + '\n')
+    build_index(path)
+    index = ItemIndex.load(index_path(path))
+    names = [name for name in index.records.dtype.names
+             if name != 'metadata_keys']
+    with open(index_path(path), 'wb') as f:
+        f.write(b'UCIDX01\n')
+        f.write(repack_fields(index.records[names]).tobytes())
+    v1_index = ItemIndex.load(index_path(path))
+    assert v1_index.find_url('http://example.com/1') == [1, 6]
+    assert v1_index.with_metadata_key('is_page') == list(range(len(index)))
+
+
+def test_build_index_truncated(tmpdir):
+    path = str(tmpdir.join('out.jl'))
+    items = make_items()
+    with open(path, 'w') as f:
+        for item in items:
+            f.write(json.dumps(item) + '\n')
+        f.write('{"url": "http://example.com/trunc')
+    assert build_index(path) == len(items)
+    assert len(ItemIndex.load(index_path(path)).records) == len(items)
+    with open(path, 'a') as f:
+        f.write('\n' + json.dumps(items[0]) + '\n')
+    with pytest.raises(ValueError):
+        build_index(path)
+
+
+def test_show(tmpdir, capsys):
+    path = str(tmpdir.join('out.jl'))
+    with open(path, 'w') as f:
+        for item in make_items():
+            f.write(json.dumps(item) + '\n')
+    for show in ['is_page', 'depth_2', 'depth_5+']:
+        print_stats(path, show=show, skip_unique=True)
+        scanned = [line for line in capsys.readouterr().out.splitlines()
+                   if line.startswith('http')]
+        assert scanned
+        build_index(path)
+        index = ItemIndex.load(index_path(path))
+        assert len(index.with_metadata_key(show)) < len(index)
+        stats = print_stats(path, show=show, skip_unique=True)
+        assert capsys.readouterr().out.splitlines() == scanned
+        assert stats[show] == len(scanned)
+        os.remove(index_path(path))
+
+
+@pytest.mark.parametrize('seconds', [0, 2, 4, 7, 100])
+def test_limit_results(tmpdir, seconds):
+    path = str(tmpdir.join('out.json'))
+    with open(path, 'w') as f:
+        f.write('[' + ',\n'.join(json.dumps(item) for item in make_items())
+                + ']\n')
+    expected_path = str(tmpdir.join('expected.json'))
+    limit_results(path, expected_path, seconds)
+    build_index(path)
+    limited_path = str(tmpdir.join('limited.json'))
+    limit_results(path, limited_path, seconds)
+    with open(expected_path) as f:
+        expected = json.load(f)
+    with open(limited_path) as f:
+        assert json.load(f) == expected
@@ -0,0 +1,52 @@
+from scrapy.http import HtmlResponse
+
+from undercrawler.link_scorer import OnlineLinkScorer, content_key
+from undercrawler.utils import body_text
+from .utils import html
+
+
+def response(url, text):
+    return HtmlResponse(url, body=html(text).encode('utf8'), encoding='utf8')
+
+
+def test_content_key():
+    assert content_key(response('http://example.com/a', 'foo  bar')) == \
+        content_key(response('http://example.com/b?s=1', 'foo bar\n'))
+    assert content_key(response('http://example.com/a', 'foo')) != \
+        content_key(response('http://example.com/a', 'bar'))
+    assert content_key(response('http://example.com/a', '')) is None
+    page = response('http://example.com/a', 'foo bar')
+    assert content_key(page, body_text(page)) == content_key(page)
+
+
+def test_online_link_scorer():
+    state = {}
+    scorer = OnlineLinkScorer(state)
+    page = response('http://example.com/catalog/', 'catalog')
+    item_features = lambda n: scorer.link_features(
+        'http://example.com/item/{}'.format(n), 'Item {}'.format(n), page, {})
+    sorted_features = lambda n: scorer.link_features(
+        'http://example.com/catalog/?sort=price&page={}'.format(n),
+        'Sort by price', page, {})
+    assert scorer.priority(item_features(1)) == 0
+    # packed uint32 feature indices, not a list of ints
+    assert isinstance(item_features(1), bytes)
+    assert scorer.score(list(scorer._indices(item_features(1)))) == \
+        scorer.score(item_features(1))
+    for n in range(20):
+        scorer.update(item_features(n), new_content=True)
+        scorer.update(sorted_features(n), new_content=False)
+    assert scorer.priority(item_features(100)) > 0
+    assert scorer.priority(sorted_features(100)) < 0
+    assert -5 <= scorer.priority(sorted_features(100))
+    # state is kept in spider.state
+    assert OnlineLinkScorer(state).score(item_features(100)) == \
+        scorer.score(item_features(100))
+
+
+def test_is_new_content():
+    scorer = OnlineLinkScorer({})
+    assert scorer.is_new_content(response('http://example.com/a', 'foo'))
+    assert not scorer.is_new_content(
+        response('http://example.com/a?s=1', 'foo'))
+    assert scorer.is_new_content(response('http://example.com/b', 'bar'))
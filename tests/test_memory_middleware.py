@@ -0,0 +1,76 @@
+from scrapy import Request
+from scrapy.spiders import Spider
+from scrapy.utils.test import get_crawler
+
+from undercrawler.middleware import MemoryAccountingMiddleware
+from undercrawler.middleware.memory import approx_size
+from undercrawler.spiders import BaseSpider
+
+
+def make_middleware(**settings):
+    settings['MEMORY_ACCOUNTING_ENABLED'] = True
+    settings.setdefault('MEMORY_SHED_PRIORITY', -3)
+    crawler = get_crawler(settings_dict=settings)
+    mw = MemoryAccountingMiddleware.from_crawler(crawler)
+    spider = Spider('test')
+    spider.state = {'allowed': {'a', 'b'}, 'handled_search_forms': set()}
+    mw.spider = spider
+    return mw, crawler.stats
+
+
+def test_accounting():
+    mw, stats = make_middleware()
+    mw.sample()
+    assert stats.get_value('memory/spider_state/allowed/items') == 2
+    assert stats.get_value('memory/spider_state/allowed/bytes') > 0
+    assert stats.get_value(
+        'memory/spider_state/handled_search_forms/items') == 0
+    assert stats.get_value('memory/rss_bytes') > 0
+    assert stats.get_value('memory/level') == 'ok'
+
+
+def test_accounting_spider_state():
+    crawler = get_crawler(BaseSpider, {'MEMORY_ACCOUNTING_ENABLED': True})
+    mw = MemoryAccountingMiddleware.from_crawler(crawler)
+    spider = mw.spider = crawler._create_spider(url='http://example.com')
+    spider.state = {}
+    spider.allowed.add('http://example.com', False)
+    spider.allowed.add('http://blog.foo.com/posts', True)
+    mw.sample()
+    stats = crawler.stats
+    assert stats.get_value('memory/spider_state/allowed/items') == 2
+    assert stats.get_value('memory/spider_state/allowed/bytes') > 0
+
+
+def test_shedding():
+    # Any process uses more than 1 MB
+    mw, stats = make_middleware(MEMORY_SOFT_LIMIT_MB=1)
+    output = [{'url': 'http://example.com'},
+              Request('http://example.com/a'),
+              # priority lowered by the link scorer
+              Request('http://example.com/c', priority=-5,
+                      meta={'link_scorer_priority': -5}),
+              Request('http://example.com/search?q=a', priority=-3),
+              Request('http://example.com/b', priority=-15)]
+    assert list(mw.process_spider_output(None, output, None)) == output
+    mw.sample()
+    assert stats.get_value('memory/level') == 'soft'
+    assert list(mw.process_spider_output(None, output, None)) == output[:3]
+    assert stats.get_value('memory/shed/soft') == 2
+    mw.hard_limit = 2**20
+    mw.sample()
+    assert stats.get_value('memory/level') == 'hard'
+    assert list(mw.process_spider_output(None, output, None)) == output[:1]
+    assert stats.get_value('memory/shed/hard') == 4
+    mw.soft_limit = mw.hard_limit = 0
+    mw.sample()
+    assert stats.get_value('memory/level') == 'ok'
+    assert list(mw.process_spider_output(None, output, None)) == output
+
+
+def test_approx_size():
+    small = {str(i) for i in range(1000)}
+    large = {str(i) * 100 for i in range(1000)}
+    assert approx_size(large) > approx_size(small) + 100 * 1000
+    nested = {i: {str(j) for j in range(100)} for i in range(10)}
+    assert approx_size(nested) > 10 * approx_size({str(j) for j in range(100)})
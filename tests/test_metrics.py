@@ -0,0 +1,54 @@
+from scrapy import Request
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+from scrapy_splash import SplashRequest
+
+from undercrawler.metrics import Histogram, MetricsExtension
+
+
+def test_metrics():
+    crawler = get_crawler(settings_dict={'METRICS_PORT': '9410'})
+    ext = MetricsExtension.from_crawler(crawler)
+    crawler.stats.set_value('downloader/request_count', 10)
+    crawler.stats.set_value('downloader/response_status_count/200', 7)
+    crawler.stats.set_value('downloader/response_status_count/404', 2)
+    crawler.stats.set_value('item_scraped_count', 5)
+    for request, latency in [(Request('http://example.com'), 0.2),
+                             (SplashRequest('http://example.com'), 3),
+                             (SplashRequest('http://example.com'), 100)]:
+        request.meta['download_latency'] = latency
+        ext.response_received(Response(request.url), request, None)
+    lines = ext.render_metrics().splitlines()
+    assert '# TYPE undercrawler_requests_total counter' in lines
+    assert 'undercrawler_requests_total 10' in lines
+    assert 'undercrawler_responses_total{status="200"} 7' in lines
+    assert 'undercrawler_responses_total{status="404"} 2' in lines
+    assert 'undercrawler_items_scraped_total 5' in lines
+    assert 'undercrawler_download_latency_seconds_bucket' \
+        '{splash="true",le="2.5"} 0' in lines
+    assert 'undercrawler_download_latency_seconds_bucket' \
+        '{splash="true",le="5"} 1' in lines
+    assert 'undercrawler_download_latency_seconds_bucket' \
+        '{splash="true",le="+Inf"} 2' in lines
+    assert 'undercrawler_download_latency_seconds_count{splash="true"} 2' \
+        in lines
+    assert 'undercrawler_download_latency_seconds_sum{splash="false"} 0.2' \
+        in lines
+    assert any(line.startswith('undercrawler_resident_memory_bytes ')
+               for line in lines)
+    # No engine yet
+    assert not any(line.startswith('undercrawler_scheduler_queue_size ')
+                   for line in lines)
+
+
+def test_histogram():
+    histogram = Histogram((1, 2))
+    for value in [0.5, 1, 1.5, 3]:
+        histogram.observe(value)
+    assert histogram.samples([]) == [
+        ('_bucket', [('le', 1)], 2),
+        ('_bucket', [('le', 2)], 3),
+        ('_bucket', [('le', '+Inf')], 4),
+        ('_sum', [], 6),
+        ('_count', [], 4),
+    ]
@@ -0,0 +1,104 @@
+from collections import Counter
+import math
+
+from datasketch import MinHashLSH
+from maybedont.utils import get_min_hash, get_too_common_shingles, \
+    shingle_hashes
+import numpy as np
+
+from scripts.minhash import BatchMinHasher, StreamingTooCommonShingles, \
+    shingle_keys, with_min_hashes
+
+
+TEXTS = [
+    'The quick brown fox jumps over the lazy dog, page {}'.format(i)
+    for i in range(20)] + [
+    '',
+    'short',
+    ' '.join('word{}'.format(i) for i in range(500)),
+    'Completely different text about something else entirely',
+]
+
+
+def test_same_as_get_min_hash():
+    too_common = get_too_common_shingles(TEXTS)
+    # Small chunks so that documents span several chunks
+    hasher = BatchMinHasher(chunk_rows=7)
+    for text, min_hash in zip(TEXTS, hasher.min_hashes(TEXTS, too_common)):
+        expected = get_min_hash(text, too_common)
+        assert np.array_equal(min_hash.hashvalues, expected.hashvalues)
+        assert min_hash.jaccard(expected) == 1.0
+
+
+def test_lsh():
+    lsh = MinHashLSH(threshold=0.9, num_perm=128)
+    lsh.insert('a', get_min_hash(TEXTS[-2], set()))
+    min_hash, = BatchMinHasher().min_hashes([TEXTS[-2]], set())
+    assert lsh.query(min_hash) == ['a']
+
+
+def test_with_min_hashes():
+    items = [{'extracted_text': text} for text in TEXTS[:5]]
+    items.insert(2, {'obj_stored_url': 'file.pdf'})
+    result = list(with_min_hashes(iter(items), set(), batch_size=2))
+    assert [item for item, _ in result] == items
+    assert result[2][1] is None
+    for item, min_hash in result:
+        if 'extracted_text' in item:
+            assert np.array_equal(
+                min_hash.hashvalues,
+                get_min_hash(item['extracted_text'], set()).hashvalues)
+
+
+def zipf_texts(n_docs, n_words=300, vocab=2000, seed=1):
+    rng = np.random.RandomState(seed)
+    weights = 1 / np.arange(1, vocab + 1)
+    return [' '.join('w{}'.format(i) for i in rng.choice(
+                vocab, size=n_words, p=weights / weights.sum()))
+            for _ in range(n_docs)]
+
+
+def test_streaming_too_common_error_bound():
+    texts = zipf_texts(400)
+    texts += ['common header text here {}'.format(t) for t in texts[:100]]
+    threshold = 0.05
+    exact = get_too_common_shingles(texts, threshold=threshold)
+    assert exact
+    doc_counts = Counter()
+    doc_digests = []
+    for text in texts:
+        digests = list({h.digest() for h in shingle_hashes(text)})
+        doc_digests.append(digests)
+        doc_counts.update(digests)
+    # A small sketch, so that there are some false positives
+    too_common = StreamingTooCommonShingles(
+        threshold=threshold, width=2**12, depth=4)
+    too_common.update([shingle_keys(d) for d in doc_digests])
+    digests = list(doc_counts)
+    mask = too_common.contains(shingle_keys(digests))
+    approx = {d for d, is_common in zip(digests, mask) if is_common}
+    assert exact <= approx
+    false_positives = approx - exact
+    assert false_positives
+    min_count = max(1, threshold * len(texts))
+    error_bound = too_common.sketch.error_bound()
+    assert error_bound == math.e / 2**12 * sum(doc_counts.values())
+    assert all(doc_counts[d] > min_count - error_bound
+               for d in false_positives)
+    estimates = too_common.sketch.estimate(shingle_keys(digests))
+    assert all(est >= doc_counts[d] for d, est in zip(digests, estimates))
+
+
+def test_streaming_same_as_exact():
+    texts = zipf_texts(200) + TEXTS
+    too_common = get_too_common_shingles(texts)
+    expected = [get_min_hash(text, too_common) for text in texts]
+    # Sketch is wide enough to have exact counts, and all texts
+    # are in one batch, so the result must be the same as with exact counts
+    streaming = StreamingTooCommonShingles(width=2**20)
+    items = [{'extracted_text': text} for text in texts]
+    result = list(with_min_hashes(items, streaming, batch_size=len(items)))
+    assert streaming.n_docs == len(texts)
+    for (_, min_hash), expected_min_hash in zip(result, expected):
+        assert np.array_equal(
+            min_hash.hashvalues, expected_min_hash.hashvalues)
@@ -0,0 +1,167 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import os
+import signal
+import socket
+import tempfile
+import time
+from multiprocessing import Process
+
+import formasaurus
+import pytest
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+from scrapy.utils.response import get_base_url
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+
+from undercrawler.model_server import (
+    ModelClient, ModelServerError, recv_message, send_message, serve)
+from undercrawler.spiders import BaseSpider
+import undercrawler.settings
+
+
+HTML = '''
+<html><body>
+<form action="/search"><input name="q" type="text"/>
+  <input type="submit" value="Search"/></form>
+<form action="/login" method="post"><input name="user" type="text"/>
+  <input name="password" type="password"/></form>
+<div class="pagination"><a href="/list?page=2">2</a>
+  <a href="/list?page=3">Next</a></div>
+</body></html>
+'''
+
+
+@pytest.fixture
+def server_socket():
+    with run_server(workers=2) as path:
+        yield path
+
+
+@contextmanager
+def run_server(workers, timeout=10):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'models.sock')
+        process = Process(target=serve, args=(path, workers, timeout))
+        process.start()
+        try:
+            for _ in range(300):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.1)
+            yield path
+        finally:
+            os.kill(process.pid, signal.SIGTERM)
+            process.join()
+
+
+def test_page_models(server_socket):
+    client = ModelClient(server_socket)
+    forms, pagination_urls = client.page_models(
+        HTML, 'http://example.com/list', pagination=True)
+    expected = formasaurus.extract_forms(HTML)
+    assert [info for _, info in forms] == [info for _, info in expected]
+    assert [form.action for form, _ in forms] == ['/search', '/login']
+    assert pagination_urls == ['http://example.com/list?page=2',
+                               'http://example.com/list?page=3']
+    forms, pagination_urls = client.page_models('', 'http://example.com')
+    assert forms == [] and pagination_urls is None
+    with pytest.raises(ModelServerError):
+        client.request([{'method': 'foo'}])
+    client.close()
+
+
+def test_pagination_base_url(server_socket):
+    html = HTML.replace('<html>', '<html><base href="http://example.com/a/">')\
+               .replace('href="/list', 'href="list')
+    response = HtmlResponse('http://example.com/list', body=html.encode('utf8'))
+    client = ModelClient(server_socket)
+    _, pagination_urls = client.page_models(
+        html, get_base_url(response), pagination=True)
+    client.close()
+    assert pagination_urls == [
+        'http://example.com/a/list?page=2', 'http://example.com/a/list?page=3']
+    crawler = get_crawler(BaseSpider)
+    spider = crawler._create_spider(url='http://example.com')
+    assert spider._pagination_urls(response) == pagination_urls
+
+
+def test_stalled_client():
+    with run_server(workers=1, timeout=0.5) as path:
+        stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stalled.connect(path)
+        stalled.sendall(b'\0\0')  # an incomplete message header
+        client = ModelClient(path, timeout=5)
+        forms, _ = client.page_models(HTML, 'http://example.com')
+        assert len(forms) == 2
+        assert stalled.recv(1) == b''  # closed by the server
+        stalled.close()
+        client.close()
+
+
+def test_unavailable():
+    client = ModelClient('/nonexistent/models.sock')
+    with pytest.raises(ModelServerError):
+        client.page_models(HTML, 'http://example.com')
+
+
+def test_messages():
+    a, b = socket.socketpair()
+    send_message(a, {'requests': ['ы' * 1000]})
+    assert recv_message(b) == {'requests': ['ы' * 1000]}
+    a.close()
+    assert recv_message(b) is None
+
+
+def test_threads(server_socket):
+    client = ModelClient(server_socket)
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(
+            lambda _: client.page_models(HTML, 'http://example.com/list'),
+            range(20)))
+    assert all(len(forms) == 2 for forms, _ in results)
+    assert 1 <= len(client._socks) <= 4
+    client.close()
+    assert not client._socks
+
+
+class DeferredModelClient:
+    def __init__(self, result):
+        self.result = result
+
+    def deferred_page_models(self, html, base_url, pagination=False):
+        if isinstance(self.result, Exception):
+            return defer.fail(self.result)
+        return defer.succeed(self.result)
+
+
+@pytest.mark.parametrize('result', [
+    ([], ['http://example.com/list?page=9']),
+    ModelServerError('server is down'),
+])
+def test_spider_parse_deferred(result):
+    settings = Settings()
+    settings.setmodule(undercrawler.settings)
+    settings.update({'SPLASH_URL': None, 'CRAZY_SEARCH_ENABLED': False,
+                     'MODEL_SERVER_SOCKET': '/tmp/models.sock'})
+    crawler = get_crawler(BaseSpider, settings.copy_to_dict())
+    spider = crawler._create_spider(url='http://example.com')
+    spider._model_client = DeferredModelClient(result)
+    url = 'http://example.com/list'
+    response = HtmlResponse(url, body=HTML.encode('utf8'),
+                            request=Request(url, meta={'depth': 1}))
+    output = []
+    spider.parse_first(response).addCallback(output.extend)
+    items = [x for x in output if not isinstance(x, Request)]
+    assert len(items) == 1
+    forms = items[0]['metadata']['forms']
+    page_urls = {r.url for r in output
+                 if isinstance(r, Request) and r.meta.get('is_page')}
+    if isinstance(result, Exception):
+        assert len(forms) == 2  # extracted locally
+        assert 'http://example.com/list?page=2' in page_urls
+    else:
+        assert forms == []
+        assert page_urls == {'http://example.com/list?page=9'}
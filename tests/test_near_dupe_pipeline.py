@@ -0,0 +1,78 @@
+import pytest
+from scrapy import Request
+from scrapy.exceptions import DropItem
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+
+from undercrawler import near_dupe_pipeline
+from undercrawler.near_dupe_pipeline import NearDuplicatePipeline
+from undercrawler.spiders import BaseSpider
+import undercrawler.settings
+
+
+TEXT = '\n'.join(
+    'line {} of some page with enough words in it'.format(i)
+    for i in range(50))
+
+
+def make_item(url, text):
+    return {'url': url, 'extracted_text': text, 'metadata': {}}
+
+
+def test_mark():
+    pipeline = NearDuplicatePipeline()
+    a = pipeline.process_item(make_item('a', TEXT), None)
+    b = pipeline.process_item(make_item('b', TEXT + '\nfooter'), None)
+    c = pipeline.process_item(make_item('c', TEXT.upper()), None)
+    assert 'near_duplicate_of' not in a['metadata']
+    assert b['metadata']['near_duplicate_of'] == 'a'
+    assert 'near_duplicate_of' not in c['metadata']
+
+
+def test_drop():
+    pipeline = NearDuplicatePipeline(action='drop')
+    pipeline.process_item(make_item('a', TEXT), None)
+    with pytest.raises(DropItem):
+        pipeline.process_item(make_item('b', TEXT), None)
+    media_item = {'url': 'c', 'obj_stored_url': 'foo'}
+    assert pipeline.process_item(media_item, None) is media_item
+
+
+@pytest.mark.parametrize('eviction', ['fifo', 'lru'])
+def test_eviction(eviction):
+    pipeline = NearDuplicatePipeline(max_items=2, eviction=eviction)
+    for url, text in [('a', TEXT), ('b', TEXT.upper()), ('a2', TEXT),
+                      ('c', TEXT.title())]:
+        pipeline.process_item(make_item(url, text), None)
+    assert len(pipeline.index) == 2
+    item = pipeline.process_item(make_item('a3', TEXT), None)
+    if eviction == 'lru':
+        assert item['metadata']['near_duplicate_of'] == 'a'
+    else:
+        assert 'near_duplicate_of' not in item['metadata']
+
+
+def test_spider_text(monkeypatch):
+    settings = Settings()
+    settings.setmodule(undercrawler.settings)
+    settings.update({'SPLASH_URL': None, 'NEAR_DUPE_ENABLED': True,
+                     'FOLLOW_LINKS': False})
+    crawler = get_crawler(BaseSpider, settings.copy_to_dict())
+    spider = crawler._create_spider(url='http://example.com')
+    html = '<html><body><p>{}</p></body></html>'.format(TEXT)
+    items = []
+    for url in ['http://example.com/a', 'http://example.com/b']:
+        response = HtmlResponse(url, body=html.encode('utf8'),
+                                request=Request(url, meta={'depth': 1}))
+        items.extend(spider.parse(response))
+    assert items[0]._body_text == TEXT
+    assert '_body_text' not in dict(items[0])
+
+    def no_parsing(*args, **kwargs):
+        raise AssertionError('page parsed again')
+    monkeypatch.setattr(near_dupe_pipeline, 'Selector', no_parsing)
+    pipeline = NearDuplicatePipeline()
+    pipeline.process_item(items[0], spider)
+    item = pipeline.process_item(items[1], spider)
+    assert item['metadata']['near_duplicate_of'] == 'http://example.com/a'
@@ -0,0 +1,51 @@
+from scrapy.statscollectors import StatsCollector
+from scrapy.utils.test import get_crawler
+from scrapy_cdr import CDRItem
+from twisted.internet.defer import Deferred
+
+from undercrawler.raw_content_pipeline import RawContentStorePipeline
+from scripts.utils import RawContentReader
+
+
+def make_item(url, raw_content):
+    return CDRItem(url=url, raw_content=raw_content, metadata={})
+
+
+def process_item(pipeline, item):
+    result = pipeline.process_item(item, None)
+    return result.result if isinstance(result, Deferred) else result
+
+
+def test_raw_content_store(tmpdir):
+    pipeline = RawContentStorePipeline('file://{}'.format(tmpdir))
+    items = []
+    for url, raw_content in [('http://example.com/a', '<b>ü</b>'),
+                             ('http://example.com/b', '<b>ü</b>'),
+                             ('http://example.com/c', '<b>c</b>')]:
+        items.append(process_item(pipeline, make_item(url, raw_content)))
+    assert all('raw_content' not in item for item in items)
+    hashes = [item['metadata']['raw_content_hash'] for item in items]
+    assert hashes[0] == hashes[1] != hashes[2]
+    assert len(tmpdir.listdir()) == 2
+    reader = RawContentReader(str(tmpdir))
+    assert [reader(item) for item in items] == \
+        ['<b>ü</b>', '<b>ü</b>', '<b>c</b>']
+
+
+def test_stored_cache_size(tmpdir):
+    stats = StatsCollector(get_crawler())
+    pipeline = RawContentStorePipeline(str(tmpdir), stats=stats, cache_size=2)
+    items = [process_item(pipeline, make_item('http://example.com', c))
+             for c in ['a', 'b', 'a', 'c', 'a', 'b']]
+    # "b" is evicted by "c", "a" is kept as it was used recently
+    assert stats.get_value('raw_content_store/stored') == 4
+    assert stats.get_value('raw_content_store/deduplicated') == 2
+    assert len(pipeline.stored) == 2
+    reader = RawContentReader(str(tmpdir))
+    assert ''.join(reader(item) for item in items) == 'abacab'
+
+
+def test_no_raw_content(tmpdir):
+    pipeline = RawContentStorePipeline(str(tmpdir))
+    item = {'url': 'http://example.com/file.pdf'}
+    assert process_item(pipeline, item) == item
@@ -0,0 +1,97 @@
+import gzip
+import json
+
+import pytest
+
+from scripts.utils import crawl_outputs, item_reader, map_crawl_outputs, \
+    peek_too_common_shingles
+from undercrawler.export_pipeline import CompressedExportPipeline
+
+
+ITEMS = [{'url': 'http://example.com/{}'.format(i),
+          'extracted_text': 'common text\nitem {} ü'.format(i)}
+         for i in range(10)]
+
+
+def write_items(path, as_array=False, compress=None):
+    lines = [json.dumps(item) for item in ITEMS]
+    if as_array:
+        data = '[' + ',\n'.join(lines) + ']\n'
+    else:
+        data = '\n'.join(lines) + '\n'
+    data = data.encode('utf8')
+    if compress == 'gz':
+        data = gzip.compress(data)
+    elif compress == 'zst':
+        zstandard = pytest.importorskip('zstandard')
+        data = zstandard.ZstdCompressor().compress(data)
+    path.write_binary(data)
+    return str(path)
+
+
+@pytest.mark.parametrize('as_array', [False, True])
+@pytest.mark.parametrize('compress', [None, 'gz', 'zst'])
+def test_item_reader(tmpdir, as_array, compress):
+    filename = 'out.json' if as_array else 'out.jl'
+    if compress:
+        filename += '.' + compress
+    path = write_items(tmpdir.join(filename), as_array, compress)
+    assert list(item_reader(path, batch_size=3)) == ITEMS
+    assert list(item_reader(path, limit=4)) == ITEMS[:4]
+
+
+def test_item_reader_truncated(tmpdir):
+    path = write_items(tmpdir.join('out.jl'))
+    with open(path, 'a') as f:
+        f.write('{"url": "trunc')
+    assert list(item_reader(path)) == ITEMS
+    with open(path, 'a') as f:
+        f.write('\n{"url": "trunc')
+    with pytest.raises(AssertionError):
+        list(item_reader(path))
+
+
+def test_empty_file(tmpdir):
+    path = tmpdir.join('out.jl')
+    path.write('')
+    assert list(item_reader(str(path))) == []
+
+
+def test_peek_too_common_shingles():
+    items = iter(ITEMS)
+    too_common, items = peek_too_common_shingles(items, limit=5)
+    assert len(too_common) == 1
+    assert list(items) == ITEMS
+
+
+def count_items(name, path):
+    n_items = sum(1 for _ in item_reader(path, progress=False))
+    print(name, n_items)
+    return n_items
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_map_crawl_outputs(tmpdir, capsys, jobs):
+    for filename in ['b.jl', 'a.jl.gz', 'c.json']:
+        write_items(tmpdir.join(filename),
+                    compress='gz' if filename.endswith('.gz') else None)
+    tmpdir.join('manifest.json.tmp').write('')
+    results = list(map_crawl_outputs(count_items, str(tmpdir), jobs=jobs))
+    assert results == [('a.jl.gz', 10), ('b.jl', 10), ('c.json', 10)]
+    assert capsys.readouterr().out == 'a.jl.gz 10\nb.jl 10\nc.json 10\n'
+
+
+def test_crawl_outputs_export_dir(tmpdir):
+    pipeline = CompressedExportPipeline(str(tmpdir), rotate_bytes=1, index=True)
+    pipeline.open_spider(None)
+    for item in ITEMS[:3]:
+        pipeline.process_item(item, None)
+    pipeline.close_spider(None)
+    assert tmpdir.join('manifest.json').exists()
+    # Left unfinished by a crashed crawl
+    tmpdir.join('items-00003.jl.gz').write_binary(b'\x1f\x8b\x08')
+    outputs = crawl_outputs(str(tmpdir))
+    assert [name for name, _ in outputs] == [
+        'items-00000.jl.gz', 'items-00001.jl.gz', 'items-00002.jl.gz']
+    assert [item for _, path in outputs
+            for item in item_reader(path, progress=False)] == ITEMS[:3]
@@ -0,0 +1,67 @@
+import re
+
+from scrapy.utils.test import get_crawler
+
+from undercrawler.seeds import AllowedUrls, SeedUrls
+from undercrawler.spiders import BaseSpider, allowed_re
+
+
+SEEDS = [
+    'http://example.com',
+    'https://www.example.org/shop/',
+    'http://blog.example.net/posts?page=1',
+    'http://127.0.0.1:8781/',
+]
+URLS = [
+    'http://example.com/', 'https://www.example.com/a', 'http://a.b.example.com',
+    'http://EXAMPLE.com/A', 'http://example.com:8080/', 'ftp://example.com/',
+    'http://example.org/shop/1', 'http://www.example.org/shop',
+    'http://example.org/about', 'http://news.example.org/shop/',
+    'http://blog.example.net/posts?page=1&sort=2', 'http://blog.example.net/',
+    'http://www.blog.example.net/posts?page=1', 'http://example.net/posts',
+    'http://127.0.0.1:8781/page/1', 'http://127.0.0.1:8782/page/1',
+    'http://other.com/http://example.com/', 'mailto:foo@example.com',
+]
+
+
+def test_allowed_urls_same_as_regexps():
+    for hard_url_constraint in [False, True]:
+        allowed = AllowedUrls()
+        for url in SEEDS:
+            assert allowed.add(url, hard_url_constraint)
+            assert not allowed.add(url, hard_url_constraint)
+        regexps = [allowed_re(url, hard_url_constraint) for url in SEEDS]
+        for url in URLS:
+            assert allowed.matches(url) == \
+                any(regexp.search(url) for regexp in regexps), \
+                (url, hard_url_constraint)
+
+
+def test_seed_urls(tmpdir):
+    path = tmpdir.join('urls.txt')
+    path.write('\n'.join([
+        '# seeds', 'example.com', ' http://example.com ', '',
+        'http://example.com/?b=1&a=2', 'http://example.com/?a=2&b=1',
+        'https://example.com', 'http://foo.com/\t',
+    ]))
+    seeds = SeedUrls(str(path))
+    expected = ['http://example.com', 'http://example.com/?b=1&a=2',
+                'https://example.com', 'http://foo.com/']
+    assert list(seeds) == expected
+    assert list(seeds) == expected
+    spider = BaseSpider(url=str(path))
+    assert list(spider.start_urls) == expected
+
+
+def test_migrate_allowed_regexps():
+    crawler = get_crawler(BaseSpider, {'SPLASH_URL': None})
+    spider = crawler._create_spider(url='http://example.com')
+    spider.state = {'allowed': {allowed_re('http://example.com', False)}}
+    assert spider.link_extractor.matches('http://www.example.com/a')
+    assert not spider.link_extractor.matches('http://example.org/a')
+    allowed = spider.allowed
+    assert isinstance(allowed, AllowedUrls)
+    assert spider.allowed is allowed
+    assert isinstance(allowed.regexps[0], type(re.compile('')))
+    allowed.add('http://example.org', False)
+    assert spider.link_extractor.matches('http://example.org/a')
@@ -0,0 +1,84 @@
+import gzip
+import tracemalloc
+
+from scrapy import Request
+from scrapy.http import TextResponse
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+
+from undercrawler.sitemaps import iter_sitemap
+from undercrawler.spiders import BaseSpider
+import undercrawler.settings
+
+
+def sitemap(n_urls, extra_urls=()):
+    urls = list(extra_urls) + [
+        'http://example.com/page/{}'.format(i) for i in range(n_urls)]
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{}'
+            '</urlset>'.format(''.join(
+                '<url><loc>{}</loc><lastmod>2017-01-01</lastmod></url>'
+                .format(url) for url in urls))).encode('utf8')
+
+
+def test_iter_sitemap_large():
+    body = gzip.compress(sitemap(50000))
+    tracemalloc.start()
+    try:
+        n_urls = sum(1 for _ in iter_sitemap(body))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert n_urls == 50000
+    assert peak < 2**20
+
+
+def test_iter_sitemap_errors():
+    body = sitemap(1000)
+    urls = list(iter_sitemap(body, max_size=len(body) // 2))
+    assert 100 < len(urls) < 1000
+    assert urls[:2] == [('url', 'http://example.com/page/0'),
+                        ('url', 'http://example.com/page/1')]
+    assert list(iter_sitemap(b'not a sitemap')) == []
+    assert list(iter_sitemap(b'\x1f\x8b broken gzip')) == []
+
+
+def make_spider(**extra_settings):
+    settings = Settings()
+    settings.setmodule(undercrawler.settings)
+    settings.set('SPLASH_URL', None)
+    settings.update(extra_settings)
+    crawler = get_crawler(BaseSpider, settings.copy_to_dict())
+    return crawler._create_spider(url='http://example.com')
+
+
+def response(url, body):
+    return TextResponse(url, body=body, encoding='utf8',
+                        request=Request(url, meta={'depth': 0}))
+
+
+def test_sitemap_seeding():
+    spider = make_spider(SITEMAP_SEEDING=True, SITEMAP_MAX_URLS=10)
+    requests = [r for r in spider.parse_first(
+                    response('http://example.com', b'<html></html>'))
+                if isinstance(r, Request) and r.callback != spider.parse]
+    assert [r.url for r in requests] == [
+        'http://example.com/robots.txt', 'http://example.com/sitemap.xml']
+    assert requests[0].callback == spider.parse_robots
+
+    sitemaps = list(spider.parse_robots(response(
+        'http://example.com/robots.txt',
+        b'User-agent: *\nSitemap: http://example.com/s.xml.gz\n')))
+    assert [r.url for r in sitemaps] == ['http://example.com/s.xml.gz']
+    assert sitemaps[0].callback == spider.parse_sitemap
+
+    body = gzip.compress(sitemap(20, extra_urls=[
+        'http://other.com/{}'.format(i) for i in range(3)]))
+    requests = list(spider.parse_sitemap(
+        response('http://example.com/s.xml.gz', body)))
+    assert [r.url for r in requests] == [
+        'http://example.com/page/{}'.format(i) for i in range(10)]
+    assert all(r.meta['from_sitemap'] for r in requests)
+    assert spider.state['sitemap_requests'] == 10
+    assert spider.crawler.stats.get_value('sitemap/sitemaps') == 2
+    assert spider.crawler.stats.get_value('sitemap/urls') == 10
@@ -1,9 +1,15 @@
+import json
 import os.path
 
 from PIL import Image
 import pytest
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+from scrapy_splash import SplashJsonResponse
 from twisted.web.resource import Resource
 
+import undercrawler.settings
+from undercrawler.spiders import BaseSpider
 from undercrawler.utils import using_splash
 from .utils import text_resource, html, paths_set, find_item, inlineCallbacks
 from .mockserver import MockServer
@@ -112,6 +118,31 @@ def test_hh(settings):
         assert 'hello' in item['raw_content']
 
 
+def test_hh_budget_exhausted():
+    settings = Settings()
+    settings.setmodule(undercrawler.settings)
+    settings.update({'SPLASH_URL': 'http://127.0.0.1:8050', 'RUN_HH': True,
+                     'CRAZY_SEARCH_ENABLED': False})
+    crawler = get_crawler(BaseSpider, settings.copy_to_dict())
+    spider = crawler._create_spider(url='http://example.com')
+    assert spider.use_splash
+
+    def parse(url, **data):
+        request = spider.make_request(url, meta={'depth': 1})
+        request.meta['_splash_processed'] = True
+        data.update(url=url, html=html('partial'), http_status=200)
+        return list(spider.parse(SplashJsonResponse(
+            'http://127.0.0.1:8050/execute', request=request,
+            headers={'Content-Type': 'application/json'},
+            body=json.dumps(data).encode('utf8'))))
+
+    items = parse('http://example.com/slow', budget_exhausted=True)
+    assert items[0]['raw_content'] == html('partial')
+    assert crawler.stats.get_value('hh/budget_exhausted') == 1
+    parse('http://example.com/fast')
+    assert crawler.stats.get_value('hh/budget_exhausted') == 1
+
+
 FILE_CONTENTS = b'\x98\x11Pr\xe7\x17\x8f'
 
 
@@ -0,0 +1,13 @@
+import subprocess
+import sys
+
+
+def test_models_not_loaded_on_import():
+    # formasaurus and autopager are slow to import, they are loaded
+    # only when the spider starts parsing pages
+    code = ('import sys, undercrawler.spiders; '
+            'print(",".join(m for m in ["formasaurus", "autopager", "sklearn"]'
+            ' if m in sys.modules))')
+    output = subprocess.check_output([sys.executable, '-c', code],
+                                     stderr=subprocess.DEVNULL)
+    assert output.decode('utf8').strip() == ''
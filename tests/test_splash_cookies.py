@@ -0,0 +1,70 @@
+import json
+
+from scrapy.statscollectors import StatsCollector
+from scrapy.utils.test import get_crawler
+from scrapy_splash import SplashRequest, SplashJsonResponse
+
+from undercrawler.middleware import SplashDeltaCookiesMiddleware
+
+
+def har(name, value, domain):
+    return {'name': name, 'value': value, 'domain': domain, 'path': '/',
+            'secure': False, 'httpOnly': False}
+
+
+def splash_response(request, data):
+    request.meta['_splash_processed'] = True
+    return SplashJsonResponse(
+        request.url, body=json.dumps(data).encode('utf8'),
+        headers={'Content-Type': 'application/json'}, request=request)
+
+
+def test_delta_cookies():
+    stats = StatsCollector(get_crawler())
+    mw = SplashDeltaCookiesMiddleware(stats=stats)
+    request = SplashRequest('http://www.example.com/a', endpoint='execute')
+    mw.process_request(request, None)
+    assert request.meta['splash']['args']['cookies'] == []
+    assert request.meta['splash']['args']['cookies_delta']
+
+    response = mw.process_response(request, splash_response(request, {
+        'cookies_delta': True,
+        'cookies': [har('session', '1', '.example.com'),
+                    har('pref', 'a', 'www.example.com'),
+                    har('tracker', 'x' * 100, '.tracker.net')],
+        'removed_cookies': {},
+    }), None)
+    assert {c.name for c in response.cookiejar} == \
+        {'session', 'pref', 'tracker'}
+
+    request = SplashRequest('http://blog.example.com/b', endpoint='execute')
+    mw.process_request(request, None)
+    sent = request.meta['splash']['args']['cookies']
+    assert [c['name'] for c in sent] == ['session']
+
+    response = mw.process_response(request, splash_response(request, {
+        'cookies_delta': True,
+        'cookies': [har('other', '2', 'blog.example.com')],
+        'removed_cookies': sent,
+    }), None)
+    assert {c.name for c in response.cookiejar} == \
+        {'pref', 'tracker', 'other'}
+    assert stats.get_value('splash_cookies/sent') == 1
+    assert stats.get_value('splash_cookies/received') == 4
+    assert stats.get_value('splash_cookies/request_bytes') > 0
+    assert stats.get_value('splash_cookies/response_bytes') > 0
+
+
+def test_full_cookies_response():
+    mw = SplashDeltaCookiesMiddleware()
+    request = SplashRequest('http://example.com/a', endpoint='execute')
+    mw.process_request(request, None)
+    mw.process_response(request, splash_response(request, {
+        'cookies': [har('a', '1', 'example.com'), har('b', '1', 'example.com')],
+    }), None)
+    request = SplashRequest('http://example.com/b', endpoint='execute')
+    mw.process_request(request, None)
+    response = mw.process_response(request, splash_response(request, {
+        'cookies': [har('a', '2', 'example.com')],
+    }), None)
+    assert {(c.name, c.value) for c in response.cookiejar} == {('a', '2')}
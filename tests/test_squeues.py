@@ -0,0 +1,113 @@
+import pickle
+
+import pytest
+from scrapy.settings import Settings
+from scrapy.squeues import PickleFifoDiskQueue
+from scrapy.utils.test import get_crawler
+from scrapy_splash import SplashRequest, SplashFormRequest
+
+from undercrawler.spiders import BaseSpider
+from undercrawler.squeues import CompactFifoDiskQueue, CompactLifoDiskQueue
+import undercrawler.settings
+
+
+def make_crawler(**extra_settings):
+    settings = Settings()
+    settings.setmodule(undercrawler.settings)
+    settings.set('SPLASH_URL', 'http://127.0.0.1:8050')
+    settings.update(extra_settings)
+    crawler = get_crawler(BaseSpider, settings.copy_to_dict())
+    crawler.spider = crawler._create_spider(url='http://example.com')
+    return crawler
+
+
+def test_round_trip(tmpdir):
+    crawler = make_crawler()
+    spider = crawler.spider
+    assert spider.use_splash
+    requests = [
+        spider.make_request('http://example.com/a'),
+        spider.make_request(
+            'http://example.com/b', priority=-3,
+            meta={'depth': 2, 'link_features': [1, 5, 7]}),
+        spider.make_request(
+            'http://example.com/search', cls=SplashFormRequest,
+            formdata={'q': 'foo'}, callback=spider.parse_first),
+    ]
+    requests[1].meta['splash']['args']['wait'] = 1
+    queue = CompactFifoDiskQueue.from_crawler(
+        crawler, str(tmpdir.join('queue')))
+    for request in requests:
+        queue.push(request)
+    assert len(queue) == len(requests)
+    for request in requests:
+        restored = queue.pop()
+        assert type(restored) is type(request)
+        assert restored.to_dict(spider=spider) == \
+            request.to_dict(spider=spider)
+    assert queue.pop() is None
+    queue.close()
+    stats = crawler.stats
+    assert stats.get_value('disk_queue/requests') == len(requests)
+    pickle_size = sum(len(pickle.dumps(r.to_dict(spider=spider), protocol=4))
+                      for r in requests)
+    assert stats.get_value('disk_queue/bytes') < pickle_size / 10
+
+
+def test_resume(tmpdir):
+    path = str(tmpdir.join('queue'))
+    crawler = make_crawler()
+    queue = CompactLifoDiskQueue.from_crawler(crawler, path)
+    queue.push(crawler.spider.make_request('http://example.com/a'))
+    queue.push(crawler.spider.make_request('http://example.com/b'))
+    queue.close()
+    crawler = make_crawler()
+    queue = CompactLifoDiskQueue.from_crawler(crawler, path)
+    request = queue.pop()
+    assert isinstance(request, SplashRequest)
+    assert request.url == 'http://example.com/b'
+    assert request.meta['splash']['args']['lua_source'] == \
+        crawler.spider.lua_source
+    assert queue.peek().url == 'http://example.com/a'
+    queue.close()
+
+
+def test_without_splash(tmpdir):
+    crawler = make_crawler(SPLASH_URL=None)
+    spider = crawler.spider
+    assert not spider.use_splash
+    queue = CompactFifoDiskQueue.from_crawler(
+        crawler, str(tmpdir.join('queue')))
+    request = spider.make_request('http://example.com/a', meta={'x': 1})
+    queue.push(request)
+    restored = queue.pop()
+    assert restored.to_dict(spider=spider) == request.to_dict(spider=spider)
+    queue.close()
+
+
+def test_read_pickle_queue(tmpdir):
+    path = str(tmpdir.join('queue'))
+    crawler = make_crawler()
+    queue = PickleFifoDiskQueue.from_crawler(crawler, path)
+    queue.push(crawler.spider.make_request('http://example.com/a'))
+    queue.close()
+    queue = CompactFifoDiskQueue.from_crawler(crawler, path)
+    request = queue.pop()
+    assert isinstance(request, SplashRequest)
+    assert request.url == 'http://example.com/a'
+    queue.close()
+
+
+def test_unserializable(tmpdir):
+    crawler = make_crawler()
+    spider = crawler.spider
+    queue = CompactFifoDiskQueue.from_crawler(
+        crawler, str(tmpdir.join('queue')))
+    request = spider.make_request(
+        'http://example.com/a', meta={'key': lambda: None})
+    with pytest.raises(ValueError):
+        queue.push(request)
+    assert len(queue) == 0
+    queue.push(spider.make_request('http://example.com/b'))
+    assert queue.pop().url == 'http://example.com/b'
+    queue.close()
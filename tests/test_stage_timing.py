@@ -0,0 +1,42 @@
+import time
+
+from scrapy import Request
+from scrapy.utils.test import get_crawler
+
+from undercrawler.dupe_filter import DupeFilter
+from undercrawler.stage_timing import StageTimer
+
+
+def test_stage_timer():
+    crawler = get_crawler(settings_dict={'STAGE_TIMING_ENABLED': True})
+    timer = StageTimer.from_crawler(crawler)
+    for _ in range(3):
+        with timer('foo'):
+            pass
+    with timer('foo'):
+        time.sleep(0.002)
+    stats = crawler.stats.get_stats()
+    assert stats['timing/foo/count'] == 4
+    assert stats['timing/foo/total_ms'] >= 2
+    assert stats['timing/foo/le_1ms'] == 3
+    assert stats['timing/foo/le_5ms'] == 1
+    timer.record('foo', 2)
+    assert crawler.stats.get_value('timing/foo/gt_1000ms') == 1
+
+
+def test_stage_timer_disabled():
+    crawler = get_crawler()
+    timer = StageTimer.from_crawler(crawler)
+    assert timer('foo') is StageTimer()('bar')
+    with timer('foo'):
+        pass
+    assert not any(key.startswith('timing/')
+                   for key in crawler.stats.get_stats())
+
+
+def test_dupe_filter_timing():
+    crawler = get_crawler(settings_dict={'STAGE_TIMING_ENABLED': True})
+    dupe_filter = DupeFilter.from_crawler(crawler)
+    assert not dupe_filter.request_seen(Request('http://example.com'))
+    assert dupe_filter.request_seen(Request('http://example.com'))
+    assert crawler.stats.get_value('timing/dupefilter/fingerprint/count') == 2
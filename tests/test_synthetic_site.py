@@ -0,0 +1,98 @@
+from twisted.web.test.requesthelper import DummyRequest
+
+from .conftest import make_crawler
+from .mockserver import MockServer
+from .synthetic_site import SyntheticSite, canonical_path
+from .utils import inlineCallbacks, paths_set
+
+
+def render(site, path, **args):
+    request = DummyRequest(path.strip('/').split('/'))
+    request.path = path.encode()
+    request.args = {k.encode(): [str(v).encode()] for k, v in args.items()}
+    return site.render_GET(request).decode('utf8'), request.responseCode
+
+
+def test_pages():
+    site = SyntheticSite()
+    root, _ = render(site, '/')
+    assert root == render(site, '/page/0')[0]
+    assert render(site, '/page/1') == render(SyntheticSite(), '/page/1')
+    assert render(site, '/page/1') != render(site, '/page/2')
+    for i in range(1, site.fan_out + 1):
+        assert 'href="/page/{}'.format(i) in root
+    assert '<form action="/search"' in root
+    assert render(site, '/page/{}'.format(site.n_pages))[1] == 404
+    assert render(site, '/foo')[1] == 404
+
+
+def test_features():
+    site = SyntheticSite()
+    pages = [render(site, '/page/{}'.format(i))[0] for i in range(200)]
+    assert any('onclick=' in page for page in pages)
+    assert any('<iframe src="/frame/' in page for page in pages)
+    assert any('href="/media/' in page for page in pages)
+    assert any('sessionid=' in page for page in pages)
+    listing, _ = render(site, '/list/0', page=2)
+    assert 'href="/list/0?page=3">Next<' in listing
+    last, _ = render(site, '/list/0', page=site.pagination_length)
+    assert '>Next<' not in last
+    search, _ = render(site, '/search', q='a')
+    assert search.count('>Result ') == site.search_results
+    assert render(site, '/search', q='a') == render(site, '/search', q='a')
+    assert len(site.media(1)) == site.media_size
+    assert site.media(1) != site.media(2)
+    site.sort_links = 2
+    page, _ = render(site, '/page/1')
+    assert 'href="/page/1?sort=name"' in page
+    assert 'sort=price' not in page
+
+
+class SmallSyntheticSite(SyntheticSite):
+    n_pages = 30
+    n_listings = 1
+    pagination_length = 3
+    search_form = False
+
+
+@inlineCallbacks
+def test_crawl(settings):
+    crawler = make_crawler(settings, AUTOLOGIN_ENABLED=False)
+    with MockServer(SmallSyntheticSite) as s:
+        yield crawler.crawl(url=s.root_url)
+    spider = crawler.spider
+    paths = {canonical_path(path)
+             for path in paths_set(spider.collected_items)}
+    assert {'/page/{}'.format(i) for i in range(30)} <= paths
+    assert {'/list/0', '/list/0?page=2', '/list/0?page=3'} <= paths
+
+
+class UnlinkedSyntheticSite(SmallSyntheticSite):
+    fan_out = 0
+    random_links = 0
+    n_listings = 0
+    onclick_ratio = iframe_ratio = media_ratio = 0
+    sitemap_size = 7
+
+
+def test_sitemaps():
+    site = UnlinkedSyntheticSite()
+    robots, _ = render(site, '/robots.txt')
+    assert 'Sitemap: /sitemap_index.xml' in robots
+    index, _ = render(site, '/sitemap_index.xml')
+    assert index.count('<sitemap>') == 5
+    assert '/sitemaps/4.xml.gz' in index
+    assert render(SmallSyntheticSite(), '/robots.txt')[1] == 404
+
+
+@inlineCallbacks
+def test_crawl_sitemap_seeding(settings):
+    crawler = make_crawler(settings, AUTOLOGIN_ENABLED=False,
+                           SITEMAP_SEEDING=True)
+    with MockServer(UnlinkedSyntheticSite) as s:
+        yield crawler.crawl(url=s.root_url)
+    spider = crawler.spider
+    paths = {canonical_path(path)
+             for path in paths_set(spider.collected_items)}
+    assert paths == {'/page/{}'.format(i) for i in range(30)}
+    assert crawler.stats.get_value('sitemap/urls') == 30
@@ -7,21 +7,46 @@
     var _clickCheckedProperty = _HH_PROPERTY + 'clickChecked';
     var _mouseoverCheckedProperty = _HH_PROPERTY + 'mouseoverChecked';
 
-    // Calling window.scrollTo() too quickly doesn't seem to work well,
-    // therefore all of our scrolling APIs introduce a small delay. I
-    // picked this value experimentally by messing around with Twitter
-    // and dontsellbodies.org.
-    var _SCROLL_DELAY_MS = 1000;
-
     // True if addEventListener() has already been patched.
     var _addEventListenerIsPatched = false;
 
+    // True if some stage was skipped or cut short because the render
+    // budget was spent.
+    var _budgetExhausted = false;
+
+    // Time (as in Date.now()) when the render budget is spent, or null
+    // if there is no budget. (See setDeadline().)
+    var _deadline = null;
+
     // If true, then diagnostics will be logged to console.
     var _debug = false;
 
     // A registry of events and the elements that have listeners for each event.
     var _elementsWithListeners = {};
 
+    // True if fetch() has already been patched.
+    var _fetchIsPatched = false;
+
+    // The page is idle when there are no pending XHR or fetch requests and
+    // no DOM mutations for this many milliseconds. (See whenIdle().)
+    var _idleMs = 500;
+
+    // Maximum time to wait for the page to become idle, in milliseconds.
+    var _idleTimeoutMs = 3000;
+
+    // Time of the last DOM mutation, request start or finish, or action
+    // triggered by HH.
+    var _lastActivity = Date.now();
+
+    // True if DOM mutations are already observed.
+    var _mutationsAreObserved = false;
+
+    // Number of XHR and fetch requests that were started but not finished.
+    var _pendingRequests = 0;
+
+    // Number of XHR and fetch requests started since the page was loaded.
+    var _requestCount = 0;
+
     // An event used for tracking calls to XHR.send().
     var _xhrInterceptedEvent = _HH_PROPERTY + 'xhrIntercepted';
 
@@ -36,6 +61,17 @@
     // True if XHR.send() has already been patched.
     var _xhrSendIsPatched = false;
 
+    // Return true if the render budget is spent. Stages call this before
+    // starting, so that the rest of the battery is skipped.
+    function budgetExhausted() {
+        if (!_budgetExhausted && timeLeft() <= 0) {
+            debugLog('budgetExhausted: render budget is spent.');
+            _budgetExhausted = true;
+        }
+
+        return _budgetExhausted;
+    }
+
     // Cleans up any mess that Headless Horseman created.
     function cleanup() {
         var p = new Promise();
@@ -160,6 +196,12 @@
         return obj[_HH_PROPERTY];
     }
 
+    // Record that something happened on the page, so that whenIdle() waits
+    // for at least another idle period.
+    function markActivity() {
+        _lastActivity = Date.now();
+    }
+
     // Return true if it looks like mousing over this element triggers an XHR.
     // This is a very rough heuristic.
     // TODO: Fine tune based on real-world sites.
@@ -221,6 +263,24 @@
         return wait(0);
     }
 
+    // Track the time of the last DOM mutation. Only added and removed nodes
+    // and text changes are observed: attributes are changed by HH itself,
+    // and by animations that would keep the page from ever becoming idle.
+    function observeMutations() {
+        if (_mutationsAreObserved || !window.MutationObserver) {
+            return;
+        }
+
+        var observer = new MutationObserver(markActivity);
+        observer.observe(document, {
+            childList: true,
+            characterData: true,
+            subtree: true
+        });
+
+        _mutationsAreObserved = true;
+    }
+
     // Monkey patch addEventListener so that we can track all event
     // registrations. Event listeners are stored on the element itself as
     // well as in a global registry.
@@ -276,6 +336,35 @@
     function patchAll() {
         patchAddEventListener();
         patchXhrSend();
+        patchFetch();
+        observeMutations();
+    }
+
+    // Monkey patch fetch() (if the browser has it) so that we can track
+    // when fetch requests start and finish.
+    function patchFetch() {
+        if (_fetchIsPatched || typeof window.fetch !== 'function') {
+            return;
+        }
+
+        var oldFetch = window.fetch;
+
+        window.fetch = function() {
+            debugLog('patchFetch: Intercepted fetch', arguments[0]);
+            requestStarted();
+
+            try {
+                var result = oldFetch.apply(window, arguments);
+            } catch (e) {
+                requestFinished();
+                throw e;
+            }
+
+            result.then(requestFinished, requestFinished);
+            return result;
+        };
+
+        _fetchIsPatched = true;
     }
 
     // Monkey patch the XHR.send() method so that we can track when
@@ -289,37 +378,28 @@
         prototypeSplash.oldXhrSend = XMLHttpRequest.prototype.send;
 
         XMLHttpRequest.prototype.send = function(body) {
-            var self = this;
-            var oldOnLoad;
+            var finished = false;
 
             debugLog('patchXhrSend: Intercepted XHR send\nbody: ',body);
-            window.dispatchEvent(new Event(_xhrInterceptedEvent));
-
-            oldOnLoad = this.onload;
-
-            this.onload = function() {
-                debugLog('patchXhrSend: XHR onLoad was called.')
 
-                window.dispatchEvent(new Event(_xhrFinishedEvent));
-
-                if (oldOnLoad) {
-                    oldOnLoad.call(self);
+            // "loadend" fires after "load", "error", "abort" and "timeout".
+            function onLoadEnd() {
+                if (!finished) {
+                    finished = true;
+                    debugLog('patchXhrSend: XHR finished.');
+                    requestFinished();
                 }
-            };
-
-            oldOnError = this.onerror;
-
-            this.onerror = function() {
-                debugLog('patchXhrSend: XHR onError was called.')
+            }
 
-                window.dispatchEvent(new Event(_xhrFinishedEvent));
+            this.addEventListener('loadend', onLoadEnd);
+            requestStarted();
 
-                if (oldOnError) {
-                    oldOnError.call(self);
-                }
-            };
-
-            prototypeSplash.oldXhrSend.call(this, body);
+            try {
+                prototypeSplash.oldXhrSend.call(this, body);
+            } catch (e) {
+                onLoadEnd();
+                throw e;
+            }
         };
 
         _xhrSendIsPatched = true;
@@ -366,11 +446,26 @@
         return p;
     }
 
-    // Scroll an element to a given position. This function wraps scrollTo
-    // so that we can introduce a delay. (See note on _SCROLL_DELAY_MS.)
-    // If xhr is true, then after scrolling, it will wait for XHRs to finish.
+    // Called when an XHR or fetch request finishes.
+    function requestFinished() {
+        _pendingRequests = Math.max(0, _pendingRequests - 1);
+        markActivity();
+        window.dispatchEvent(new Event(_xhrFinishedEvent));
+    }
+
+    // Called when an XHR or fetch request starts.
+    function requestStarted() {
+        _pendingRequests++;
+        _requestCount++;
+        markActivity();
+        window.dispatchEvent(new Event(_xhrInterceptedEvent));
+    }
+
+    // Scroll an element to a given position. Calling window.scrollTo() too
+    // quickly doesn't seem to work well, and scroll handlers may start
+    // loading more content, so this waits until the page is idle again.
     // Returns a promise.
-    function scroll(el, x, y, xhr) {
+    function scroll(el, x, y) {
         if (x === 'left') {
             x = 0;
         } else if (x === 'right') {
@@ -400,7 +495,13 @@
             el.scrollTop = y;
         }
 
-        return wait(_SCROLL_DELAY_MS);
+        markActivity();
+        return whenIdle();
+    }
+
+    // Set the time when the render budget is spent, as in Date.now().
+    function setDeadline(deadline) {
+        _deadline = deadline;
     }
 
     // Enable or disable debug mode.
@@ -408,16 +509,30 @@
         _debug = enabled;
     }
 
+    // Set the idle period and the maximum time to wait for it, used by
+    // whenIdle() by default.
+    function setIdle(idleMs, timeoutMs) {
+        _idleMs = idleMs;
+        _idleTimeoutMs = timeoutMs;
+    }
+
     // Enable or disable visual mode.
     function setVisual(enabled) {
         _visual = enabled;
     }
 
+    // Milliseconds left until the render budget is spent.
+    function timeLeft() {
+        return (_deadline === null) ? Infinity : _deadline - Date.now();
+    }
+
     // Simulate an event on an element.
     function trigger(eventName, element) {
         var attributeName = 'on' + eventName;
         var event = new Event(eventName);
 
+        markActivity();
+
         if (element[attributeName]) {
             element[attributeName](event);
         } else {
@@ -434,36 +549,48 @@
     function tryClickXhr(n) {
         var p = new Promise();
 
-        whenAll(
-            whenXhrFinished(),
-            clickXhrElement()
-        ).then(function (values) {
-            var found = values[1]; // The return value from clickXhrElement()
+        if (budgetExhausted()) {
+            debugLog('tryClickXhr: no time left for clicking.');
+            p.resolve();
+            return p;
+        }
 
-            if (found && n > 1) {
-                p.resolve(tryClickXhr(n-1));
-            } else {
+        clickXhrElement().then(function (found) {
+            if (!found) {
                 p.resolve();
+                return;
             }
+
+            whenIdle().then(function () {
+                if (n > 1) {
+                    p.resolve(tryClickXhr(n-1));
+                } else {
+                    p.resolve();
+                }
+            });
         });
 
         return p;
     }
 
     // Try to trigger an infinite scroll XHR. If successful, then repeat
-    // several more times until no XHR is trigger or you hit the max
-    // number of attempts.
+    // several more times until no XHR or fetch is triggered or you hit
+    // the max number of attempts.
     //
     // Returns a promise that is resolved when it is completely finished
     // with all of its scrolling.
     function tryInfiniteScroll(n) {
         var p = new Promise();
 
-        whenAll(
-            whenXhrFinished(),
-            scroll(window, 'left', 'bottom')
-        ).then(function (values) {
-            var intercepted = values[0]; // The return value from whenXhrFinished()
+        if (budgetExhausted()) {
+            debugLog('tryInfiniteScroll: no time left for scrolling.');
+            p.resolve();
+            return p;
+        }
+        var requestCount = _requestCount;
+
+        scroll(window, 'left', 'bottom').then(function () {
+            var intercepted = _requestCount > requestCount;
 
             if (intercepted && n > 1) {
                 p.resolve(tryInfiniteScroll(n-1));
@@ -484,17 +611,25 @@
     function tryMouseoverXhr(n) {
         var p = new Promise();
 
-        whenAll(
-            whenXhrFinished(),
-            mouseoverXhrElement()
-        ).then(function (values) {
-            var found = values[1]; // The return value from mouseoverXhrElement()
+        if (budgetExhausted()) {
+            debugLog('tryMouseoverXhr: no time left for mousing over.');
+            p.resolve();
+            return p;
+        }
 
-            if (found && n > 1) {
-                p.resolve(tryMouseoverXhr(n-1));
-            } else {
+        mouseoverXhrElement().then(function (found) {
+            if (!found) {
                 p.resolve();
+                return;
             }
+
+            whenIdle().then(function () {
+                if (n > 1) {
+                    p.resolve(tryMouseoverXhr(n-1));
+                } else {
+                    p.resolve();
+                }
+            });
         });
 
         return p;
@@ -554,6 +689,46 @@
         return p;
     }
 
+    // Wait until the page is idle: there are no pending XHR or fetch
+    // requests, and nothing happened on the page (see markActivity()) for
+    // idleMs milliseconds, but no longer than timeoutMs milliseconds, or
+    // than the rest of the render budget. Defaults are set with setIdle().
+    //
+    // Returns a promise that is resolved with true if the page became idle,
+    // or with false on timeout.
+    function whenIdle(idleMs, timeoutMs) {
+        var p = new Promise();
+        var start = Date.now();
+
+        idleMs = (idleMs === undefined) ? _idleMs : idleMs;
+        timeoutMs = (timeoutMs === undefined) ? _idleTimeoutMs : timeoutMs;
+        timeoutMs = Math.min(timeoutMs, Math.max(0, timeLeft()));
+
+        function check() {
+            var now = Date.now();
+            var idleFor = now - _lastActivity;
+            var delay;
+
+            if (_pendingRequests === 0 && idleFor >= idleMs) {
+                debugLog('whenIdle: idle after ' + (now - start) + ' ms');
+                p.resolve(true);
+            } else if (now - start >= timeoutMs) {
+                budgetExhausted();
+                debugLog('whenIdle: timed out with ' + _pendingRequests +
+                         ' pending requests');
+                p.resolve(false);
+            } else {
+                // Check again when the page could become idle, or on timeout.
+                delay = (_pendingRequests === 0) ? idleMs - idleFor : idleMs;
+                setTimeout(check, Math.max(
+                    10, Math.min(delay, start + timeoutMs - now)));
+            }
+        }
+
+        check();
+        return p;
+    }
+
     // If any XHRs are opened, then wait for them to complete.
     //
     // Because an XHR may not be opened in the event handler, we wait for
@@ -690,22 +865,29 @@
 
     // Export public functions.
     window[_HH_PROPERTY] = {
+        'budgetExhausted': budgetExhausted,
         'cleanup': cleanup,
         'clickLikelyTriggersXhr': clickLikelyTriggersXhr,
         'clickXhrElement': clickXhrElement,
         'debugLog': debugLog,
         'findElementsWithListener': findElementsWithListener,
         'getHH': getHH,
+        'markActivity': markActivity,
         'mouseoverLikelyTriggersXhr': mouseoverLikelyTriggersXhr,
         'mouseoverXhrElement': mouseoverXhrElement,
         'nextTick': nextTick,
+        'observeMutations': observeMutations,
         'patchAddEventListener': patchAddEventListener,
         'patchAll': patchAll,
+        'patchFetch': patchFetch,
         'patchXhrSend': patchXhrSend,
         'removeOverlays': removeOverlays,
         'scroll': scroll,
+        'setDeadline': setDeadline,
         'setDebug': setDebug,
+        'setIdle': setIdle,
         'setVisual': setVisual,
+        'timeLeft': timeLeft,
         'trigger': trigger,
         'tryClickXhr': tryClickXhr,
         'tryInfiniteScroll': tryInfiniteScroll,
@@ -713,6 +895,7 @@
         'wait': wait,
         'when': when,
         'whenAll': whenAll,
+        'whenIdle': whenIdle,
         'whenXhrFinished': whenXhrFinished
     };
 
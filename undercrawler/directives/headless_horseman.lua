@@ -6,6 +6,64 @@ function get_arg(arg, default)
   end
 end
 
+function time_left(splash, deadline)
+  -- Seconds left until the render budget is spent, or nil without a budget.
+  if deadline == nil then
+    return nil
+  end
+  return (deadline - splash:evaljs("Date.now()")) / 1000
+end
+
+function host(url)
+  return string.lower(string.match(url or "", "^%a[%w+.-]*://([^/?#:]+)") or "")
+end
+
+function same_site(domain, host)
+  -- Cookie domain is the host, its parent domain or a subdomain
+  -- (the same check as in SplashDeltaCookiesMiddleware).
+  domain = string.lower(string.gsub(domain or "", "^%.+", ""))
+  local function ends_with(s, suffix)
+    return #s > #suffix and string.sub(s, -#suffix) == suffix
+  end
+  return domain == "" or domain == host or
+    ends_with(host, "." .. domain) or ends_with(domain, "." .. host)
+end
+
+function cookie_key(cookie)
+  return cookie.name .. "\t" .. (cookie.domain or "") .. "\t" .. (cookie.path or "/")
+end
+
+function cookies_delta(sent, current, hosts)
+  --[[
+  Return cookies for one of hosts that were added or changed compared to
+  sent cookies, and sent cookies that were removed.
+  ]]
+  local sent_by_key = {}
+  for _, cookie in ipairs(sent or {}) do
+    sent_by_key[cookie_key(cookie)] = cookie
+  end
+  local changed, removed, seen = {}, {}, {}
+  for _, cookie in ipairs(current) do
+    local key = cookie_key(cookie)
+    local old = sent_by_key[key]
+    seen[key] = true
+    if old == nil or old.value ~= cookie.value or old.expires ~= cookie.expires then
+      for _, h in ipairs(hosts) do
+        if same_site(cookie.domain, h) then
+          table.insert(changed, cookie)
+          break
+        end
+      end
+    end
+  end
+  for key, cookie in pairs(sent_by_key) do
+    if not seen[key] then
+      table.insert(removed, cookie)
+    end
+  end
+  return changed, removed
+end
+
 function main(splash)
   --[[
   The main Headless Horseman directive. It automatically tries every
@@ -24,6 +82,14 @@ function main(splash)
   local headers = get_arg(splash.args.headers, nil)
   local cookies = get_arg(splash.args.cookies, nil)
   local visual = get_arg(splash.args.visual, false)
+  -- The page is idle when there are no pending XHR or fetch requests
+  -- and no DOM mutations for idle_ms, but we wait at most idle_timeout_ms.
+  local idle_ms = get_arg(splash.args.idle_ms, 500)
+  local idle_timeout_ms = get_arg(splash.args.idle_timeout_ms, 3000)
+  -- Once the render budget is spent (counting from the start of the page
+  -- load), remaining HH stages are skipped, and what is rendered so far
+  -- is returned. 0 means no budget.
+  local render_budget_ms = get_arg(splash.args.render_budget_ms, 0)
 
   -- 1024px is already "desktop" size for most frameworks,
   -- and 768 gives 4:3 aspect ratio.
@@ -56,6 +122,16 @@ function main(splash)
     splash:autoload("__headless_horseman__.setVisual(true);")
   end
 
+  splash:autoload(string.format(
+    "__headless_horseman__.setIdle(%d, %d);",
+    tonumber(idle_ms), tonumber(idle_timeout_ms)))
+  local deadline = nil
+  local budget_exhausted = false
+  if render_budget_ms > 0 then
+    deadline = splash:evaljs("Date.now()") + render_budget_ms
+    splash:autoload(string.format(
+      "__headless_horseman__.setDeadline(%.0f);", deadline))
+  end
   splash:autoload("__headless_horseman__.patchAll();")
   splash:set_viewport_size(viewport_width, viewport_height)
   local ok, reason = splash:go{
@@ -67,11 +143,16 @@ function main(splash)
 
   -- Run a battery of Headless Horseman tests.
 
-  if run_hh then
-    splash:wait_for_resume([[
+  local timeout = time_left(splash, deadline)
+  if run_hh and timeout ~= nil and timeout <= 0 then
+    budget_exhausted = true
+  elseif run_hh then
+    -- Stages check the budget in JS, the timeout is only a safeguard
+    -- for stages that do not finish in time.
+    local ok = splash:wait_for_resume([[
       function main(splash) {
         __headless_horseman__
-          .wait(3000)
+          .whenIdle()
           .then(__headless_horseman__.tryInfiniteScroll, 3)
           .then(__headless_horseman__.tryClickXhr, 3)
           .then(__headless_horseman__.tryMouseoverXhr, 3)
@@ -80,12 +161,32 @@ function main(splash)
        // .then(__headless_horseman__.removeOverlays)
           .then(splash.resume);
       }
-    ]])
+    ]], timeout and timeout + 1 or 0)
+    if not ok and deadline ~= nil and time_left(splash, deadline) <= 0 then
+      budget_exhausted = true
+    end
   end
 
   splash:stop()
   splash:set_viewport_full()
-  splash:wait(1)
+  -- Wait for content loaded after resizing. HH script might be missing
+  -- if the page is not HTML.
+  splash:wait_for_resume([[
+    function main(splash) {
+      if (window.__headless_horseman__) {
+        __headless_horseman__.whenIdle().then(splash.resume);
+      } else {
+        splash.resume();
+      }
+    }
+  ]], idle_timeout_ms / 1000 + 1)
+
+  if deadline ~= nil and not budget_exhausted then
+    budget_exhausted = splash:evaljs([[
+      !!(window.__headless_horseman__ &&
+         __headless_horseman__.budgetExhausted())
+    ]])
+  end
 
   -- Render and return the requested outputs.
 
@@ -110,7 +211,17 @@ function main(splash)
   end
 
   render['url'] = splash:url()
-  render['cookies'] = splash:get_cookies()
+  if splash.args.cookies_delta then
+    render['cookies'], render['removed_cookies'] = cookies_delta(
+      cookies, splash:get_cookies(), {host(url), host(splash:url())})
+    render['cookies_delta'] = true
+  else
+    render['cookies'] = splash:get_cookies()
+  end
+
+  if budget_exhausted then
+    render['budget_exhausted'] = true
+  end
 
   if last_entry then
     local last_response = entries[#entries].response
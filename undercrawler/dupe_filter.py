@@ -1,22 +1,234 @@
+from functools import lru_cache
+import hashlib
+import logging
+import os
 import re
-from copy import deepcopy
+import sys
 
+import numpy as np
+from scrapy.utils.job import job_dir
+from scrapy.utils.python import to_bytes
 from scrapy_splash import SplashAwareDupeFilter
+from scrapy_splash.utils import dict_hash
+
+from .stage_timing import StageTimer
+from .utils import UrlCache
+
+
+logger = logging.getLogger(__name__)
 
 
 class DupeFilter(SplashAwareDupeFilter):
     """
     Consider same urls with and without www and using http or https
     as duplicates.
+
+    If fingerprint_bits is 64 or 128, fingerprints are truncated to this
+    size and kept as raw bytes in a FingerprintSet, and in
+    ``requests.seen.bin`` in JOBDIR. Existing ``requests.seen`` file
+    with full hex fingerprints is migrated to the compact format.
     """
+    stage_timer = StageTimer()
+    fingerprint_sizes = {64, 128}
+
+    def __init__(self, path=None, debug=False, fingerprint_bits=0):
+        self.fingerprint_size = fingerprint_bits // 8
+        # Replaced with the cache shared with the spider in from_crawler
+        self.url_cache = UrlCache()
+        if not fingerprint_bits:
+            super().__init__(path, debug)
+            if path and os.path.exists(_compact_path(path)):
+                logger.warning(
+                    'Compact fingerprints found in %s are not used, '
+                    'set DUPEFILTER_FINGERPRINT_BITS to use them', path)
+            return
+        if fingerprint_bits not in self.fingerprint_sizes:
+            raise ValueError('Unsupported fingerprint size: {}'
+                             .format(fingerprint_bits))
+        super().__init__(None, debug)
+        self.fingerprints = FingerprintSet(self.fingerprint_size)
+        if path:
+            self.file = _open_compact(path, self.fingerprint_size)
+            self.fingerprints.update_from_bytes(self.file.read())
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(job_dir(settings), settings.getbool('DUPEFILTER_DEBUG'),
+                   settings.getint('DUPEFILTER_FINGERPRINT_BITS'))
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        dupe_filter = cls.from_settings(crawler.settings)
+        dupe_filter.stage_timer = StageTimer.from_crawler(crawler)
+        dupe_filter.url_cache = UrlCache.from_crawler(crawler)
+        return dupe_filter
+
+    def request_seen(self, request):
+        if not self.fingerprint_size:
+            return super().request_seen(request)
+        fp = compact_fingerprint(
+            self.request_fingerprint(request), self.fingerprint_size)
+        if fp in self.fingerprints:
+            return True
+        self.fingerprints.add(fp)
+        if self.file:
+            self.file.write(fp)
+        return False
+
     def request_fingerprint(self, request):
+        with self.stage_timer('dupefilter/fingerprint'):
+            return self._request_fingerprint(request)
+
+    def _request_fingerprint(self, request):
+        """ The same fingerprint as SplashAwareDupeFilter computes for
+        a request with normalized url, but without copying the request
+        and using url cache for canonicalization.
+        """
+        url = request.url
+        splash_options = request.meta.get('splash')
         # It's only valid to do this normalization when using splash, which
         # handles redirects "inside" splash. If scrapy sees these redirects,
         # then http -> https and non-www -> www redirects will be dropped.
-        if 'splash' in request.meta and \
-                not request.meta.get('_splash_processed'):
-            url = re.sub(r'^https?://(www\.)?', 'http://', request.url)
-            meta = deepcopy(request.meta)
-            meta['splash'].setdefault('args', {})['url'] = url
-            request = request.replace(url=url, meta=meta)
-        return super().request_fingerprint(request)
+        normalize = splash_options is not None and \
+            not request.meta.get('_splash_processed')
+        if normalize:
+            url = re.sub(r'^https?://(www\.)?', 'http://', url)
+        # The same as scrapy.utils.request.request_fingerprint
+        fp = hashlib.sha1()
+        fp.update(to_bytes(request.method))
+        fp.update(to_bytes(self.url_cache.canonicalize_url(url)))
+        fp.update(request.body or b'')
+        fp = fp.hexdigest()
+        if splash_options is None:
+            return fp
+        # The same as scrapy_splash.dupefilter.splash_request_fingerprint
+        splash_options = dict(splash_options)
+        args = splash_options['args'] = dict(splash_options.get('args', {}))
+        if normalize:
+            args['url'] = url
+        if 'url' in args:
+            args['url'] = self.url_cache.canonicalize_url(
+                args['url'], keep_fragments=True)
+        return _dict_hash(splash_options, fp)
+
+
+def _dict_hash(obj, start=''):
+    """ scrapy_splash.utils.dict_hash, caching hashes of long strings
+    (like lua_source and js_source in splash args).
+    """
+    if isinstance(obj, dict):
+        h = hashlib.sha1(to_bytes(start))
+        h.update(to_bytes(obj.__class__.__name__))
+        for key, value in sorted(obj.items()):
+            h.update(to_bytes(key))
+            h.update(to_bytes(_dict_hash(value)))
+        return h.hexdigest()
+    if isinstance(obj, str) and len(obj) > 1000 and not start:
+        return _long_value_hash(obj)
+    return dict_hash(obj, start)
+
+
+@lru_cache(maxsize=256)
+def _long_value_hash(value):
+    return dict_hash(value)
+
+
+def compact_fingerprint(hex_fingerprint, size):
+    r""" Compact binary fingerprint of ``size`` bytes from a hex fingerprint.
+
+    >>> compact_fingerprint('a94a8fe5ccb19ba61c4c0873d391e987982fbbd3', 8)
+    b'\xa9J\x8f\xe5\xcc\xb1\x9b\xa6'
+    """
+    return bytes.fromhex(hex_fingerprint[:2 * size])
+
+
+class FingerprintSet:
+    """ A set of fixed-size binary fingerprints, kept in a sorted numpy
+    array, with recently added fingerprints in a set buffer, which is
+    merged into the array when it grows large.
+    A fingerprint takes ``size`` bytes once merged,
+    instead of about 90 bytes for a hex string in a set.
+    """
+    min_buffer_size = 2**14
+
+    def __init__(self, size):
+        self.size = size
+        self._array = np.zeros(0, dtype='S{}'.format(size))
+        self._buffer = set()
+
+    def __len__(self):
+        return len(self._array) + len(self._buffer)
+
+    def __contains__(self, fp):
+        if fp in self._buffer:
+            return True
+        array = self._array
+        idx = array.searchsorted(fp)
+        # "S" dtype strips trailing zero bytes, so compare stripped values
+        return idx < len(array) and array[idx] == fp.rstrip(b'\0')
+
+    def add(self, fp):
+        if len(fp) != self.size:
+            raise ValueError('Expected a fingerprint of {} bytes, got {}'
+                             .format(self.size, len(fp)))
+        self._buffer.add(fp)
+        if len(self._buffer) >= max(self.min_buffer_size,
+                                    len(self._array) // 8):
+            self._merge()
+
+    def update_from_bytes(self, data):
+        """ Add fingerprints concatenated in data. A partially written
+        fingerprint at the end is skipped.
+        """
+        extra = len(data) % self.size
+        if extra:
+            logger.warning('Skipping %d bytes of a partially written '
+                           'fingerprint', extra)
+            data = data[:-extra]
+        new = np.frombuffer(data, dtype=self._array.dtype)
+        self._array = np.unique(np.concatenate([self._array, new]))
+
+    @property
+    def nbytes(self):
+        return self._array.nbytes + len(self._buffer) * (
+            sys.getsizeof(b'') + self.size + 8)  # object and set slot
+
+    def _merge(self):
+        new = np.array(sorted(self._buffer), dtype=self._array.dtype)
+        self._array = np.insert(
+            self._array, self._array.searchsorted(new), new)
+        self._buffer.clear()
+
+
+def _compact_path(path):
+    return os.path.join(path, 'requests.seen.bin')
+
+
+def _open_compact(path, size):
+    """ Open compact fingerprints file in JOBDIR for reading and appending,
+    migrating hex fingerprints from requests.seen if it exists.
+    """
+    f = open(_compact_path(path), 'a+b')
+    hex_path = os.path.join(path, 'requests.seen')
+    if os.path.exists(hex_path):
+        with open(hex_path, 'rt') as hex_file:
+            n_migrated = 0
+            for line in hex_file:
+                line = line.strip()
+                if len(line) >= 2 * size:  # skip a partially written line
+                    f.write(compact_fingerprint(line, size))
+                    n_migrated += 1
+        f.flush()
+        os.fsync(f.fileno())
+        os.rename(hex_path, hex_path + '.migrated')
+        logger.info('Migrated %d fingerprints from %s to %s',
+                    n_migrated, hex_path, _compact_path(path))
+    # Drop a partially written fingerprint, so that new ones are aligned
+    f.seek(0, os.SEEK_END)
+    extra = f.tell() % size
+    if extra:
+        logger.warning('Removing %d bytes of a partially written fingerprint '
+                       'from %s', extra, _compact_path(path))
+        f.truncate(f.tell() - extra)
+    f.seek(0)
+    return f
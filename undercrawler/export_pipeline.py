@@ -0,0 +1,251 @@
+from datetime import datetime
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.serialize import ScrapyJSONEncoder
+
+from .item_index import IndexWriter, index_path
+
+
+logger = logging.getLogger(__name__)
+
+
+class CompressedExportPipeline:
+    """ Export items as compressed JSON lines into ``EXPORT_DIR``.
+    Serialisation, compression and writing happen in a background thread,
+    so the reactor does not block on large items. Files are rotated by size
+    (``EXPORT_ROTATE_MB``) and/or age (``EXPORT_ROTATE_SECONDS``), and each
+    finished file is recorded in an fsync'd ``manifest.json``.
+    If ``EXPORT_INDEX`` is set, a sidecar index (see ``item_index``)
+    is written for each file.
+    """
+    def __init__(self, export_dir, compression='gzip', rotate_bytes=0,
+                 rotate_seconds=0, queue_size=1000, index=False, stats=None):
+        self.writer = RotatingWriter(
+            export_dir, compression=compression,
+            rotate_bytes=rotate_bytes, rotate_seconds=rotate_seconds,
+            index=index)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stats = stats
+        self._thread = None
+        self._error = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        export_dir = s.get('EXPORT_DIR')
+        if not export_dir:
+            raise NotConfigured
+        return cls(
+            export_dir,
+            compression=s.get('EXPORT_COMPRESSION'),
+            rotate_bytes=int(s.getfloat('EXPORT_ROTATE_MB') * 2**20),
+            rotate_seconds=s.getfloat('EXPORT_ROTATE_SECONDS'),
+            queue_size=s.getint('EXPORT_QUEUE_SIZE'),
+            index=s.getbool('EXPORT_INDEX'),
+            stats=crawler.stats,
+        )
+
+    def open_spider(self, spider):
+        self._thread = threading.Thread(
+            target=self._run, name='CompressedExportPipeline', daemon=True)
+        self._thread.start()
+
+    def process_item(self, item, spider):
+        self._raise_error()
+        # This blocks only if the writer thread falls far behind,
+        # which bounds memory used by the queue.
+        self.queue.put(dict(item))
+        return item
+
+    def close_spider(self, spider):
+        self.queue.put(_STOP)
+        self._thread.join()
+        if self.stats is not None:
+            self.stats.set_value('export/items', self.writer.total_items)
+            self.stats.set_value('export/files', len(self.writer.manifest))
+            self.stats.set_value('export/bytes', self.writer.total_bytes)
+        self._raise_error()
+
+    def _run(self):
+        encoder = ScrapyJSONEncoder(ensure_ascii=False)
+        poll_interval = min(self.writer.rotate_seconds or 1, 1)
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=poll_interval)
+                except queue.Empty:
+                    self.writer.maybe_rotate()
+                    continue
+                if item is _STOP:
+                    break
+                self.writer.write(
+                    (encoder.encode(item) + '\n').encode('utf8'), item)
+        except Exception as e:
+            logger.exception('Export failed')
+            self._error = e
+            # Keep draining the queue so that process_item never blocks
+            while self.queue.get() is not _STOP:
+                pass
+        finally:
+            self.writer.close()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError('Export failed: {!r}'.format(self._error))
+
+
+_STOP = object()
+
+
+class RotatingWriter:
+    """ Write lines into a sequence of compressed files, starting a new file
+    when the current one is too big or too old. Information about finished
+    files is kept in the manifest, which is atomically replaced and fsync'd
+    after each rotation.
+    """
+    manifest_name = 'manifest.json'
+    extensions = {'gzip': '.gz', 'zstd': '.zst', 'none': ''}
+
+    def __init__(self, export_dir, compression='gzip', rotate_bytes=0,
+                 rotate_seconds=0, index=False):
+        compression = compression or 'none'
+        if compression not in self.extensions:
+            raise ValueError(
+                'Unsupported EXPORT_COMPRESSION: "{}", expected one of {}'
+                .format(compression, ', '.join(sorted(self.extensions))))
+        if compression == 'zstd':
+            _check_zstandard()
+        self.export_dir = export_dir
+        self.compression = compression
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.index = index
+        os.makedirs(export_dir, exist_ok=True)
+        self.manifest = self._load_manifest()
+        self.total_items = self.total_bytes = 0
+        self._raw = self._stream = self._index = None
+        self._current = None  # manifest entry for the current file
+
+    def write(self, line, item=None):
+        if self._stream is None:
+            self._open()
+        elif self._should_rotate():
+            self.rotate()
+            self._open()
+        if self._index is not None and item is not None:
+            self._index.add(self._current['raw_bytes'], len(line) - 1, item)
+        self._stream.write(line)
+        self._current['items'] += 1
+        self._current['raw_bytes'] += len(line)
+        self.total_items += 1
+
+    def maybe_rotate(self):
+        if self._stream is not None and self._should_rotate():
+            self.rotate()
+
+    def rotate(self):
+        if self._stream is None:
+            return
+        if self._stream is not self._raw:
+            self._stream.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._current['bytes'] = self._raw.tell()
+        self._current['finished'] = _now()
+        self._raw.close()
+        if self._index is not None:
+            self._index.close()
+        self.total_bytes += self._current['bytes']
+        self.manifest.append(self._current)
+        self._write_manifest()
+        logger.info('Finished export file %s (%d items)',
+                    self._current['name'], self._current['items'])
+        self._raw = self._stream = self._index = self._current = None
+
+    def close(self):
+        self.rotate()
+
+    def _should_rotate(self):
+        if self.rotate_bytes and self._raw.tell() >= self.rotate_bytes:
+            return True
+        return bool(self.rotate_seconds and
+                    time.time() - self._started_at >= self.rotate_seconds)
+
+    def _open(self):
+        # Files left unfinished by a crashed crawl are not in the manifest,
+        # they are kept and skipped instead of being overwritten.
+        n = len(self.manifest)
+        while True:
+            name = 'items-{:05d}.jl{}'.format(
+                n, self.extensions[self.compression])
+            path = os.path.join(self.export_dir, name)
+            if not os.path.exists(index_path(path)):
+                try:
+                    self._raw = open(path, 'xb')
+                    break
+                except FileExistsError:
+                    pass
+            logger.warning('Export file %s already exists, skipping it', name)
+            n += 1
+        if self.compression == 'gzip':
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode='wb')
+        elif self.compression == 'zstd':
+            import zstandard  # optional dependency
+            self._stream = zstandard.ZstdCompressor().stream_writer(
+                self._raw, closefd=False)
+        else:
+            self._stream = self._raw
+        self._started_at = time.time()
+        self._current = {
+            'name': name,
+            'compression': self.compression,
+            'items': 0,
+            'raw_bytes': 0,
+            'started': _now(),
+        }
+        if self.index:
+            self._current['index'] = index_path(name)
+            self._index = IndexWriter(
+                os.path.join(self.export_dir, self._current['index']))
+
+    def _load_manifest(self):
+        path = os.path.join(self.export_dir, self.manifest_name)
+        if os.path.exists(path):
+            with open(path, 'rt', encoding='utf8') as f:
+                return json.load(f)['files']
+        return []
+
+    def _write_manifest(self):
+        path = os.path.join(self.export_dir, self.manifest_name)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wt', encoding='utf8') as f:
+            json.dump({'files': self.manifest}, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        dir_fd = os.open(self.export_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def _check_zstandard():
+    # stream_writer(..., closefd=False) is available since zstandard 0.15
+    import zstandard  # optional dependency
+    version = tuple(int(x) for x in zstandard.__version__.split('.')[:2])
+    if version < (0, 15):
+        raise ValueError(
+            'EXPORT_COMPRESSION "zstd" requires zstandard 0.15 or newer, '
+            'found {}'.format(zstandard.__version__))
+
+
+def _now():
+    return '{}Z'.format(datetime.utcnow().isoformat())
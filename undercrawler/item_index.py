@@ -0,0 +1,290 @@
+""" Sidecar offset index for crawler output files (JSON lines, optionally
+compressed). The index is written next to the data file as ``<name>.idx``:
+an 8 byte header followed by fixed size records, one per item in file order
+(so record position is the item ordinal). Offsets refer to the uncompressed
+stream, so for compressed files seeking still has to decompress from the
+start, but no JSON decoding is needed.
+Each record also has a 64-bit Bloom filter of item metadata keys
+(as counted by ``scripts/crawl_stats.py``), to find candidate items
+for a key without decoding all items.
+"""
+import calendar
+from datetime import datetime
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import zlib
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'UCIDX02\n'
+
+RECORD_DTYPE = np.dtype([
+    ('offset', '<u8'),  # in the uncompressed stream
+    ('length', '<u4'),
+    ('timestamp', '<i8'),  # milliseconds since epoch, -1 if missing
+    ('url_hash', '<u8'),
+    ('content_type', '<u4'),  # crc32
+    ('metadata_keys', '<u8'),  # Bloom filter of metadata_keys
+])
+
+# Indexes without metadata_keys can still be read
+_RECORD_DTYPES = {
+    b'UCIDX01\n': np.dtype([
+        (name, RECORD_DTYPE.fields[name][0])
+        for name in RECORD_DTYPE.names if name != 'metadata_keys']),
+    MAGIC: RECORD_DTYPE,
+}
+
+
+def index_path(path):
+    """
+    >>> index_path('out/items-00001.jl.gz')
+    'out/items-00001.jl.gz.idx'
+    """
+    return path + '.idx'
+
+
+def url_hash(url):
+    return int.from_bytes(
+        hashlib.sha1(url.encode('utf8')).digest()[:8], 'little')
+
+
+def content_type_hash(content_type):
+    return zlib.crc32((content_type or '').encode('utf8'))
+
+
+def item_timestamp(item):
+    """ Return item crawl timestamp in milliseconds, supporting both
+    CDRv2 ``timestamp`` and CDRv3 ``timestamp_crawl``.
+
+    >>> item_timestamp({'timestamp': 1486585412345})
+    1486585412345
+    >>> item_timestamp({'timestamp_crawl': '2017-02-08T20:23:32.345000Z'})
+    1486585412345
+    >>> item_timestamp({'timestamp_crawl': '2017-02-08T20:23:32Z'})
+    1486585412000
+    >>> item_timestamp({})
+    -1
+    """
+    if 'timestamp' in item:
+        return int(item['timestamp'])
+    timestamp_crawl = item.get('timestamp_crawl')
+    if not timestamp_crawl:
+        return -1
+    fmt = '%Y-%m-%dT%H:%M:%S.%fZ' if '.' in timestamp_crawl \
+        else '%Y-%m-%dT%H:%M:%SZ'
+    dt = datetime.strptime(timestamp_crawl, fmt)
+    return calendar.timegm(dt.timetuple()) * 1000 + dt.microsecond // 1000
+
+
+def item_url(item):
+    return item.get('url') or item.get('obj_original_url') or ''
+
+
+def item_metadata(item):
+    """ Return item metadata, supporting both CDRv2 ``extracted_metadata``
+    and CDRv3 ``metadata``.
+    """
+    return item.get('metadata') or item.get('extracted_metadata') or {}
+
+
+METADATA_MAX_INT_VALUE = 5
+
+
+def metadata_keys(metadata, max_int_value=METADATA_MAX_INT_VALUE):
+    """ Return keys for item metadata as counted by crawl_stats:
+    keys with true values, keys with int values and list lengths
+    (capped at max_int_value), and form types and form field types.
+
+    >>> metadata_keys({'is_page': True, 'is_iframe': False, 'depth': 7,
+    ...                'forms': [{'form': 'login', 'fields': {'a': 'username'}}]})
+    ['is_page', 'depth_5+', 'form_login', 'form_field username', 'forms_1']
+    """
+    keys = []
+    for key, value in metadata.items():
+        if key == 'forms':
+            for form in value:
+                keys.append('form_{}'.format(form['form']))
+                keys.extend('form_field {}'.format(f)
+                            for f in form['fields'].values())
+        if isinstance(value, list):
+            value = len(value)
+        if isinstance(value, int) and not isinstance(value, bool):
+            if value >= max_int_value:
+                value = '{}+'.format(max_int_value)
+            key = '{}_{}'.format(key, value)
+        if value:
+            keys.append(key)
+    return keys
+
+
+def metadata_key_bit(key):
+    return 1 << (zlib.crc32(key.encode('utf8')) % 64)
+
+
+def metadata_keys_filter(item):
+    bits = 0
+    for key in metadata_keys(item_metadata(item)):
+        bits |= metadata_key_bit(key)
+    return bits
+
+
+class IndexWriter:
+    """ Append index records for items, given their position
+    in the uncompressed stream.
+    """
+    def __init__(self, path):
+        self._f = open(path, 'wb')
+        self._f.write(MAGIC)
+
+    def add(self, offset, length, item):
+        record = np.array([(
+            offset, length, item_timestamp(item), url_hash(item_url(item)),
+            content_type_hash(item.get('content_type')),
+            metadata_keys_filter(item),
+        )], dtype=RECORD_DTYPE)
+        self._f.write(record.tobytes())
+
+    def close(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+
+
+class ItemIndex:
+    """ Index of a crawler output file, loaded in memory
+    (``RECORD_DTYPE.itemsize`` bytes per item).
+    """
+    def __init__(self, records):
+        self.records = records
+        self._max_timestamps = None
+        self._url_order = None
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            dtype = _RECORD_DTYPES.get(f.read(len(MAGIC)))
+            if dtype is None:
+                raise ValueError('Not an item index: {}'.format(path))
+            data = f.read()
+        # Ignore a partially written last record
+        n_records = len(data) // dtype.itemsize
+        records = np.frombuffer(data[:n_records * dtype.itemsize], dtype=dtype)
+        if dtype != RECORD_DTYPE:
+            old_records, records = records, np.zeros(
+                n_records, dtype=RECORD_DTYPE)
+            for name in old_records.dtype.names:
+                records[name] = old_records[name]
+            # Any item can have any metadata key
+            records['metadata_keys'] = np.iinfo(np.uint64).max
+        return cls(records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def time_limit(self, seconds):
+        """ Return the number of items from the start of the file
+        until the first item crawled more than ``seconds`` after
+        the first item. Items are not strictly ordered by time,
+        so binary search is done on running maximum of timestamps.
+        """
+        if not len(self):
+            return 0
+        if self._max_timestamps is None:
+            self._max_timestamps = np.maximum.accumulate(
+                self.records['timestamp'])
+        limit = self.records['timestamp'][0] + seconds * 1000
+        return int(np.searchsorted(self._max_timestamps, limit, side='right'))
+
+    def find_url(self, url):
+        """ Return ordinals of items with given url.
+        """
+        if self._url_order is None:
+            self._url_order = np.argsort(
+                self.records['url_hash'], kind='mergesort')
+        hashes = self.records['url_hash'][self._url_order]
+        h = np.uint64(url_hash(url))
+        start = np.searchsorted(hashes, h, side='left')
+        end = np.searchsorted(hashes, h, side='right')
+        return sorted(int(i) for i in self._url_order[start:end])
+
+    def with_content_type(self, content_type):
+        """ Return ordinals of items with given content type.
+        """
+        return [int(i) for i in np.flatnonzero(
+            self.records['content_type'] == content_type_hash(content_type))]
+
+    def with_metadata_key(self, key):
+        """ Return ordinals of items which can have given metadata key
+        (see ``metadata_keys``, with default ``max_int_value``).
+        Some of them may not have it, as this is a Bloom filter.
+        """
+        bit = np.uint64(metadata_key_bit(key))
+        return [int(i) for i in np.flatnonzero(
+            self.records['metadata_keys'] & bit)]
+
+    def read_raw(self, f, ordinal):
+        """ Return JSON of item ``ordinal`` as bytes, given the file object
+        of the uncompressed stream (see ``open_output``).
+        """
+        record = self.records[ordinal]
+        f.seek(int(record['offset']))
+        return f.read(int(record['length']))
+
+    def read_item(self, f, ordinal):
+        return json.loads(self.read_raw(f, ordinal).decode('utf8'))
+
+
+def open_output(path):
+    """ Open crawler output file as a binary uncompressed stream.
+    zstd streams can be seeked only forward, so items should be read
+    in increasing order.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        import zstandard  # optional dependency
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+    return open(path, 'rb')
+
+
+def build_index(path, out_path=None):
+    """ Build an index for an existing crawler output file,
+    in JSON lines or JSON array format (one item per line).
+    A truncated last line (of an output that is still being written,
+    or was not finished) is skipped.
+    Return the number of indexed items.
+    """
+    writer = IndexWriter(out_path or index_path(path))
+    n_items = offset = 0
+    error = None
+    try:
+        with open_output(path) as f:
+            for line in io.BufferedReader(f):
+                stripped = line.lstrip(b'[')
+                item_offset = offset + len(line) - len(stripped)
+                offset += len(line)
+                data = stripped.rstrip(b'],\r\n')
+                if not data:
+                    continue
+                if error is not None:
+                    raise error  # not the last line
+                try:
+                    item = json.loads(data.decode('utf8'))
+                except ValueError as e:
+                    error = e
+                    continue
+                writer.add(item_offset, len(data), item)
+                n_items += 1
+    finally:
+        writer.close()
+    if error is not None:
+        logger.warning('Skipped truncated last line of %s: %r', path, error)
+    return n_items
@@ -0,0 +1,183 @@
+from abc import ABC, abstractmethod
+import hashlib
+import math
+import re
+from urllib.parse import parse_qsl, urlsplit
+import zlib
+
+import numpy as np
+
+from .dupe_filter import FingerprintSet
+from .utils import body_text
+
+
+class LinkScorer(ABC):
+    """ Base class for link scorers, set with ``LINK_SCORER`` setting.
+    A scorer returns priority adjustment for links found on the page,
+    and learns from crawled pages. ``state`` is a dict kept in
+    ``spider.state``, so it is persisted with ``JOBDIR``.
+    """
+    def __init__(self, state, stats=None, priority_range=5):
+        self.state = state
+        self.stats = stats
+        self.priority_range = priority_range
+
+    @classmethod
+    def from_crawler(cls, crawler, state):
+        return cls(state, stats=crawler.stats,
+                   priority_range=crawler.settings.getint(
+                       'LINK_SCORER_PRIORITY_RANGE'))
+
+    @abstractmethod
+    def link_features(self, url, link_text, response, meta):
+        """ Return link features to be stored in request meta
+        (as ``link_features``). They are kept with each scheduled request,
+        so they should be compact.
+        """
+
+    @abstractmethod
+    def score(self, features):
+        """ Return estimated probability that the link leads to new content.
+        """
+
+    @abstractmethod
+    def update(self, features, new_content):
+        """ Learn from a crawled page: new_content is True if page
+        content was not seen before.
+        """
+
+    def priority(self, features):
+        """ Return priority adjustment in
+        [-priority_range, priority_range] range for the link.
+        """
+        return int(round(
+            self.priority_range * (2 * self.score(features) - 1)))
+
+    def is_new_content(self, response, text=None):
+        """ Return True if page text was not seen before.
+        text is page body text if it is already extracted.
+        """
+        seen = self.state.get('seen_content')
+        if seen is None:
+            seen = self.state['seen_content'] = FingerprintSet(8)
+        key = content_key(response, text)
+        if key is None:
+            return False
+        if key in seen:
+            self._inc_stats('duplicate_content')
+            return False
+        seen.add(key)
+        self._inc_stats('new_content')
+        return True
+
+    def _inc_stats(self, key):
+        if self.stats is not None:
+            self.stats.inc_value('link_scorer/' + key)
+
+
+class OnlineLinkScorer(LinkScorer):
+    """ Online logistic regression over hashed features of url tokens,
+    anchor text, link type and the page where the link was found.
+    Links similar to those that led to new content get higher priority,
+    links like sort orders, calendars and faceted filters leading to
+    already seen content get lower priority.
+    Features are hashed feature indices packed as uint32 bytes.
+    """
+    n_features = 2**18
+    learning_rate = 0.2
+    feature_dtype = np.dtype('<u4')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if 'weights' not in self.state:
+            self.state['weights'] = np.zeros(self.n_features, dtype=np.float32)
+        self.weights = self.state['weights']
+
+    def link_features(self, url, link_text, response, meta):
+        for kind in ['is_page', 'is_onclick', 'is_iframe']:
+            if meta.get(kind):
+                break
+        else:
+            kind = 'is_link'
+        tokens = url_tokens(url)
+        tokens.append('kind:' + kind)
+        words = _words(link_text or '')[:10]
+        tokens.extend('a:' + w for w in words)
+        if not words:
+            tokens.append('a:')
+        context = _path_segments(urlsplit(response.url).path)[:1] or ['']
+        tokens.append('ctx:' + context[0])
+        tokens.extend(['ctx:{}>{}'.format(context[0], t)
+                       for t in tokens if t.startswith('p0:')])
+        return np.array(
+            sorted({zlib.crc32(t.encode('utf8')) % self.n_features
+                    for t in tokens}),
+            dtype=self.feature_dtype).tobytes()
+
+    def score(self, features):
+        indices = self._indices(features)
+        z = float(self.weights[indices].sum()) if len(indices) else 0.
+        return 1 / (1 + math.exp(-max(-30., min(30., z))))
+
+    def update(self, features, new_content):
+        indices = self._indices(features)
+        if not len(indices):
+            return
+        error = float(new_content) - self.score(features)
+        self.weights[indices] += self.learning_rate * error
+        self._inc_stats('updates')
+
+    def _indices(self, features):
+        if isinstance(features, bytes):
+            return np.frombuffer(features, dtype=self.feature_dtype)
+        # A list of indices in requests scheduled by older versions
+        return np.asarray(features, dtype=self.feature_dtype)
+
+
+def url_tokens(url):
+    """ Return url tokens, with numbers replaced by "N".
+
+    >>> url_tokens('http://example.com/news/2017/?sort=date&page=2')
+    ['bias', 'p0:news', 'p1:N', 'p:news', 'p:N', 'depth:2', 'q:sort', \
+'qv:sort=date', 'q:page', 'qv:page=N', 'nq:2']
+    """
+    p = urlsplit(url)
+    segments = _path_segments(p.path)
+    tokens = ['bias']
+    tokens.extend('p{}:{}'.format(i, s) for i, s in enumerate(segments[:2]))
+    tokens.extend('p:' + s for s in segments)
+    tokens.append('depth:{}'.format(min(len(segments), 10)))
+    query = parse_qsl(p.query, keep_blank_values=True)
+    for name, value in query:
+        name = _normalize(name)
+        tokens.append('q:' + name)
+        tokens.append('qv:{}={}'.format(name, _normalize(value)[:30]))
+    tokens.append('nq:{}'.format(min(len(query), 5)))
+    return tokens
+
+
+def content_key(response, text=None):
+    """ Return an 8-byte hash of page text, or None if there is no text.
+    text is page body text (from ``utils.body_text``) if it is
+    already extracted.
+    """
+    if text is None:
+        if not getattr(response, 'text', None):
+            return None
+        text = body_text(response)
+    words = text.split()
+    if not words:
+        return None
+    return hashlib.sha1(' '.join(words).encode('utf8')).digest()[:8]
+
+
+def _path_segments(path):
+    return [_normalize(s) for s in path.split('/') if s]
+
+
+def _normalize(token):
+    return re.sub(r'\d+', 'N', token.lower())
+
+
+def _words(text):
+    return re.findall(r'\w+', _normalize(text))
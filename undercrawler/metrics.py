@@ -0,0 +1,207 @@
+import logging
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.reactor import listen_tcp
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from .utils import rss_bytes
+
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsExtension:
+    """ Serve live crawl metrics in Prometheus text format on
+    ``http://METRICS_HOST:METRICS_PORT/metrics``. ``METRICS_PORT`` can be
+    a single port or a range (like ``TELNETCONSOLE_PORT``), so that
+    many crawl processes on one host can use the same settings.
+    """
+    latency_buckets = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        settings = crawler.settings
+        self.portrange = [int(x) for x in settings.getlist('METRICS_PORT')]
+        self.host = settings.get('METRICS_HOST')
+        self.latency = {
+            'true': Histogram(self.latency_buckets),  # splash
+            'false': Histogram(self.latency_buckets),
+        }
+        self.port = None
+        crawler.signals.connect(self.spider_opened, signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signals.spider_closed)
+        crawler.signals.connect(
+            self.response_received, signals.response_received)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.get('METRICS_PORT'):
+            raise NotConfigured
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        self.port = listen_tcp(
+            self.portrange, self.host, Site(MetricsResource(self)))
+        address = self.port.getHost()
+        logger.info('Metrics available at http://%s:%d/metrics',
+                    address.host, address.port)
+
+    def spider_closed(self, spider):
+        if self.port is not None:
+            self.port.stopListening()
+            self.port = None
+
+    def response_received(self, response, request, spider):
+        # For Splash requests, SplashAwareAutoThrottle replaces
+        # download_latency with page load time reported by Splash.
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            splash = 'true' if 'splash' in request.meta else 'false'
+            self.latency[splash].observe(latency)
+
+    def render_metrics(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            name = 'undercrawler_' + name
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for suffix, labels, value in samples:
+                if value is None:
+                    continue
+                label_str = ','.join(
+                    '{}="{}"'.format(k, v) for k, v in labels)
+                lines.append('{}{}{} {}'.format(
+                    name, suffix, '{' + label_str + '}' if labels else '',
+                    _format_value(value)))
+
+        stats = self.stats.get_stats()
+        metric('requests_total', 'counter', 'Requests sent by the downloader.',
+               [('', [], stats.get('downloader/request_count', 0))])
+        status_prefix = 'downloader/response_status_count/'
+        metric('responses_total', 'counter',
+               'Responses received by the downloader, by HTTP status.',
+               [('', [('status', key[len(status_prefix):])], value)
+                for key, value in sorted(stats.items())
+                if key.startswith(status_prefix)])
+        metric('download_errors_total', 'counter', 'Download errors.',
+               [('', [], stats.get('downloader/exception_count', 0))])
+        metric('items_scraped_total', 'counter', 'Items scraped.',
+               [('', [], stats.get('item_scraped_count', 0))])
+        metric('items_dropped_total', 'counter', 'Items dropped.',
+               [('', [], stats.get('item_dropped_count', 0))])
+        samples = []
+        for splash, histogram in sorted(self.latency.items()):
+            samples.extend(histogram.samples([('splash', splash)]))
+        metric('download_latency_seconds', 'histogram',
+               'Download latency (page load time for Splash requests).',
+               samples)
+        engine = self.crawler.engine
+        metric('scheduler_queue_size', 'gauge',
+               'Requests waiting in the scheduler.',
+               [('', [], _scheduler_size(engine))])
+        metric('dupefilter_size', 'gauge', 'Fingerprints in the dupefilter.',
+               [('', [], _dupefilter_size(engine))])
+        metric('downloader_active', 'gauge',
+               'Requests being downloaded.',
+               [('', [], _downloader_active(engine))])
+        metric('media_backlog', 'gauge',
+               'Media downloads in progress or waiting in media pipelines.',
+               [('', [], _media_backlog(engine))])
+        metric('resident_memory_bytes', 'gauge',
+               'Resident memory size of the crawler process.',
+               [('', [], rss_bytes())])
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsResource(Resource):
+    isLeaf = True
+
+    def __init__(self, extension):
+        super().__init__()
+        self.extension = extension
+
+    def render_GET(self, request):
+        if request.path not in {b'/', b'/metrics'}:
+            request.setResponseCode(404)
+            return b'Not found\n'
+        request.setHeader(b'content-type', b'text/plain; version=0.0.4')
+        return self.extension.render_metrics().encode('utf8')
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+
+    def samples(self, labels):
+        """ Return samples in Prometheus format: buckets are cumulative.
+        """
+        samples = []
+        total = 0
+        for bucket, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            samples.append(('_bucket', labels + [('le', bucket)], total))
+        samples.append(('_sum', labels, self.sum))
+        samples.append(('_count', labels, total))
+        return samples
+
+
+def _format_value(value):
+    """
+    >>> _format_value(3)
+    '3'
+    >>> _format_value(0.25)
+    '0.25'
+    """
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+def _scheduler(engine):
+    slot = getattr(engine, 'slot', None)
+    return getattr(slot, 'scheduler', None)
+
+
+def _scheduler_size(engine):
+    scheduler = _scheduler(engine)
+    return len(scheduler) if scheduler is not None else None
+
+
+def _dupefilter_size(engine):
+    fingerprints = getattr(getattr(_scheduler(engine), 'df', None),
+                           'fingerprints', None)
+    return len(fingerprints) if fingerprints is not None else None
+
+
+def _downloader_active(engine):
+    active = getattr(getattr(engine, 'downloader', None), 'active', None)
+    return len(active) if active is not None else None
+
+
+def _media_backlog(engine):
+    itemproc = getattr(getattr(engine, 'scraper', None), 'itemproc', None)
+    if itemproc is None:
+        return None
+    backlog = 0
+    for pipeline in itemproc.middlewares:
+        info = getattr(pipeline, 'spiderinfo', None)
+        if info is not None and hasattr(info, 'downloading'):
+            backlog += len(info.downloading) + sum(
+                len(waiting) for waiting in info.waiting.values())
+    return backlog
+
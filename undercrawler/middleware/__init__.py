@@ -1,2 +1,4 @@
 from .throttle import *
 from .cookies import *
+from .memory import *
+from .autologin import *
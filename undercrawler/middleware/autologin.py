@@ -0,0 +1,203 @@
+import contextlib
+import functools
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from urllib.parse import urljoin, urlsplit
+
+from autologin_middleware import AutologinMiddleware
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import deferLater
+
+
+logger = logging.getLogger(__name__)
+
+
+class CachedAutologinMiddleware(AutologinMiddleware):
+    """ AutologinMiddleware that shares login cookies between crawl
+    processes through a local cache (``AUTOLOGIN_COOKIE_CACHE``, a path
+    to an SQLite database), keyed by domain and credentials.
+    Cookies are reused for ``AUTOLOGIN_COOKIE_CACHE_TTL`` seconds,
+    and are removed from the cache when a logout is detected.
+    While one process is logging in, others wait for its cookies for up
+    to ``AUTOLOGIN_COOKIE_CACHE_WAIT`` seconds instead of logging in too.
+    Without ``AUTOLOGIN_COOKIE_CACHE`` this is the same
+    as AutologinMiddleware.
+    """
+    poll_interval = 1.0
+
+    def __init__(self, autologin_url, crawler):
+        super().__init__(autologin_url, crawler)
+        s = crawler.settings
+        path = s.get('AUTOLOGIN_COOKIE_CACHE')
+        self.cookie_cache = AutologinCookieCache(
+            path, ttl=s.getfloat('AUTOLOGIN_COOKIE_CACHE_TTL')) \
+            if path else None
+        self.cache_wait = s.getfloat('AUTOLOGIN_COOKIE_CACHE_WAIT')
+
+    @inlineCallbacks
+    def _login(self, request, spider):
+        if self.cookie_cache is None:
+            yield super()._login(request, spider)
+            return
+        key = self._cache_key(request)
+        waited = 0
+        while True:
+            cookies = self.cookie_cache.get(key)
+            if cookies:
+                logger.debug('Using cached login cookies for %s', key)
+                self.stats.inc_value('autologin/cookie_cache/hits')
+                self.auth_cookies = cookies
+                self.logged_in = True
+                return
+            leased = self.cookie_cache.acquire_lease(key, self.cache_wait)
+            if leased or waited >= self.cache_wait:
+                break
+            # Another process is logging in, wait for its cookies
+            yield deferLater(reactor, self.poll_interval, lambda: None)
+            waited += self.poll_interval
+        self.stats.inc_value('autologin/cookie_cache/misses')
+        try:
+            yield super()._login(request, spider)
+            if self.logged_in and self.auth_cookies:
+                self.cookie_cache.set(key, self.auth_cookies)
+        finally:
+            if leased:
+                self.cookie_cache.release_lease(key)
+
+    def process_response(self, request, response, spider):
+        autologin_meta = request.meta.get('_autologin')
+        if (self.cookie_cache is not None and self.logged_in and
+                autologin_meta and self.auth_cookies and
+                self.is_logout(response) and
+                all(autologin_meta['cookie_dict'].get(c['name']) ==
+                    c['value'] for c in self.auth_cookies)):
+            # Current cookies are no longer valid
+            if self.cookie_cache.invalidate(
+                    self._cache_key(request), self.auth_cookies):
+                logger.debug('Removed login cookies from cache after logout '
+                             'at %s', response.url)
+                self.stats.inc_value('autologin/cookie_cache/invalidated')
+        return super().process_response(request, response, spider)
+
+    def _cache_key(self, request):
+        """ Login domain and a hash of credentials, so that they are not
+        stored in the cache.
+        """
+        meta = request.meta
+        login_url = meta.get('autologin_login_url', self.login_url)
+        url = urljoin(request.url, login_url) if login_url else request.url
+        domain = urlsplit(url).netloc.lower()
+        if domain.startswith('www.'):
+            domain = domain[len('www.'):]
+        credentials = json.dumps([
+            meta.get('autologin_username', self.username),
+            meta.get('autologin_password', self.password),
+            meta.get('autologin_extra_js', self.extra_js),
+        ])
+        return '{} {}'.format(
+            domain,
+            hashlib.sha256(credentials.encode('utf8')).hexdigest()[:16])
+
+
+def _unless_locked(default):
+    """ Return default instead of waiting for a database locked by
+    another process (for longer than the busy timeout).
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return method(self, *args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) and 'busy' not in str(e):
+                    raise
+                logger.warning('Autologin cookie cache is locked, '
+                               'skipping %s: %s', method.__name__, e)
+                return default
+        return wrapper
+    return decorator
+
+
+class AutologinCookieCache:
+    """ Login cookies in an SQLite database, shared by processes on
+    the same host. Methods are called from the reactor thread, so they
+    wait at most busy_timeout seconds for a lock held by another process,
+    and then act as if there is nothing in the cache (``get`` returns None,
+    ``acquire_lease`` returns False, and cookies are not stored).
+    """
+    def __init__(self, path, ttl=3600, busy_timeout=0.1):
+        self.ttl = ttl
+        # Wait longer for other processes only when creating the database
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS cookies ('
+            'key TEXT PRIMARY KEY, cookies TEXT, expires REAL)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS leases ('
+            'key TEXT PRIMARY KEY, expires REAL)')
+        self.conn.execute(
+            'PRAGMA busy_timeout = {:d}'.format(int(busy_timeout * 1000)))
+
+    @_unless_locked(None)
+    def get(self, key):
+        row = self.conn.execute(
+            'SELECT cookies FROM cookies WHERE key = ? AND expires > ?',
+            (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @_unless_locked(None)
+    def set(self, key, cookies):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO cookies VALUES (?, ?, ?)',
+            (key, _dumps(cookies), time.time() + self.ttl))
+
+    @_unless_locked(False)
+    def invalidate(self, key, cookies):
+        """ Remove cookies from the cache, unless they were already
+        replaced with new ones. Return True if cookies were removed.
+        """
+        return self.conn.execute(
+            'DELETE FROM cookies WHERE key = ? AND cookies = ?',
+            (key, _dumps(cookies))).rowcount > 0
+
+    @_unless_locked(False)
+    def acquire_lease(self, key, duration):
+        """ Return True if no other process is logging in with this key,
+        and mark that we are logging in for up to duration seconds.
+        """
+        now = time.time()
+        with self._transaction():
+            row = self.conn.execute(
+                'SELECT expires FROM leases WHERE key = ?', (key,)).fetchone()
+            if row and row[0] > now:
+                return False
+            self.conn.execute('INSERT OR REPLACE INTO leases VALUES (?, ?)',
+                              (key, now + duration))
+            return True
+
+    @_unless_locked(None)
+    def release_lease(self, key):
+        self.conn.execute('DELETE FROM leases WHERE key = ?', (key,))
+
+    def close(self):
+        self.conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        else:
+            self.conn.execute('COMMIT')
+
+
+def _dumps(cookies):
+    return json.dumps(cookies, sort_keys=True)
@@ -1,5 +1,9 @@
+import json
+
 from autologin_middleware import ExposeCookiesMiddleware
 from scrapy.exceptions import NotConfigured
+from scrapy_splash import SplashCookiesMiddleware, SplashJsonResponse
+from scrapy_splash.cookies import cookie_to_har, har_to_jar
 
 
 class CookiesMiddlewareIfNoSplash(ExposeCookiesMiddleware):
@@ -8,3 +12,104 @@ class CookiesMiddlewareIfNoSplash(ExposeCookiesMiddleware):
         if crawler.settings.get('SPLASH_URL'):
             raise NotConfigured
         return super().from_crawler(crawler)
+
+
+class SplashDeltaCookiesMiddleware(SplashCookiesMiddleware):
+    """ SplashCookiesMiddleware that sends to Splash only cookies for
+    the domain of the request (and its parent domains and subdomains),
+    and asks the script (with ``cookies_delta`` argument) to return
+    only cookies for this domain that were changed or added during
+    rendering, and cookies that were removed. Scripts that do not
+    support ``cookies_delta`` return all cookies as before.
+    Splash does not keep cookies between renders, so the jar is still
+    kept here and the cookies are sent with each request.
+    Sizes of cookies sent and received are recorded in
+    ``splash_cookies/request_bytes`` and ``splash_cookies/response_bytes``.
+    """
+    def __init__(self, debug=False, stats=None):
+        super().__init__(debug=debug)
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(debug=crawler.settings.getbool('SPLASH_COOKIES_DEBUG'),
+                   stats=crawler.stats)
+
+    def process_request(self, request, spider):
+        splash_options = request.meta.get('splash')
+        if (splash_options is None or
+                request.meta.get('_splash_processed') or
+                'cookies' in splash_options.get('args', {}) or
+                'session_id' not in splash_options):
+            return super().process_request(request, spider)
+        splash_args = splash_options.setdefault('args', {})
+        jar = self.jars[splash_options['session_id']]
+        har_to_jar(jar, self._get_request_cookies(request))
+        host = _host(request.url)
+        cookies = [cookie_to_har(cookie) for cookie in jar
+                   if _same_site(cookie.domain, host)]
+        splash_args['cookies'] = cookies
+        splash_args['cookies_delta'] = True
+        self._inc_stats('splash_cookies/sent', len(cookies))
+        self._inc_stats('splash_cookies/request_bytes',
+                        len(json.dumps(cookies)))
+        self._debug_cookie(request, spider)
+
+    def process_response(self, request, response, spider):
+        if not (isinstance(response, SplashJsonResponse) and
+                response.data.get('cookies_delta') and
+                request.meta.get('_splash_processed')):
+            return super().process_response(request, response, spider)
+        splash_options = request.meta['splash']
+        session_id = splash_options.get('new_session_id',
+                                        splash_options.get('session_id'))
+        if session_id is None:
+            return response
+        jar = self.jars[session_id]
+        # Empty lists are encoded as empty objects by Splash
+        changed = response.data.get('cookies') or []
+        removed = response.data.get('removed_cookies') or []
+        har_to_jar(jar, changed)
+        for c in removed:
+            try:
+                jar.clear(c.get('domain', ''), c.get('path', '/'), c['name'])
+            except KeyError:
+                pass  # It could have been already removed
+        self._inc_stats('splash_cookies/received', len(changed))
+        self._inc_stats('splash_cookies/response_bytes',
+                        len(json.dumps(changed)) + len(json.dumps(removed)))
+        self._debug_set_cookie(response, spider)
+        response.cookiejar = jar
+        return response
+
+    def _inc_stats(self, key, value):
+        if self.stats is not None:
+            self.stats.inc_value(key, value)
+
+
+def _host(url):
+    """
+    >>> _host('http://www.Example.com:8080/foo')
+    'www.example.com'
+    """
+    netloc = url.split('://', 1)[-1].split('/', 1)[0]
+    return netloc.rsplit('@', 1)[-1].split(':', 1)[0].lower()
+
+
+def _same_site(domain, host):
+    """ Return True if cookie for domain can be used on host or its
+    parent domains or subdomains (cookies without domain are kept).
+
+    >>> _same_site('.example.com', 'www.example.com')
+    True
+    >>> _same_site('www.example.com', 'example.com')
+    True
+    >>> _same_site('.doubleclick.net', 'www.example.com')
+    False
+    >>> _same_site('ample.com', 'example.com')
+    False
+    """
+    domain = domain.lstrip('.').lower()
+    if not domain or domain == host:
+        return True
+    return host.endswith('.' + domain) or domain.endswith('.' + host)
@@ -0,0 +1,182 @@
+import logging
+from itertools import islice
+import sys
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from twisted.internet.task import LoopingCall
+
+from ..seeds import AllowedUrls
+from ..utils import rss_bytes
+
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryAccountingMiddleware:
+    """ Periodically record sizes of the largest in-memory structures
+    (spider state, scheduler queues, dupefilter, duplicate content model)
+    in ``memory/<structure>/items`` and ``memory/<structure>/bytes`` stats.
+
+    If process RSS goes above ``MEMORY_SOFT_LIMIT_MB``, new requests with
+    priority at most ``MEMORY_SHED_PRIORITY`` (search refinements, onclick
+    guesses) are dropped, not counting the adjustment made by
+    ``LINK_SCORER``; above ``MEMORY_HARD_LIMIT_MB`` all new requests
+    are dropped, and the crawl finishes what is already scheduled.
+    Scheduled requests are kept on disk if ``JOBDIR`` is set.
+    """
+    OK, SOFT, HARD = 0, 1, 2
+    level_names = {OK: 'ok', SOFT: 'soft', HARD: 'hard'}
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        settings = crawler.settings
+        self.interval = settings.getfloat('MEMORY_ACCOUNTING_INTERVAL')
+        self.soft_limit = settings.getint('MEMORY_SOFT_LIMIT_MB') * 2**20
+        self.hard_limit = settings.getint('MEMORY_HARD_LIMIT_MB') * 2**20
+        self.shed_priority = settings.getint('MEMORY_SHED_PRIORITY')
+        self.jobdir = settings.get('JOBDIR')
+        self.level = self.OK
+        self.spider = None
+        self.task = LoopingCall(self.sample)
+        crawler.signals.connect(self.spider_opened, signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('MEMORY_ACCOUNTING_ENABLED'):
+            raise NotConfigured
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        self.task.start(self.interval, now=True)
+
+    def spider_closed(self, spider):
+        if self.task.running:
+            self.task.stop()
+        self.sample()
+
+    def process_spider_output(self, response, result, spider):
+        for x in result:
+            if isinstance(x, Request) and self.should_shed(x):
+                self.stats.inc_value(
+                    'memory/shed/{}'.format(self.level_names[self.level]))
+                logger.debug('Dropping %s: memory limit reached', x)
+                continue
+            yield x
+
+    def should_shed(self, request):
+        if self.level == self.HARD:
+            return True
+        priority = request.priority - \
+            request.meta.get('link_scorer_priority', 0)
+        return self.level == self.SOFT and priority <= self.shed_priority
+
+    def sample(self):
+        for name, (n_items, n_bytes) in sorted(self.structure_sizes().items()):
+            self.stats.set_value('memory/{}/items'.format(name), n_items)
+            if n_bytes is not None:
+                self.stats.set_value('memory/{}/bytes'.format(name), n_bytes)
+        rss = rss_bytes()
+        self.stats.set_value('memory/rss_bytes', rss)
+        self.stats.max_value('memory/max_rss_bytes', rss)
+        self.update_level(rss)
+
+    def update_level(self, rss):
+        if self.hard_limit and rss > self.hard_limit:
+            level = self.HARD
+        elif self.soft_limit and rss > self.soft_limit:
+            level = self.SOFT
+        else:
+            level = self.OK
+        if level != self.level:
+            log = logger.info if level == self.OK else logger.warning
+            log('Memory level changed from %s to %s (RSS %.1f MB)',
+                self.level_names[self.level], self.level_names[level],
+                rss / 2**20)
+            if level != self.OK and not self.jobdir:
+                logger.warning('JOBDIR is not set, all scheduled requests '
+                               'are kept in memory')
+            self.level = level
+        self.stats.set_value('memory/level', self.level_names[self.level])
+
+    def structure_sizes(self):
+        """ Return a dict mapping structure name to (items, bytes),
+        bytes are None if unknown.
+        """
+        sizes = {}
+        spider = self.spider
+        for key, value in sorted(getattr(spider, 'state', {}).items()):
+            if isinstance(value, (set, dict, list)):
+                sizes['spider_state/{}'.format(key)] = \
+                    (len(value), approx_size(value))
+            elif isinstance(value, AllowedUrls):
+                sizes['spider_state/{}'.format(key)] = (len(value), sum(
+                    approx_size(x) for x in vars(value).values()))
+        engine = self.crawler.engine
+        scheduler = getattr(getattr(engine, 'slot', None), 'scheduler', None)
+        if scheduler is not None:
+            mqs = getattr(scheduler, 'mqs', None)
+            if mqs is not None:
+                sizes['scheduler/memory_queue'] = (len(mqs), None)
+            dqs = getattr(scheduler, 'dqs', None)
+            if dqs is not None:
+                sizes['scheduler/disk_queue'] = (len(dqs), None)
+            fingerprints = getattr(
+                getattr(scheduler, 'df', None), 'fingerprints', None)
+            if fingerprints is not None:
+                sizes['dupefilter/fingerprints'] = (
+                    len(fingerprints), getattr(fingerprints, 'nbytes', None)
+                    or approx_size(fingerprints))
+        dupe_middleware = _avoid_dup_content_middleware(engine)
+        if dupe_middleware is not None:
+            queue = dupe_middleware.initial_queue or []  # None after training
+            sizes['maybedont/initial_queue'] = (len(queue), approx_size(queue))
+            predictor = dupe_middleware.dupe_predictor
+            if predictor is not None:
+                sizes['maybedont/model'] = (
+                    len(predictor.seen_urls), sum(
+                        approx_size(value) for value in vars(predictor).values()
+                        if isinstance(value, (set, dict))))
+        return sizes
+
+
+def approx_size(container, sample_size=100):
+    """ Approximate size in bytes of a container with its items
+    (including nested containers and tuples), extrapolated
+    from the first sample_size items.
+
+    >>> approx_size(set()) == sys.getsizeof(set())
+    True
+    >>> approx_size({'a' * 1000}) > 1000
+    True
+    """
+    size = sys.getsizeof(container)
+    if not container:
+        return size
+    if isinstance(container, dict):
+        sample = [_item_size(key) + _item_size(value) for key, value
+                  in islice(container.items(), sample_size)]
+    else:
+        sample = [_item_size(item) for item in islice(container, sample_size)]
+    return size + int(sum(sample) / len(sample) * len(container))
+
+
+def _item_size(item):
+    if isinstance(item, (set, dict, list)):
+        return approx_size(item, sample_size=10)
+    size = sys.getsizeof(item)
+    if isinstance(item, tuple):
+        size += sum(_item_size(x) for x in item)
+    return size
+
+
+def _avoid_dup_content_middleware(engine):
+    downloader = getattr(engine, 'downloader', None)
+    manager = getattr(downloader, 'middleware', None)
+    for mw in getattr(manager, 'middlewares', []):
+        if hasattr(mw, 'dupe_predictor') and hasattr(mw, 'initial_queue'):
+            return mw
@@ -2,6 +2,8 @@ from scrapy.extensions.throttle import AutoThrottle
 from scrapy.exceptions import NotConfigured
 from scrapy_splash.response import SplashJsonResponse
 
+from ..stage_timing import StageTimer
+
 
 class SplashAwareAutoThrottle(AutoThrottle):
     def __init__(self, crawler):
@@ -9,6 +11,7 @@ class SplashAwareAutoThrottle(AutoThrottle):
         self.target_concurrency = \
             crawler.settings.getfloat('AUTOTHROTTLE_TARGET_CONCURRENCY')
         self.debug = crawler.settings.getbool('AUTOTHROTTLE_DEBUG')
+        self.stage_timer = StageTimer.from_crawler(crawler)
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -22,6 +25,11 @@ class SplashAwareAutoThrottle(AutoThrottle):
         assert hasattr(self, 'mindelay')
 
     def process_response(self, request, response, spider):
+        with self.stage_timer('throttle'):
+            self._process_response(request, response, spider)
+        return response
+
+    def _process_response(self, request, response, spider):
         if isinstance(response, SplashJsonResponse) and 'har' in response.data:
             pages = response.data['har']['log'].get('pages')
             if pages:
@@ -29,4 +37,3 @@ class SplashAwareAutoThrottle(AutoThrottle):
                 if t_ms is not None:
                     request.meta['download_latency'] = t_ms / 1000
         self._response_downloaded(response, request, spider)
-        return response
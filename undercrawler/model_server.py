@@ -0,0 +1,305 @@
+""" A local server for formasaurus and autopager models, shared by all
+crawl processes on a host, so that each of them does not need to load
+its own copy of the models (set ``MODEL_SERVER_SOCKET`` to use it)::
+
+    python -m undercrawler.model_server /tmp/undercrawler-models.sock
+
+Models are loaded once, and then worker processes are forked,
+sharing model memory copy-on-write. Workers accept connections on the
+same Unix socket. Messages are length-prefixed JSON in both directions:
+a 4-byte big-endian length followed by a UTF-8 JSON body.
+Each request message holds a batch of requests
+``{"requests": [{"method": "forms", "html": "..."}, ...]}``,
+and the response holds their results in the same order:
+``{"results": [...]}``, with ``{"error": "..."}`` for failed requests.
+A connection is closed if a message is not received or sent
+within ``--timeout`` seconds, so that a stalled client does not hold
+a worker.
+"""
+import argparse
+import json
+import logging
+import os
+import selectors
+import signal
+import socket
+import struct
+import threading
+
+import lxml.html
+from twisted.internet import reactor
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('>I')
+# The same parser as used by formasaurus.html.load_html
+_html_parser = lxml.html.HTMLParser(encoding='utf8')
+
+
+class ModelServerError(Exception):
+    pass
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode('utf8')
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    """ Return a decoded message, or None if the connection was closed
+    before a new message.
+    """
+    header = _recv_exactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    length, = _HEADER.unpack(header)
+    data = _recv_exactly(sock, length)
+    if data is None:
+        raise ModelServerError('Connection closed in the middle of a message')
+    return json.loads(data.decode('utf8'))
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 2**20))
+        if not chunk:
+            if chunks:
+                raise ModelServerError('Connection closed')
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def load_html(html):
+    """ Parse HTML the same way formasaurus does, so that forms found
+    by the client and the server are the same and in the same order.
+    """
+    return lxml.html.fromstring(html.encode('utf8'), parser=_html_parser)
+
+
+class ModelClient:
+    """ Client for the model server, used by the spider if
+    ``MODEL_SERVER_SOCKET`` is set. ``request`` and ``page_models`` are
+    blocking, ``deferred_page_models`` runs ``page_models`` in a pool of
+    ``threads`` threads (not in the reactor thread pool, which is also
+    used for DNS resolution), so that a slow server does not block
+    the reactor. Each thread uses its own connection.
+    """
+    def __init__(self, path, timeout=10, threads=4):
+        self.path = path
+        self.timeout = timeout
+        self.threads = threads
+        self._local = threading.local()
+        self._socks = set()
+        self._socks_lock = threading.Lock()
+        self._pool = None
+
+    def request(self, requests):
+        """ Send a batch of requests, returning a list of results.
+        """
+        sock = getattr(self._local, 'sock', None)
+        try:
+            if sock is None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._set_sock(sock)
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+            send_message(sock, {'requests': requests})
+            response = recv_message(sock)
+            if response is None:
+                raise ModelServerError('Connection closed by the server')
+        except (OSError, ValueError, ModelServerError) as e:
+            self._close_sock()
+            raise ModelServerError(
+                'Model server at {} failed: {!r}'.format(self.path, e))
+        results = response['results']
+        for result in results:
+            if 'error' in result:
+                raise ModelServerError(result['error'])
+        return results
+
+    def page_models(self, html, base_url, pagination=False):
+        """ Return a list of (form_element, form_info) tuples, the same
+        as ``formasaurus.extract_forms(html)``, and a list of
+        pagination urls from ``autopager.urls`` if pagination is True
+        (None otherwise). Both are done with a single request.
+        Pagination urls are resolved against base_url, which should be
+        ``get_base_url(response)`` to honour ``<base href>``.
+        """
+        requests = []
+        if html:
+            requests.append({'method': 'forms', 'html': html})
+        if pagination:
+            requests.append(
+                {'method': 'pagination', 'html': html, 'url': base_url})
+        results = self.request(requests) if requests else []
+        forms = []
+        if html:
+            form_infos = results.pop(0)['forms']
+            elements = load_html(html).xpath('//form')
+            if len(elements) != len(form_infos):
+                raise ModelServerError(
+                    'Got {} forms from the model server, found {}'.format(
+                        len(form_infos), len(elements)))
+            forms = list(zip(elements, form_infos))
+        pagination_urls = results.pop(0)['urls'] if pagination else None
+        return forms, pagination_urls
+
+    def deferred_page_models(self, html, base_url, pagination=False):
+        """ The same as ``page_models``, but run in a thread, returning
+        a Deferred. Must be called from the reactor thread.
+        """
+        if self._pool is None:
+            self._pool = ThreadPool(
+                minthreads=0, maxthreads=self.threads, name='ModelClient')
+            self._pool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', self.close)
+        return deferToThreadPool(reactor, self._pool, self.page_models,
+                                 html, base_url, pagination=pagination)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.stop()
+            self._pool = None
+        with self._socks_lock:
+            socks, self._socks = self._socks, set()
+        for sock in socks:
+            sock.close()
+        self._local = threading.local()
+
+    def _set_sock(self, sock):
+        self._local.sock = sock
+        with self._socks_lock:
+            self._socks.add(sock)
+
+    def _close_sock(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            self._local.sock = None
+            with self._socks_lock:
+                self._socks.discard(sock)
+            sock.close()
+
+
+def load_models():
+    import autopager
+    import formasaurus
+    # Models are loaded on first use, make sure it happens before forking.
+    formasaurus.extract_forms('<form><input name="q"></form>')
+    autopager.urls('<a href="?page=2">2</a>', baseurl='http://example.com')
+
+
+def handle_request(request):
+    method = request.get('method')
+    try:
+        if method == 'forms':
+            import formasaurus
+            return {'forms': [
+                info for _, info in formasaurus.extract_forms(
+                    load_html(request['html']))]}
+        elif method == 'pagination':
+            import autopager
+            return {'urls': autopager.urls(
+                request['html'], baseurl=request['url'])}
+        else:
+            return {'error': 'Unknown method: {!r}'.format(method)}
+    except Exception as e:
+        logger.exception('Error handling %s request', method)
+        return {'error': '{}: {!r}'.format(method, e)}
+
+
+def worker_loop(listener, timeout):
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ)
+    while True:
+        for key, _ in selector.select():
+            sock = key.fileobj
+            if sock is listener:
+                try:
+                    conn, _ = listener.accept()
+                except BlockingIOError:
+                    continue  # accepted by another worker
+                conn.settimeout(timeout)
+                selector.register(conn, selectors.EVENT_READ)
+                continue
+            try:
+                message = recv_message(sock)
+                if message is not None:
+                    send_message(sock, {'results': [
+                        handle_request(r) for r in message['requests']]})
+            except (OSError, ValueError, KeyError, ModelServerError) as e:
+                logger.warning('Closing connection: %r', e)
+                message = None
+            if message is None:
+                selector.unregister(sock)
+                sock.close()
+
+
+def serve(path, workers, timeout=10):
+    load_models()
+    if os.path.exists(path):
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(128)
+    listener.setblocking(False)
+    logger.info('Serving models at %s with %d workers', path, workers)
+
+    pids = set()
+
+    def stop(signum, frame):
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+        if os.path.exists(path):
+            os.unlink(path)
+        raise SystemExit(0)
+
+    def start_worker():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                worker_loop(listener, timeout)
+            finally:
+                os._exit(1)
+        pids.add(pid)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        start_worker()
+    while True:
+        pid, status = os.wait()
+        if pid in pids:
+            pids.discard(pid)
+            logger.warning('Worker %d exited with status %d, restarting',
+                           pid, status)
+            start_worker()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg = parser.add_argument
+    arg('socket', help='path to the Unix socket to listen on')
+    arg('--workers', type=int, default=max(1, os.cpu_count() or 1),
+        help='number of worker processes (default: number of CPUs)')
+    arg('--timeout', type=float, default=10,
+        help='timeout in seconds for receiving or sending a message, '
+             'after which the connection is closed (default: 10)')
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(name)s] %(levelname)s: %(message)s')
+    serve(args.socket, args.workers, args.timeout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+from collections import OrderedDict
+import logging
+
+from datasketch import MinHashLSH
+from maybedont.utils import get_min_hash
+from scrapy import Selector
+from scrapy.exceptions import DropItem, NotConfigured
+
+from .utils import body_text
+
+
+logger = logging.getLogger(__name__)
+
+
+class NearDuplicatePipeline:
+    """ Find near-duplicate items before they are exported, using MinHash LSH
+    over item text, the same way as ``scripts/crawl_stats.py`` does.
+    Near-duplicates are either dropped (``NEAR_DUPE_ACTION = 'drop'``), or
+    marked with ``near_duplicate_of`` metadata field holding the url
+    of the first seen item (``NEAR_DUPE_ACTION = 'mark'``).
+    The index holds at most ``NEAR_DUPE_MAX_ITEMS`` items, evicting either
+    the oldest items (``NEAR_DUPE_EVICTION = 'fifo'``) or items that were not
+    matched for the longest time (``NEAR_DUPE_EVICTION = 'lru'``).
+    """
+    actions = {'mark', 'drop'}
+    evictions = {'fifo', 'lru'}
+
+    def __init__(self, action='mark', threshold=0.9, max_items=50000,
+                 eviction='lru', num_perm=128, stats=None):
+        if action not in self.actions:
+            raise ValueError('Unsupported NEAR_DUPE_ACTION: "{}"'
+                             .format(action))
+        if eviction not in self.evictions:
+            raise ValueError('Unsupported NEAR_DUPE_EVICTION: "{}"'
+                             .format(eviction))
+        self.action = action
+        self.threshold = threshold
+        self.max_items = max_items
+        self.eviction = eviction
+        self.num_perm = num_perm
+        self.stats = stats
+        self.lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        self.index = OrderedDict()  # key -> (min_hash, url)
+        self._next_key = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = crawler.settings
+        if not s.getbool('NEAR_DUPE_ENABLED'):
+            raise NotConfigured
+        return cls(
+            action=s.get('NEAR_DUPE_ACTION'),
+            threshold=s.getfloat('NEAR_DUPE_THRESHOLD'),
+            max_items=s.getint('NEAR_DUPE_MAX_ITEMS'),
+            eviction=s.get('NEAR_DUPE_EVICTION'),
+            stats=crawler.stats,
+        )
+
+    def process_item(self, item, spider):
+        text = item_text(item)
+        if not text or not text.strip():
+            return item
+        min_hash = get_min_hash(text, too_common=set(),
+                                num_perm=self.num_perm)
+        canonical_key = self.find_duplicate(min_hash)
+        if canonical_key is None:
+            self._inc_stats('unique')
+            self.add(min_hash, item.get('url'))
+            return item
+        self._inc_stats('duplicates')
+        if self.eviction == 'lru':
+            self.index.move_to_end(canonical_key)
+        canonical_url = self.index[canonical_key][1]
+        if self.action == 'drop':
+            raise DropItem('Near-duplicate of {}'.format(canonical_url))
+        item.setdefault('metadata', {})['near_duplicate_of'] = canonical_url
+        return item
+
+    def find_duplicate(self, min_hash):
+        """ Return the key of the most similar indexed item, if it is
+        similar enough, verifying LSH candidates with estimated Jaccard
+        similarity.
+        """
+        best_key, best_similarity = None, self.threshold
+        for key in self.lsh.query(min_hash):
+            similarity = min_hash.jaccard(self.index[key][0])
+            if similarity >= best_similarity:
+                best_key, best_similarity = key, similarity
+        return best_key
+
+    def add(self, min_hash, url):
+        key = self._next_key
+        self._next_key += 1
+        self.lsh.insert(key, min_hash)
+        self.index[key] = (min_hash, url)
+        while len(self.index) > self.max_items:
+            evicted_key, _ = self.index.popitem(last=False)
+            self.lsh.remove(evicted_key)
+            self._inc_stats('evicted')
+
+    def _inc_stats(self, key):
+        if self.stats is not None:
+            self.stats.inc_value('near_dupe/' + key)
+
+
+def item_text(item):
+    """ Return item text, or None if the item has no text content.
+    Text extracted by the spider (``_body_text`` item attribute, which is
+    not exported) is used if present, so that the page is not parsed again.
+
+    >>> item_text({'extracted_text': 'foo'})
+    'foo'
+    >>> item_text({'raw_content': '<title>t</title><p>foo</p> <p>bar</p>'})
+    'foo bar'
+    >>> item_text({'obj_stored_url': 'foo'}) is None
+    True
+    """
+    text = item.get('extracted_text')
+    if text is None:
+        text = getattr(item, '_body_text', None)
+    if text is not None:
+        return text
+    raw_content = item.get('raw_content')
+    if raw_content is None:
+        return None
+    return body_text(Selector(text=raw_content))
@@ -0,0 +1,110 @@
+from collections import OrderedDict
+import hashlib
+from io import BytesIO
+import logging
+from urllib.parse import urlsplit
+
+from scrapy.exceptions import NotConfigured
+from scrapy.pipelines.files import FSFilesStore, S3FilesStore
+from twisted.internet import defer
+
+
+logger = logging.getLogger(__name__)
+
+
+class RawContentStorePipeline:
+    """ Store raw page contents in a content-addressed store
+    (set by ``RAW_CONTENT_STORE``, a local path or ``s3://bucket/prefix/``),
+    and replace ``raw_content`` with a hash and a path in the store:
+    ``raw_content_hash`` and ``raw_content_stored_url`` fields in item
+    metadata. Byte-identical pages are stored only once: hashes of up to
+    ``RAW_CONTENT_STORE_CACHE_SIZE`` recently stored pages are remembered,
+    other pages are written again (to the same path).
+    """
+    default_cache_size = 2**16
+
+    def __init__(self, store_uri, settings=None, stats=None,
+                 cache_size=default_cache_size):
+        self.store = get_store(store_uri, settings)
+        self.stats = stats
+        self.cache_size = cache_size
+        # Digests of recently stored pages, least recently used first
+        self.stored = OrderedDict()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        store_uri = settings.get('RAW_CONTENT_STORE')
+        if not store_uri:
+            raise NotConfigured
+        return cls(store_uri, settings=settings, stats=crawler.stats,
+                   cache_size=settings.getint(
+                       'RAW_CONTENT_STORE_CACHE_SIZE', cls.default_cache_size))
+
+    def process_item(self, item, spider):
+        raw_content = item.get('raw_content')
+        if raw_content is None:
+            return item
+        data = raw_content.encode('utf8')
+        digest = hashlib.sha256(data).digest()
+        content_hash = digest.hex().upper()
+        path = raw_content_path(content_hash)
+        if digest in self.stored:
+            self.stored.move_to_end(digest)
+            self._inc_stats('deduplicated')
+            self._inc_stats('deduplicated_bytes', len(data))
+            return self._replace_raw_content(item, content_hash, path)
+        dfd = defer.maybeDeferred(
+            self.store.persist_file, path, BytesIO(data), info=None,
+            headers={'Content-Type': 'text/html; charset=utf-8'})
+
+        def _stored(_):
+            if self.cache_size:
+                self.stored[digest] = None
+                if len(self.stored) > self.cache_size:
+                    self.stored.popitem(last=False)
+            self._inc_stats('stored')
+            self._inc_stats('stored_bytes', len(data))
+            return self._replace_raw_content(item, content_hash, path)
+
+        def _failed(failure):
+            logger.error('Failed to store raw content of %s: %s',
+                         item.get('url'), failure.getErrorMessage())
+            self._inc_stats('failed')
+            return item
+
+        return dfd.addCallbacks(_stored, _failed)
+
+    def _replace_raw_content(self, item, content_hash, path):
+        metadata = item.setdefault('metadata', {})
+        metadata['raw_content_hash'] = content_hash
+        metadata['raw_content_stored_url'] = path
+        del item['raw_content']
+        return item
+
+    def _inc_stats(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value('raw_content_store/' + key, count)
+
+
+def raw_content_path(content_hash):
+    """ Path of raw content with given hash, relative to the store root.
+
+    >>> raw_content_path('9F86D081884C7D659A2FEAA0C55AD015')
+    '9F/9F86D081884C7D659A2FEAA0C55AD015.html'
+    """
+    return '{}/{}.html'.format(content_hash[:2], content_hash)
+
+
+def get_store(uri, settings=None):
+    if urlsplit(uri).scheme == 's3':
+        if settings is not None:
+            # The same way as it's done in FilesPipeline.from_settings
+            S3FilesStore.AWS_ACCESS_KEY_ID = settings['AWS_ACCESS_KEY_ID']
+            S3FilesStore.AWS_SECRET_ACCESS_KEY = \
+                settings['AWS_SECRET_ACCESS_KEY']
+            S3FilesStore.POLICY = settings['FILES_STORE_S3_ACL']
+        return S3FilesStore(uri)
+    if uri.startswith('file://'):
+        uri = uri[len('file://'):]
+    return FSFilesStore(uri)
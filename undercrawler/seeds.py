@@ -0,0 +1,169 @@
+import hashlib
+import logging
+from pathlib import Path
+import re
+from urllib.parse import urlsplit
+
+from scrapy.linkextractors import LinkExtractor
+from scrapy.utils.url import add_http_if_no_scheme
+from w3lib.url import canonicalize_url
+
+from .dupe_filter import FingerprintSet
+
+
+logger = logging.getLogger(__name__)
+
+
+class SeedUrls:
+    """ Seed urls read lazily from a file, one url per line.
+    Empty lines and lines starting with "#" are skipped, urls without
+    a scheme get "http://", and duplicates (after canonicalization)
+    are skipped, keeping only 8 bytes per seen url.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        seen = FingerprintSet(8)
+        n_duplicates = 0
+        with Path(self.path).open('rt', encoding='utf8') as f:
+            for line in f:
+                url = line.strip()
+                if not url or url.startswith('#'):
+                    continue
+                url = add_http_if_no_scheme(url)
+                key = hashlib.sha1(
+                    canonicalize_url(url).encode('utf8')).digest()[:8]
+                if key in seen:
+                    n_duplicates += 1
+                    continue
+                seen.add(key)
+                yield url
+        logger.info('Read %d seed urls from %s, skipped %d duplicates',
+                    len(seen), self.path, n_duplicates)
+
+    def __repr__(self):
+        return 'SeedUrls({!r})'.format(self.path)
+
+
+_url_re = re.compile(r'https?://([^/?#]*)(.*)', re.IGNORECASE | re.DOTALL)
+
+
+class AllowedUrls:
+    """ Urls allowed by seeds, indexed by host, so that checking a url
+    does not depend on the number of seeds. Matches the same urls as
+    ``allowed_re`` regexps: a url is allowed if it is on the domain of
+    some seed or its subdomain, or if hard_url_constraint is True,
+    if it starts with the seed url (with or without "www").
+    Regexps (as kept in ``spider.state`` by older versions) can be added
+    with ``add_regexp``, they are checked one by one.
+    """
+    def __init__(self):
+        self.domains = set()
+        self.prefixes = {}  # netloc -> set of url prefixes after netloc
+        self.regexps = []
+
+    def add(self, url, hard_url_constraint):
+        """ Allow urls under the seed url, return True if they were
+        not allowed before.
+
+        >>> allowed = AllowedUrls()
+        >>> allowed.add('http://www.example.com/foo', False)
+        True
+        >>> allowed.add('https://example.com/bar', False)
+        False
+        """
+        if not hard_url_constraint:
+            netloc = urlsplit(url).netloc.lower()
+            if netloc.startswith('www.'):
+                netloc = netloc[len('www.'):]
+            if netloc in self.domains:
+                return False
+            self.domains.add(netloc)
+            return True
+        url = re.sub(r'^https?://(www\.)?', '', url)
+        netloc = urlsplit('http://' + url).netloc
+        prefix = url[len(netloc):].lower()
+        netloc = netloc.lower()
+        netlocs = [netloc]
+        if len(netloc.split('.')) <= 2:
+            netlocs.append('www.' + netloc)
+        if prefix in self.prefixes.get(netloc, ()):
+            return False
+        for netloc in netlocs:
+            self.prefixes.setdefault(netloc, set()).add(prefix)
+        return True
+
+    def add_regexp(self, regexp):
+        if regexp not in self.regexps:
+            self.regexps.append(regexp)
+
+    def matches(self, url):
+        """
+        >>> allowed = AllowedUrls()
+        >>> _ = allowed.add('http://www.example.com', False)
+        >>> _ = allowed.add('http://blog.foo.com/posts', True)
+        >>> [allowed.matches(url) for url in [
+        ...     'https://example.com/a', 'http://news.example.com:8080/',
+        ...     'ftp://example.com/', 'http://example.org/',
+        ...     'http://blog.foo.com/posts/1', 'http://www.blog.foo.com/posts',
+        ...     'http://blog.foo.com/about', 'http://foo.com/posts']]
+        [True, True, False, False, True, False, False, False]
+        """
+        m = _url_re.match(url)
+        if m is None:
+            return False
+        netloc = m.group(1).lower()
+        host = netloc.split(':', 1)[0]
+        hosts = [netloc] if host == netloc else [netloc, host]
+        if self.domains and any(
+                _is_subdomain(h, self.domains) for h in hosts):
+            return True
+        if self.prefixes:
+            rest = None
+            for h in hosts:
+                prefixes = self.prefixes.get(h)
+                if prefixes:
+                    if rest is None:
+                        rest = (netloc + m.group(2)).lower()
+                    if any(rest.startswith(prefix, len(h))
+                           for prefix in prefixes):
+                        return True
+        return any(regexp.search(url) for regexp in self.regexps)
+
+    def __len__(self):
+        return len(self.domains) + len(self.prefixes) + len(self.regexps)
+
+    def __repr__(self):
+        return '<AllowedUrls: {} domains, {} hosts with url prefixes, ' \
+               '{} regexps>'.format(
+                   len(self.domains), len(self.prefixes), len(self.regexps))
+
+
+class AllowedLinkExtractor(LinkExtractor):
+    """ LinkExtractor that only extracts links matching AllowedUrls,
+    or any links if nothing is allowed yet (as LinkExtractor with empty
+    ``allow``). AllowedUrls can be updated after the link extractor
+    is created.
+    """
+    def __init__(self, allowed, **kwargs):
+        super().__init__(**kwargs)
+        self.allowed = allowed
+
+    def _link_allowed(self, link):
+        return super()._link_allowed(link) and self._url_allowed(link.url)
+
+    def matches(self, url):
+        return super().matches(url) and self._url_allowed(url)
+
+    def _url_allowed(self, url):
+        return not self.allowed or self.allowed.matches(url)
+
+
+def _is_subdomain(host, domains):
+    while True:
+        if host in domains:
+            return True
+        _, dot, host = host.partition('.')
+        if not dot:
+            return False
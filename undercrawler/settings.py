@@ -10,6 +10,9 @@ SPLASH_URL = 'http://127.0.0.1:8050'
 
 AUTOLOGIN_URL = 'http://127.0.0.1:8089'
 AUTOLOGIN_ENABLED = True
+AUTOLOGIN_COOKIE_CACHE = None
+AUTOLOGIN_COOKIE_CACHE_TTL = 3600
+AUTOLOGIN_COOKIE_CACHE_WAIT = 60
 CRAZY_SEARCH_ENABLED = True
 FOLLOW_LINKS = True
 
@@ -20,29 +23,71 @@ PREFER_PAGINATION = True
 ADBLOCK = False
 MAX_DOMAIN_SEARCH_FORMS = 10
 HARD_URL_CONSTRAINT = False
+MODEL_SERVER_SOCKET = None
+LINK_SCORER = None
+LINK_SCORER_PRIORITY_RANGE = 5
+SITEMAP_SEEDING = False
+SITEMAP_MAX_URLS = 50000
 AVOID_DUP_CONTENT_ENABLED = True
 
 FILES_STORE_S3_ACL = 'public-read'
 # Set FILES_STORE to enable
 ITEM_PIPELINES = {
     'undercrawler.media_pipeline.UndercrawlerMediaPipeline': 1,
+    'undercrawler.near_dupe_pipeline.NearDuplicatePipeline': 400,
+    'undercrawler.raw_content_pipeline.RawContentStorePipeline': 500,
+    'undercrawler.export_pipeline.CompressedExportPipeline': 900,
 }
 
+NEAR_DUPE_ENABLED = False
+NEAR_DUPE_ACTION = 'mark'
+NEAR_DUPE_THRESHOLD = 0.9
+NEAR_DUPE_MAX_ITEMS = 50000
+NEAR_DUPE_EVICTION = 'lru'
+
+# Set EXPORT_DIR to enable CompressedExportPipeline
+EXPORT_COMPRESSION = 'gzip'
+EXPORT_ROTATE_MB = 512
+EXPORT_ROTATE_SECONDS = 0
+EXPORT_QUEUE_SIZE = 1000
+EXPORT_INDEX = True
+
+STAGE_TIMING_ENABLED = False
+
+MEMORY_ACCOUNTING_ENABLED = False
+MEMORY_ACCOUNTING_INTERVAL = 60
+MEMORY_SOFT_LIMIT_MB = 0
+MEMORY_HARD_LIMIT_MB = 0
+MEMORY_SHED_PRIORITY = -3
+
+EXTENSIONS = {
+    'undercrawler.metrics.MetricsExtension': 500,
+}
+# Set METRICS_PORT (a port or a range like [9410, 9450])
+# to enable MetricsExtension
+METRICS_HOST = '127.0.0.1'
+
 DOWNLOADER_MIDDLEWARES = {
     'maybedont.scrapy_middleware.AvoidDupContentMiddleware': 200,
-    'autologin_middleware.AutologinMiddleware': 605,
+    'undercrawler.middleware.CachedAutologinMiddleware': 605,
     'scrapy.downloadermiddlewares.cookies.CookiesMiddleware': None,
     'undercrawler.middleware.CookiesMiddlewareIfNoSplash': 700,
     'undercrawler.middleware.SplashAwareAutoThrottle': 722,
-    'scrapy_splash.SplashCookiesMiddleware': 723,
+    'undercrawler.middleware.SplashDeltaCookiesMiddleware': 723,
     'scrapy_splash.SplashMiddleware': 725,
     'scrapy.downloadermiddlewares.httpcompression'
         '.HttpCompressionMiddleware': 810,
 }
 DUPEFILTER_CLASS = 'undercrawler.dupe_filter.DupeFilter'
+URL_CACHE_SIZE = 65536
+DUPEFILTER_FINGERPRINT_BITS = 0
 
 SPIDER_MIDDLEWARES = {
     'scrapy_splash.SplashDeduplicateArgsMiddleware': 100,
+    # Spider output goes from higher to lower orders, so this runs before
+    # DepthMiddleware (900), and sees priorities assigned by the spider,
+    # not yet adjusted with DEPTH_PRIORITY
+    'undercrawler.middleware.MemoryAccountingMiddleware': 950,
 }
 
 # use the same user agent as autologin by default
@@ -55,6 +100,13 @@ COOKIES_ENABLED = True
 
 # Run full headless-horseman scripts
 RUN_HH = True
+# Headless-horseman waits until there are no pending requests and
+# no DOM mutations for HH_IDLE_MS, but at most HH_IDLE_TIMEOUT_MS
+HH_IDLE_MS = 500
+HH_IDLE_TIMEOUT_MS = 3000
+# Skip remaining headless-horseman stages after this time (including
+# page load), so that the page fits into splash timeout (0 to disable)
+HH_RENDER_BUDGET_MS = 20000
 
 DOWNLOAD_DELAY = 0.1  # Adjusted by AutoThrottle
 SPLASH_AUTOTHROTTLE_ENABLED = True
@@ -65,6 +117,7 @@ CONCURRENT_REQUESTS = 32
 CONCURRENT_REQUESTS_PER_DOMAIN = 32
 
 DEPTH_PRIORITY = 1
+# undercrawler.squeues.CompactFifoDiskQueue takes much less disk space
 SCHEDULER_DISK_QUEUE = 'scrapy.squeues.PickleFifoDiskQueue'
 SCHEDULER_MEMORY_QUEUE = 'scrapy.squeues.FifoMemoryQueue'
 SCHEDULER_DEBUG = True
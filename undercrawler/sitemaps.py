@@ -0,0 +1,91 @@
+""" Streaming sitemap parsing for seeding the crawl from sitemaps
+(see ``SITEMAP_SEEDING`` setting).
+"""
+import gzip
+from io import BytesIO
+import logging
+from urllib.parse import urljoin
+
+import lxml.etree
+
+
+logger = logging.getLogger(__name__)
+
+
+def iter_sitemap(body, max_size=50 * 2**20):
+    """ Yield (kind, url) pairs from a sitemap or a sitemap index,
+    where kind is "url" or "sitemap". body may be gzipped. Document is
+    parsed incrementally and elements are cleared as they are processed,
+    so memory does not grow with sitemap size.
+    Parsing stops after max_size bytes of uncompressed data.
+
+    >>> body = b'''<?xml version="1.0" encoding="UTF-8"?>
+    ... <urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+    ...   <url><loc> http://example.com/a </loc><priority>1</priority></url>
+    ...   <url><loc>http://example.com/b</loc></url>
+    ... </urlset>'''
+    >>> list(iter_sitemap(body))
+    [('url', 'http://example.com/a'), ('url', 'http://example.com/b')]
+    >>> list(iter_sitemap(gzip.compress(
+    ...     b'<sitemapindex><sitemap><loc>http://example.com/s.xml</loc>'
+    ...     b'</sitemap></sitemapindex>')))
+    [('sitemap', 'http://example.com/s.xml')]
+    """
+    source = BytesIO(body)
+    if body[:2] == b'\x1f\x8b':
+        source = gzip.GzipFile(fileobj=source)
+    events = lxml.etree.iterparse(
+        _LimitedReader(source, max_size), events=('end',), recover=True,
+        resolve_entities=False, no_network=True)
+    try:
+        for _, element in events:
+            tag = _local_name(element.tag)
+            if tag == 'loc':
+                parent = element.getparent()
+                kind = _local_name(parent.tag) if parent is not None else None
+                url = (element.text or '').strip()
+                if kind in {'url', 'sitemap'} and url:
+                    yield kind, url
+            elif tag in {'url', 'sitemap'}:
+                element.clear()
+                # Drop references to already processed siblings
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+    except (lxml.etree.XMLSyntaxError, OSError, EOFError) as e:
+        logger.warning('Error parsing sitemap: %r', e)
+
+
+def robots_sitemap_urls(robots_text, base_url):
+    """ Return sitemap urls listed in robots.txt.
+
+    >>> robots_sitemap_urls(
+    ...     'User-agent: *\\nDisallow: /cart\\nsitemap: /sitemap_index.xml',
+    ...     'http://example.com/robots.txt')
+    ['http://example.com/sitemap_index.xml']
+    """
+    urls = []
+    for line in robots_text.splitlines():
+        if line.lstrip().lower().startswith('sitemap:'):
+            url = line.split(':', 1)[1].strip()
+            if url:
+                urls.append(urljoin(base_url, url))
+    return urls
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else None
+
+
+class _LimitedReader:
+    def __init__(self, f, max_size):
+        self.f = f
+        self.remaining = max_size
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
@@ -1,6 +1,7 @@
 from base64 import b64decode
 import contextlib
 import hashlib
+from itertools import chain
 import os
 from pathlib import Path
 import re
@@ -8,20 +9,27 @@ from typing import Optional
 from urllib.parse import urljoin, urlsplit
 import uuid
 
-import autopager
-import formasaurus
 import scrapy
 from scrapy import Request, FormRequest
 from scrapy.linkextractors import LinkExtractor
 from scrapy.settings import Settings
-from scrapy.utils.url import canonicalize_url, add_http_if_no_scheme
+from scrapy.utils.misc import load_object
+from scrapy.utils.url import add_http_if_no_scheme
 from scrapy.utils.python import unique
+from scrapy.utils.response import get_base_url
 from scrapy_cdr import text_cdr_item
 from scrapy_splash import SplashRequest, SplashFormRequest
+from twisted.internet.defer import Deferred
 from autologin_middleware import link_looks_like_logout
 
 from .crazy_form_submitter import search_form_requests
-from .utils import cached_property, load_directive, using_splash
+from .dupe_filter import DupeFilter, compact_fingerprint
+from .model_server import ModelClient, ModelServerError
+from .seeds import AllowedLinkExtractor, AllowedUrls, SeedUrls
+from .sitemaps import iter_sitemap, robots_sitemap_urls
+from .stage_timing import StageTimer
+from .utils import body_text, cached_property, load_directive, \
+    using_splash, UrlCache
 import undercrawler.settings
 
 
@@ -30,11 +38,11 @@ class BaseSpider(scrapy.Spider):
 
     def __init__(self, url, search_terms=None, *args, **kwargs):
         if url.startswith('.') or url.startswith('/'):
-            with Path(url).open('rt', encoding='utf8') as f:
-                urls = [line.strip() for line in f]
+            # Read lazily in start_requests
+            self.start_urls = SeedUrls(url)
         else:
-            urls = [u for u in url.split() if u]
-        self.start_urls = [add_http_if_no_scheme(_url) for _url in urls]
+            self.start_urls = [
+                add_http_if_no_scheme(_url) for _url in url.split() if _url]
         self.search_terms = search_terms
         self._extra_search_terms = None  # lazy-loaded via extra_search_terms
         self._reset_link_extractors()
@@ -42,13 +50,26 @@ class BaseSpider(scrapy.Spider):
             tags=['img'], attrs=['src'], deny_extensions=[],
             canonicalize=False)
         self.state = {}
-        self.use_splash = None  # set up in start_requests
+        self.use_splash = None  # set up in from_crawler and start_requests
         self._screenshot_dest = None  # type: Path
+        self._stage_timer = None  # lazy-loaded via stage_timer
+        self._model_client = None  # lazy-loaded via model_client
+        self._link_scorer = None  # lazy-loaded via link_scorer
+        # Replaced with the cache shared with the dupefilter in from_crawler
+        self.url_cache = UrlCache()
         # Load headless horseman scripts
         self.lua_source = load_directive('headless_horseman.lua')
         self.js_source = load_directive('headless_horseman.js')
         super().__init__(*args, **kwargs)
 
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.url_cache = UrlCache.from_crawler(crawler)
+        # Requests can be read from the disk queue before start_requests
+        spider.use_splash = using_splash(crawler.settings)
+        return spider
+
     def start_requests(self):
         self.use_splash = using_splash(self.settings)
         for url in self.start_urls:
@@ -66,6 +87,9 @@ class BaseSpider(scrapy.Spider):
                 'run_hh': settings.getbool('RUN_HH'),
                 'return_png': settings.getbool('SCREENSHOT'),
                 'images_enabled': settings.getbool('IMAGES_ENABLED'),
+                'idle_ms': settings.getint('HH_IDLE_MS'),
+                'idle_timeout_ms': settings.getint('HH_IDLE_TIMEOUT_MS'),
+                'render_budget_ms': settings.getint('HH_RENDER_BUDGET_MS'),
             }
             for s in ['VIEWPORT_WIDTH', 'VIEWPORT_HEIGHT',
                       'SCREENSHOT_WIDTH', 'SCREENSHOT_HEIGHT']:
@@ -85,16 +109,92 @@ class BaseSpider(scrapy.Spider):
         return cls(url, callback=callback, meta=meta, **kwargs)
 
     def parse_first(self, response):
-        allowed = allowed_re(
-            response.url, self.settings.getbool('HARD_URL_CONSTRAINT'))
-        if allowed not in self.allowed:
-            self.allowed.add(allowed)
-            # Reset link extractors to pick up with the latest self.allowed regexps
-            self._reset_link_extractors()
-            self.logger.info('Updated allowed regexps: %s', self.allowed)
-        yield from self.parse(response)
+        if self.allowed.add(
+                response.url, self.settings.getbool('HARD_URL_CONSTRAINT')):
+            self.logger.info('Allowed urls under %s: %s',
+                             response.url, self.allowed)
+        return _chain_output(
+            self._seed_sitemap_requests(response), self.parse(response))
+
+    def _seed_sitemap_requests(self, response):
+        if self.settings.getbool('SITEMAP_SEEDING'):
+            with _dont_increase_depth(response):
+                yield self._sitemap_request(
+                    urljoin(response.url, '/robots.txt'), is_robots=True)
+                yield self._sitemap_request(
+                    urljoin(response.url, '/sitemap.xml'))
+
+    def parse_robots(self, response):
+        for url in robots_sitemap_urls(
+                response.body.decode('utf8', 'replace'), response.url):
+            with _dont_increase_depth(response):
+                yield self._sitemap_request(url)
+
+    def parse_sitemap(self, response):
+        """ Follow sitemap index entries and yield requests for allowed
+        urls from the sitemap. Sitemap is parsed as requests are consumed,
+        and the total number of page requests (not counting sitemaps)
+        is limited by SITEMAP_MAX_URLS.
+        """
+        max_urls = self.settings.getint('SITEMAP_MAX_URLS')
+        for kind, url in iter_sitemap(response.body):
+            url = response.urljoin(url)
+            if self.state.get('sitemap_requests', 0) >= max_urls:
+                self.logger.info('SITEMAP_MAX_URLS limit reached at %s',
+                                 response.url)
+                self._inc_stats('sitemap/max_urls_reached')
+                break
+            if kind == 'sitemap':
+                with _dont_increase_depth(response):
+                    yield self._sitemap_request(url)
+            elif self.link_extractor.matches(url):
+                self.state['sitemap_requests'] = \
+                    self.state.get('sitemap_requests', 0) + 1
+                self._inc_stats('sitemap/urls')
+                yield self.make_request(url, meta={
+                    'from_sitemap': True, 'extracted_at': response.url})
+            else:
+                self._inc_stats('sitemap/urls_not_allowed')
+
+    def _sitemap_request(self, url, is_robots=False):
+        """ A plain request for robots.txt or a sitemap, made before
+        page requests (sitemaps are not rendered with splash).
+        """
+        if not is_robots:
+            self._inc_stats('sitemap/sitemaps')
+        return Request(
+            url, priority=10,
+            callback=self.parse_robots if is_robots else self.parse_sitemap)
+
+    def _inc_stats(self, key):
+        if hasattr(self, 'crawler'):
+            self.crawler.stats.inc_value(key)
 
     def parse(self, response):
+        """ If MODEL_SERVER_SOCKET is set, forms and pagination are
+        extracted by the model server in a thread, and a Deferred
+        with parse results is returned.
+        """
+        if self.model_client and self.link_extractor.matches(response.url):
+            d = self.model_client.deferred_page_models(
+                response.text, get_base_url(response),
+                pagination=self.prefer_pagination)
+            d.addErrback(self._model_server_failed, response)
+            d.addCallback(lambda page_models: self._parse(response, page_models))
+            return d
+        return self._parse(response)
+
+    def _model_server_failed(self, failure, response):
+        failure.trap(ModelServerError)
+        self.logger.warning(
+            'Using local models for %s: %s', response.url, failure.value)
+
+    def _parse(self, response, page_models=None):
+        if hasattr(self, 'crawler'):
+            self.url_cache.record_stats(self.crawler.stats)
+        if self.use_splash and \
+                (getattr(response, 'data', None) or {}).get('budget_exhausted'):
+            self._inc_stats('hh/budget_exhausted')
         if not self.link_extractor.matches(response.url):
             return
 
@@ -102,59 +202,98 @@ class BaseSpider(scrapy.Spider):
             'from_search': response.meta.get('is_search'),
             'extracted_at': response.url,
         }
-
-        def request(url, meta=None, **kwargs):
+        timer = self.stage_timer
+        scorer = self.link_scorer
+        page_text = None  # extracted once for the scorer and near-duplicates
+        if scorer:
+            with timer('parse/link_scorer'):
+                page_text = body_text(response)
+                new_content = scorer.is_new_content(response, page_text)
+                if 'link_features' in response.meta:
+                    scorer.update(response.meta['link_features'], new_content)
+
+        def request(url, meta=None, link_text=None, **kwargs):
             meta = meta or {}
             meta.update(request_meta)
+            if scorer and not meta.get('is_search'):
+                features = scorer.link_features(url, link_text, response, meta)
+                meta['link_features'] = features
+                # Kept so that memory shedding can ignore this adjustment
+                meta['link_scorer_priority'] = scorer.priority(features)
+                kwargs['priority'] = \
+                    kwargs.get('priority', 0) + meta['link_scorer_priority']
             return self.make_request(url, meta=meta, **kwargs)
 
-        forms = (formasaurus.extract_forms(response.text) if response.text
-                 else [])
+        prefer_pagination = self.prefer_pagination
+        if page_models is None:
+            with timer('parse/forms'):
+                page_models = self._page_models(response)
+        forms, pagination_urls = page_models
+        with timer('parse/screenshot'):
+            screenshot = self._take_screenshot(response)
         metadata = dict(
             is_page=response.meta.get('is_page', False),
             is_onclick=response.meta.get('is_onclick', False),
             is_iframe=response.meta.get('is_iframe', False),
             is_search=response.meta.get('is_search', False),
             from_search=response.meta.get('from_search', False),
+            from_sitemap=response.meta.get('from_sitemap', False),
             extracted_at=response.meta.get('extracted_at', None),
             depth=response.meta.get('depth', None),
             priority=response.request.priority,
             forms=[meta for _, meta in forms],
-            screenshot=self._take_screenshot(response),
+            screenshot=screenshot,
         )
-        follow_urls = {link_to_url(link) for link in
-                       self.link_extractor.extract_links(response)
-                       if not self._looks_like_logout(link, response)}
-        yield self.text_cdr_item(
-            response, follow_urls=follow_urls, metadata=metadata)
+        with timer('parse/links'):
+            follow_links = {}  # url -> link text
+            for link in self.link_extractor.extract_links(response):
+                if not self._looks_like_logout(link, response):
+                    follow_links.setdefault(link_to_url(link), link.text)
+            follow_urls = set(follow_links)
+        with timer('parse/item'):
+            item = self.text_cdr_item(
+                response, follow_urls=follow_urls, metadata=metadata)
+            if self.settings.getbool('NEAR_DUPE_ENABLED'):
+                # For NearDuplicatePipeline, using the parsed response
+                item._body_text = page_text if page_text is not None \
+                    else body_text(response)
+        yield item
 
         if not self.settings.getbool('FOLLOW_LINKS'):
             return
 
-        if self.settings.getbool('PREFER_PAGINATION'):
+        if prefer_pagination:
             # Follow pagination links; pagination is not a subject of
             # a max depth limit. This also prioritizes pagination links because
             # depth is not increased for them.
+            with timer('parse/pagination'):
+                pagination_urls = self._pagination_urls(
+                    response, pagination_urls)
             with _dont_increase_depth(response):
-                for url in self._pagination_urls(response):
+                for url in pagination_urls:
                     # self.logger.debug('Pagination link found: %s', url)
                     yield request(url, meta={'is_page': True})
 
         # Follow all in-domain links.
         # Pagination requests are sent twice, but we don't care because
         # they're be filtered out by a dupefilter.
-        for url in follow_urls:
-            yield request(url)
+        for url, link_text in follow_links.items():
+            yield request(url, link_text=link_text)
 
         # urls extracted from onclick handlers
-        for url in get_js_links(response):
+        with timer('parse/onclick'):
+            js_links = get_js_links(response)
+        for url in js_links:
             priority = 0 if _looks_like_url(url) else -15
             url = response.urljoin(url)
             yield request(url, meta={'is_onclick': True}, priority=priority)
 
         # go to iframes
-        for link in self.iframe_link_extractor.extract_links(response):
-            yield request(link_to_url(link), meta={'is_iframe': True})
+        with timer('parse/iframes'):
+            iframe_links = self.iframe_link_extractor.extract_links(response)
+        for link in iframe_links:
+            yield request(link_to_url(link), meta={'is_iframe': True},
+                          link_text=link.text)
 
         # Try submitting forms
         for form, meta in forms:
@@ -162,7 +301,7 @@ class BaseSpider(scrapy.Spider):
                 yield request(**request_kwargs)
 
     def handle_form(self, url, form, meta):
-        action = canonicalize_url(urljoin(url, form.action))
+        action = self.url_cache.canonicalize_url(urljoin(url, form.action))
         if not self.link_extractor.matches(action):
             return
         if (meta['form'] == 'search' and
@@ -172,10 +311,12 @@ class BaseSpider(scrapy.Spider):
                 self.settings.getint('MAX_DOMAIN_SEARCH_FORMS')):
             self.logger.debug('Found a search form at %s', url)
             self.handled_search_forms.add(action)
-            for request_kwargs in search_form_requests(
+            with self.stage_timer('search_form_requests'):
+                search_requests = list(search_form_requests(
                     url, form, meta,
                     search_terms=self.search_terms,
-                    extra_search_terms=self.extra_search_terms):
+                    extra_search_terms=self.extra_search_terms))
+            for request_kwargs in search_requests:
                 request_kwargs['meta'] = {'is_search': True}
                 request_kwargs['cls'] = \
                     SplashFormRequest if self.use_splash else FormRequest
@@ -207,13 +348,28 @@ class BaseSpider(scrapy.Spider):
             metadata=metadata,
         )
 
-    def _pagination_urls(self, response):
+    def _page_models(self, response):
+        """ Return forms extracted with formasaurus, and None for
+        pagination urls (they are extracted later), the same as
+        ``ModelClient.page_models`` returns.
+        """
+        forms = extract_forms(response.text) if response.text else []
+        return forms, None
+
+    @property
+    def prefer_pagination(self):
+        return (self.settings.getbool('FOLLOW_LINKS') and
+                self.settings.getbool('PREFER_PAGINATION'))
+
+    def _pagination_urls(self, response, urls=None):
+        if urls is None:
+            import autopager  # see extract_forms
+            # autopager resolves urls against response.url, not <base href>
+            urls = autopager.urls(response, baseurl=get_base_url(response))
         return [
             url for url in
-            unique(
-                canonicalize_url(url, keep_fragments=True)
-                for url in autopager.urls(response)
-            )
+            unique(self.url_cache.canonicalize_url(url, keep_fragments=True)
+                   for url in urls)
             if self.link_extractor.matches(url)
             ]
 
@@ -226,9 +382,38 @@ class BaseSpider(scrapy.Spider):
         else:
             return []
 
+    def closed(self, reason):
+        if self._model_client:
+            self._model_client.close()
+
+    @cached_property('_model_client')
+    def model_client(self):
+        path = self.settings.get('MODEL_SERVER_SOCKET')
+        return ModelClient(path) if path else False
+
+    @cached_property('_link_scorer')
+    def link_scorer(self):
+        scorer_cls = self.settings.get('LINK_SCORER')
+        if not scorer_cls:
+            return False
+        return load_object(scorer_cls).from_crawler(
+            self.crawler, self.state.setdefault('link_scorer', {}))
+
+    @cached_property('_stage_timer')
+    def stage_timer(self):
+        return StageTimer.from_crawler(getattr(self, 'crawler', None))
+
     @property
     def allowed(self):
-        return self.state.setdefault('allowed', set())
+        allowed = self.state.get('allowed')
+        if not isinstance(allowed, AllowedUrls):
+            # Migrate from a set of regexps kept in state by older versions
+            regexps = allowed or []
+            allowed = self.state['allowed'] = AllowedUrls()
+            for regexp in regexps:
+                allowed.add_regexp(regexp)
+            self._reset_link_extractors()
+        return allowed
 
     def _reset_link_extractors(self):
         self._link_extractor = None
@@ -237,19 +422,19 @@ class BaseSpider(scrapy.Spider):
 
     @cached_property('_link_extractor')
     def link_extractor(self):
-        return LinkExtractor(allow=self.allowed, unique=False,
-                             canonicalize=False)
+        return AllowedLinkExtractor(self.allowed, unique=False,
+                                    canonicalize=False)
 
     @cached_property('_iframe_link_extractor')
     def iframe_link_extractor(self):
-        return LinkExtractor(
-            allow=self.allowed, tags=['iframe'], attrs=['src'],
+        return AllowedLinkExtractor(
+            self.allowed, tags=['iframe'], attrs=['src'],
             unique=False, canonicalize=False)
 
     @cached_property('_files_link_extractor')
     def files_link_extractor(self):
-        return LinkExtractor(
-            allow=self.allowed,
+        return AllowedLinkExtractor(
+            self.allowed,
             tags=['a'],
             attrs=['href'],
             deny_extensions=[],  # allow all extensions
@@ -305,6 +490,14 @@ class ArachnadoSpider(BaseSpider):
         self.start_url = self.start_urls[0]
 
 
+def _chain_output(first, output):
+    """ Chain callback output after first, output can be a Deferred.
+    """
+    if isinstance(output, Deferred):
+        return output.addCallback(lambda result: chain(first, result))
+    return chain(first, output)
+
+
 @contextlib.contextmanager
 def _dont_increase_depth(response):
     # XXX: a hack to keep the same depth for outgoing requests
@@ -329,6 +522,16 @@ def get_onclick_url(attr_value):
     return m.group("url").strip() if m else m
 
 
+def extract_forms(html):
+    """ Extract forms with formasaurus. formasaurus and autopager load
+    scikit-learn and their models on import, so they are imported on first
+    use: this keeps spider startup fast, and autopager is never loaded if
+    PREFER_PAGINATION is disabled.
+    """
+    import formasaurus
+    return formasaurus.extract_forms(html)
+
+
 def get_js_links(response):
     """ Extract URLs from JS. """
     urls = [
@@ -385,9 +588,26 @@ def link_to_url(link):
     return link.url
 
 
-def url_fingerprint(url):
-    url = canonicalize_url(url, keep_fragments=True)
-    return hashlib.sha1(url.encode()).hexdigest()
+def url_fingerprint(url, fingerprint_bits=0, url_cache=None):
+    r""" SHA-1 hex fingerprint of a canonical url (fragments are kept),
+    or if fingerprint_bits is 64 or 128, a compact binary fingerprint
+    of this size (see DUPEFILTER_FINGERPRINT_BITS).
+
+    >>> url_fingerprint('http://example.com/?b=2&a=1')
+    '0677b9d64c52a49b37afb7aa9c1e53fb4e82c701'
+    >>> url_fingerprint('http://example.com/?a=1&b=2', 64)
+    b'\x06w\xb9\xd6LR\xa4\x9b'
+    """
+    if url_cache is None:
+        url_cache = UrlCache(maxsize=0)
+    url = url_cache.canonicalize_url(url, keep_fragments=True)
+    fp = hashlib.sha1(url.encode()).hexdigest()
+    if not fingerprint_bits:
+        return fp
+    if fingerprint_bits not in DupeFilter.fingerprint_sizes:
+        raise ValueError('Unsupported fingerprint size: {}'
+                         .format(fingerprint_bits))
+    return compact_fingerprint(fp, fingerprint_bits // 8)
 
 
 def allowed_re(url, hard_url_constraint):
@@ -0,0 +1,158 @@
+""" Compact disk queues for the scheduler. Only the parts of a request
+that differ from ``spider.make_request(url)`` are stored: splash args
+(including lua_source and js_source) and meta set by make_request are
+rebuilt when the request is read from the queue. To use them, set
+``SCHEDULER_DISK_QUEUE = 'undercrawler.squeues.CompactFifoDiskQueue'``.
+Requests written by ``scrapy.squeues.PickleFifoDiskQueue`` can be read too,
+so an existing ``JOBDIR`` can be resumed with a compact queue.
+"""
+from copy import deepcopy
+import os
+import pickle
+
+from queuelib import queue
+try:
+    from scrapy.utils.request import request_from_dict
+except ImportError:  # Scrapy < 2.6
+    from scrapy.utils.reqser import request_from_dict, request_to_dict
+else:
+    def request_to_dict(request, spider):
+        return request.to_dict(spider=spider)
+
+
+class CompactRequestCodec:
+    """ Encode requests as a diff against ``spider.make_request(url)``.
+    """
+    def __init__(self, spider, stats=None):
+        self.spider = spider
+        self.stats = stats
+        self._base_template = None
+
+    def encode(self, request):
+        """ Raise ValueError for requests that can not be serialized,
+        as scrapy.squeues.PickleFifoDiskQueue does, so that the scheduler
+        keeps them in memory.
+        """
+        try:
+            d = request_to_dict(request, self.spider)
+            url = d.pop('url')
+            data = pickle.dumps(
+                (url, dict_diff(d, self._template(url))), protocol=4)
+        # Both PicklingError and AttributeError can be raised by pickle.dumps,
+        # TypeError is raised from parsel.Selector
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            raise ValueError(str(e)) from e
+        if self.stats is not None:
+            self.stats.inc_value('disk_queue/requests')
+            self.stats.inc_value('disk_queue/bytes', len(data))
+            self.stats.set_value(
+                'disk_queue/bytes_per_request',
+                self.stats.get_value('disk_queue/bytes') //
+                self.stats.get_value('disk_queue/requests'))
+        return data
+
+    def decode(self, data):
+        obj = pickle.loads(data)
+        if isinstance(obj, dict):  # written by scrapy.squeues.Pickle*DiskQueue
+            return request_from_dict(obj, spider=self.spider)
+        url, diff = obj
+        d = apply_diff(self._template(url), diff)
+        d['url'] = url
+        return request_from_dict(d, spider=self.spider)
+
+    def _template(self, url):
+        """ Request dict of ``spider.make_request(url)`` without the url.
+        It is built only once, and copied with the url put into splash args.
+        """
+        if self._base_template is None:
+            d = request_to_dict(
+                self.spider.make_request('http://example.com'), self.spider)
+            del d['url']
+            self._base_template = d
+        d = deepcopy(self._base_template)
+        splash_args = d['meta'].get('splash', {}).get('args')
+        if splash_args is not None and 'url' in splash_args:
+            splash_args['url'] = url
+        return d
+
+
+_SET, _PATCH, _DELETE = 0, 1, 2
+
+
+def dict_diff(d, template):
+    """ Return a diff to get d from template, with nested dicts
+    diffed recursively.
+
+    >>> dict_diff({'a': 1, 'b': {'c': 2, 'd': 3}}, {'a': 1, 'b': {'c': 2}})
+    {'b': (1, {'d': (0, 3)})}
+    >>> dict_diff({}, {'a': 1})
+    {'a': (2,)}
+    """
+    diff = {}
+    for key, value in d.items():
+        if key not in template:
+            diff[key] = (_SET, value)
+        elif value != template[key]:
+            if isinstance(value, dict) and isinstance(template[key], dict):
+                diff[key] = (_PATCH, dict_diff(value, template[key]))
+            else:
+                diff[key] = (_SET, value)
+    for key in template:
+        if key not in d:
+            diff[key] = (_DELETE,)
+    return diff
+
+
+def apply_diff(template, diff):
+    """ Apply diff returned by dict_diff to template (template is modified).
+
+    >>> apply_diff({'a': 1, 'b': {'c': 2}}, {'b': (1, {'d': (0, 3)})})
+    {'a': 1, 'b': {'c': 2, 'd': 3}}
+    """
+    for key, change in diff.items():
+        if change[0] == _SET:
+            template[key] = change[1]
+        elif change[0] == _PATCH:
+            apply_diff(template[key], change[1])
+        else:
+            del template[key]
+    return template
+
+
+def _compact_queue(queue_class):
+
+    class CompactRequestQueue(queue_class):
+
+        def __init__(self, crawler, key):
+            self.codec = CompactRequestCodec(crawler.spider, crawler.stats)
+            dirname = os.path.dirname(key)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            super().__init__(key)
+
+        @classmethod
+        def from_crawler(cls, crawler, key, *args, **kwargs):
+            return cls(crawler, key)
+
+        def push(self, request):
+            super().push(self.codec.encode(request))
+
+        def pop(self):
+            data = super().pop()
+            if data:
+                return self.codec.decode(data)
+
+        def peek(self):
+            try:
+                data = super().peek()
+            except AttributeError:
+                raise NotImplementedError(
+                    'The underlying queue class does not implement "peek"')
+            if data:
+                return self.codec.decode(data)
+
+    return CompactRequestQueue
+
+
+CompactFifoDiskQueue = _compact_queue(queue.FifoDiskQueue)
+CompactLifoDiskQueue = _compact_queue(queue.LifoDiskQueue)
@@ -0,0 +1,74 @@
+import time
+
+
+class StageTimer:
+    """ Measure time spent in hot-path stages, and record it in Scrapy stats
+    if ``STAGE_TIMING_ENABLED`` is set::
+
+        with stage_timer('parse/forms'):
+            forms = extract_forms(html)
+
+    For each stage, ``timing/<stage>/count`` and ``timing/<stage>/total_ms``
+    are recorded, along with a latency histogram:
+    ``timing/<stage>/le_<N>ms`` counts calls that took at most N ms
+    (and more than the previous bucket), ``timing/<stage>/gt_<N>ms``
+    counts calls slower than the last bucket.
+    When disabled, a shared no-op context manager is returned.
+    """
+    buckets_ms = (1, 5, 10, 50, 100, 500, 1000)
+
+    def __init__(self, stats=None, enabled=False):
+        self.stats = stats
+        self.enabled = enabled and stats is not None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler is None:
+            return cls()
+        return cls(stats=crawler.stats,
+                   enabled=crawler.settings.getbool('STAGE_TIMING_ENABLED'))
+
+    def __call__(self, stage):
+        if not self.enabled:
+            return _NOOP
+        return _StageContext(self, stage)
+
+    def record(self, stage, seconds):
+        ms = seconds * 1000
+        prefix = 'timing/{}/'.format(stage)
+        self.stats.inc_value(prefix + 'count')
+        self.stats.inc_value(prefix + 'total_ms', ms)
+        for bucket in self.buckets_ms:
+            if ms <= bucket:
+                self.stats.inc_value('{}le_{}ms'.format(prefix, bucket))
+                break
+        else:
+            self.stats.inc_value(
+                '{}gt_{}ms'.format(prefix, self.buckets_ms[-1]))
+
+
+class _StageContext:
+    __slots__ = ['timer', 'stage', 'start']
+
+    def __init__(self, timer, stage):
+        self.timer = timer
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.timer.record(self.stage, time.perf_counter() - self.start)
+
+
+class _NoopContext:
+    __slots__ = []
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NOOP = _NoopContext()
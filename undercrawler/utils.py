@@ -1,4 +1,9 @@
-import os.path
+from collections import OrderedDict
+import os
+import resource
+import sys
+
+from scrapy.utils.url import canonicalize_url
 
 
 def cached_property(name):
@@ -21,3 +26,77 @@ def load_directive(filename):
 
 def using_splash(settings):
     return bool(settings.get('SPLASH_URL'))
+
+
+def body_text(selector):
+    """ Text of the page body, for a Selector or a TextResponse
+    (using its already parsed selector).
+    The same as maybedont.scrapy_middleware.extract_text.
+    """
+    return '\n'.join(selector.xpath('//body').xpath('string()').extract())
+
+
+def rss_bytes():
+    """ Resident memory size of the current process.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Peak instead of current memory use on systems without /proc
+        return max_rss_bytes()
+
+
+def max_rss_bytes():
+    """ Peak resident memory size of the current process.
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class UrlCache:
+    """ A bounded LRU cache of canonical urls, shared by the spider and
+    the dupefilter of one crawler (see ``from_crawler``): the same
+    navigation links are found on every page of a site,
+    and ``canonicalize_url`` is slow.
+    Setting maxsize to 0 disables caching.
+    """
+    default_maxsize = 2**16
+
+    def __init__(self, maxsize=default_maxsize):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._cache = OrderedDict()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """ Return the cache of this crawler, creating it on first call.
+        """
+        cache = getattr(crawler, '_url_cache', None)
+        if cache is None:
+            cache = crawler._url_cache = cls(crawler.settings.getint(
+                'URL_CACHE_SIZE', cls.default_maxsize))
+        return cache
+
+    def canonicalize_url(self, url, keep_fragments=False):
+        if not self.maxsize:
+            return canonicalize_url(url, keep_fragments=keep_fragments)
+        key = (url, keep_fragments)
+        try:
+            canonical = self._cache[key]
+        except KeyError:
+            self.misses += 1
+            canonical = self._cache[key] = \
+                canonicalize_url(url, keep_fragments=keep_fragments)
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        else:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        return canonical
+
+    def record_stats(self, stats):
+        stats.set_value('url_cache/hits', self.hits)
+        stats.set_value('url_cache/misses', self.misses)
+        stats.set_value('url_cache/size', len(self._cache))